@@ -0,0 +1,248 @@
+import argparse
+import itertools
+import platform
+import tempfile
+import datetime
+import json
+import time
+import sys
+import os
+import subprocess
+
+"""
+Benchmarks of `infer` over the sample programs of privugger/test.
+
+Every configuration (program, method, draws, chains, num_elements, with or without an observation) runs
+in a fresh python process, so its peak memory and its import and lifting costs are its own. The results
+are written as one JSON document with the commit, the environment and one entry per run:
+
+- "seconds": wall-clock time of `infer`
+- "throughput": samples (draws times chains) per second of `infer`
+- "sampling_throughput": samples per second of the sampling phase alone
+- "compile_seconds": time from the start of pm.sample until its first draw, i.e., theano compilation and set-up
+- "phases": seconds per phase, as reported by privugger.inference.profiling
+- "peak_rss": peak resident set size in bytes
+
+Usage, from the root of the repository:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --quick --compare results.json
+
+With `--compare` the runs are matched by configuration with a previous result file, and the command
+fails if the throughput of any run dropped by more than `--threshold`, or if the import time of privugger
+grew by more than `--import-threshold`.
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#NOTE program: (file, input specs (name, mu, std), output, observation, takes num_elements)
+PROGRAMS = {
+    "alpha":          ("privugger/test/alpha.py",          [("age", 55.2, 3.5)],                       "Float", "57>output>56", True),
+    "addition":       ("privugger/test/addition.py",       [("age", 55.2, 3.5), ("height", 170, 10)],  "Float", "output>230",   False),
+    "multiplication": ("privugger/test/multiplication.py", [("age", 55.2, 3.5), ("height", 170, 10)],  "Float", "output>9500",  False),
+    "identity":       ("privugger/test/identity.py",       [("age", 55.2, 3.5)],                       "Float", "output>56",    False),
+}
+
+METHODS = ["pymc3", "scipy"]
+
+QUICK = {"draws": [200], "chains": [1], "num_elements": [10]}
+FULL  = {"draws": [500, 2000], "chains": [1, 2], "num_elements": [10, 100]}
+
+
+def configurations(programs, methods, draws, chains, num_elements, observed):
+    """
+    Returns the list of configurations of a sweep. The scipy backend has no chains and no observations, and only
+    programs over vectors sweep num_elements
+    """
+    configs = []
+    for program, method in itertools.product(programs, methods):
+        vector = PROGRAMS[program][4]
+        for d, c, n, o in itertools.product(draws, chains if method == "pymc3" else [1], num_elements if vector else [-1],
+                                            observed if method == "pymc3" else [False]):
+            configs.append({"program": program, "method": method, "draws": d, "chains": c, "num_elements": n, "observed": o})
+    #NOTE the same configuration can come from several values that do not apply to it
+    unique = []
+    for config in configs:
+        if(config not in unique):
+            unique.append(config)
+    return unique
+
+
+def run_one(config, cores=1, seed=0):
+    """
+    Runs one configuration in this process and returns its result
+    """
+    start = time.perf_counter()
+    import privugger as pv
+    from privugger.inference import profiling
+    import_seconds = time.perf_counter() - start
+
+    path, specs, output, observation, vector = PROGRAMS[config["program"]]
+    n = config["num_elements"]
+    inputs = [pv.Normal(name, mu=mu, std=std, num_elements=n) for name, mu, std in specs]
+    prog = pv.Program("output", dataset=pv.Dataset(input_specs=inputs), output_type=getattr(pv, output), function=os.path.join(ROOT, path))
+    if(config["observed"]):
+        prog.add_observation(observation, precision=0.5)
+
+    events = []
+    with pv.profile(events.append):
+        begin = time.perf_counter()
+        trace = pv.infer(prog, method=config["method"], draws=config["draws"], chains=config["chains"], cores=cores, random_seed=seed)
+        seconds = time.perf_counter() - begin
+
+    phases = {}
+    for event in events:
+        if(event["event"] == "phase"):
+            phases[event["phase"]] = phases.get(event["phase"], 0.0) + event["seconds"]
+    samples = config["draws"] * config["chains"]
+    return {**config,
+            "cores": cores,
+            "sampler": trace.posterior.attrs.get("sampler", "mcmc" if config["method"] == "pymc3" else "scipy"),
+            "samples": samples,
+            "seconds": seconds,
+            "throughput": samples / seconds,
+            "sampling_throughput": samples / phases["sample"] if phases.get("sample") else None,
+            "compile_seconds": phases.get("compile"),
+            "import_seconds": import_seconds,
+            "phases": phases,
+            "peak_rss": profiling.peak_rss()}
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import numpy, scipy, pymc3, theano, arviz
+    return {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(),
+            "cpus": os.cpu_count(), "numpy": numpy.__version__, "scipy": scipy.__version__, "pymc3": pymc3.__version__,
+            "theano": theano.__version__, "arviz": arviz.__version__}
+
+
+def run_all(configs, repeat=1, cores=1, cold=False, verbose=True):
+    """
+    Runs every configuration `repeat` times, each in a fresh process
+    """
+    results = []
+    for config in configs:
+        for _ in range(repeat):
+            env = dict(os.environ)
+            env["PYTHONPATH"] = os.pathsep.join([ROOT] + [p for p in [env.get("PYTHONPATH")] if p])
+            with tempfile.TemporaryDirectory() as compiledir:
+                if(cold):
+                    #NOTE an empty compiledir makes the run pay the full theano compilation
+                    env["THEANO_FLAGS"] = ",".join([f for f in [env.get("THEANO_FLAGS"), f"compiledir={compiledir}"] if f])
+                #NOTE pymc3 prints its progress to stdout, so the result is written to a file
+                path = os.path.join(compiledir, "result.json")
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(config), "--result", path,
+                                      "--cores", str(cores)], env=env, cwd=ROOT, capture_output=True, text=True)
+                if(out.returncode != 0):
+                    result = {**config, "error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f"exit code {out.returncode}"}
+                else:
+                    with open(path) as f:
+                        result = json.load(f)
+            results.append(result)
+            if(verbose):
+                label = " ".join(f"{k}={config[k]}" for k in ["program", "method", "draws", "chains", "num_elements", "observed"])
+                status = result["error"] if "error" in result else f"{result['seconds']:.2f}s {result['throughput']:.0f} samples/s"
+                print(f"{label}: {status}", file=sys.stderr, flush=True)
+    return results
+
+
+def _key(result):
+    return tuple(result.get(k) for k in ["program", "method", "draws", "chains", "num_elements", "observed", "cores"])
+
+
+def compare(results, baseline, threshold, import_threshold=0.5):
+    """
+    Matches the runs of two result documents by configuration
+
+    Returns
+    -----------
+    List of dicts with the configuration, the mean throughput of both and their ratio, and whether it regressed by
+    more than the threshold. The last dict compares the import time of privugger over all runs, and whether it grew by
+    more than import_threshold
+    """
+    def means(runs):
+        groups = {}
+        for run in runs:
+            if("error" not in run):
+                groups.setdefault(_key(run), []).append(run["throughput"])
+        return {key: sum(values) / len(values) for key, values in groups.items()}
+    new, old = means(results), means(baseline["results"])
+    rows = []
+    for key in new:
+        if(key in old):
+            ratio = new[key] / old[key]
+            rows.append({"config": dict(zip(["program", "method", "draws", "chains", "num_elements", "observed", "cores"], key)),
+                         "throughput": new[key], "baseline": old[key], "ratio": ratio, "regressed": ratio < 1 - threshold})
+
+    def import_seconds(runs):
+        #NOTE every run imports privugger in a fresh process, the fastest import is the least disturbed by the machine
+        return min([run["import_seconds"] for run in runs if "error" not in run and run.get("import_seconds") is not None], default=None)
+    new, old = import_seconds(results), import_seconds(baseline["results"])
+    if(new is not None and old):
+        ratio = new / old
+        rows.append({"config": "import", "import_seconds": new, "baseline": old, "ratio": ratio, "regressed": ratio > 1 + import_threshold})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks infer over the sample programs of privugger/test")
+    parser.add_argument("--programs", nargs="+", choices=list(PROGRAMS), default=list(PROGRAMS))
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=METHODS)
+    parser.add_argument("--draws", nargs="+", type=int)
+    parser.add_argument("--chains", nargs="+", type=int)
+    parser.add_argument("--num-elements", nargs="+", type=int)
+    parser.add_argument("--observed", nargs="+", choices=["no", "yes"], default=["no", "yes"],
+                        help="run the pymc3 method without the observation (forward sampling), with it (MCMC), or both")
+    parser.add_argument("--quick", action="store_true", help="small sweep, for a quick check")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per configuration")
+    parser.add_argument("--cores", type=int, default=1, help="cores of pm.sample")
+    parser.add_argument("--cold", action="store_true", help="run every configuration with an empty theano compiledir")
+    parser.add_argument("--output", help="file for the JSON results, stdout by default")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare the throughput with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="largest accepted drop of throughput, default 0.2")
+    parser.add_argument("--import-threshold", type=float, default=0.5,
+                        help="largest accepted growth of the import time of privugger, default 0.5")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if(args.run_one is not None):
+        result = run_one(json.loads(args.run_one), cores=args.cores)
+        with open(args.result, "w") as f:
+            json.dump(result, f)
+        return 0
+
+    sweep = QUICK if args.quick else FULL
+    configs = configurations(args.programs, args.methods, args.draws or sweep["draws"], args.chains or sweep["chains"],
+                             args.num_elements or sweep["num_elements"], [o == "yes" for o in args.observed])
+    started = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    results = run_all(configs, repeat=args.repeat, cores=args.cores, cold=args.cold)
+    document = {"commit": _commit(), "started": started, "environment": environment(), "cold": args.cold, "results": results}
+
+    status = 1 if any("error" in r for r in results) else 0
+    if(args.compare is not None):
+        with open(args.compare) as f:
+            document["comparison"] = compare(results, json.load(f), args.threshold, args.import_threshold)
+        for row in document["comparison"]:
+            flag = "REGRESSED" if row["regressed"] else "ok"
+            print(f"{row['config']}: {row['ratio']:.2f}x {flag}", file=sys.stderr)
+        if(any(row["regressed"] for row in document["comparison"])):
+            status = 1
+
+    text = json.dumps(document, indent=2)
+    if(args.output is None):
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,33 @@
 """
 The privugger package
+
+The public names are imported from their modules when they are first used, so `import privugger`
+does not import pymc3, theano or arviz until an analysis needs them.
 """
 
-from privugger.transformer import *
-from privugger.measures import *
-from privugger.inference import * 
-from privugger.distributions import * 
-from privugger.data_structures import * 
+from privugger.lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    "privugger.distributions.continuous":       ["Continuous", "Uniform", "Normal", "Exponential", "Beta"],
+    "privugger.distributions.discrete":         ["Discrete", "Bernoulli", "Categorical", "Binomial", "DiscreteUniform", "Geometric", "Constant"],
+    "privugger.data_structures.dataset":        ["Dataset"],
+    "privugger.data_structures.program":        ["Program"],
+    "privugger.transformer.PyMC3.program_output": ["Int", "Float", "List", "Matrix"],
+    "privugger.transformer.PyMC3.theano_types": ["TheanoToken", "set_precision", "get_precision", "use_precision", "float_dtype"],
+    "privugger.transformer.PyMC3.type_decoration": ["FunctionTypeDecorator"],
+    "privugger.transformer.PyMC3.lifted":       ["lift_program", "lift_cache_info", "lift_cache_clear"],
+    "privugger.transformer.PyMC3.symbolic":     ["compile_program", "UnsupportedConstruct"],
+    "privugger.transformer.PyMC3.op_stats":     ["instrument_ops", "set_op_instrumentation", "op_stats", "reset_op_stats", "OpStats"],
+    "privugger.measures.mutual_information":    ["mi_sklearn", "mi_binned"],
+    "privugger.inference.inference":            ["infer", "infer_batch", "extend", "concatenate", "stack", "get_model", "sample_prior"],
+    "privugger.inference.scipy_backend":        ["infer_scipy", "infer_scipy_batch", "infer_stream", "load_samples"],
+    "privugger.inference.exact":                ["infer_exact", "ExactResult"],
+    "privugger.inference.session":              ["AnalysisSession", "current_session"],
+    "privugger.inference.pool":                 ["SamplerPool"],
+    "privugger.inference.memmap_trace":         ["sample_memmap"],
+    "privugger.inference.continuation":         ["SampleRun", "forward_sample", "sample_until_converged", "sample_draws"],
+    "privugger.inference.warmup":               ["warm_up", "WarmUpRun"],
+    "privugger.inference.profiling":            ["profile", "add_sink", "remove_sink", "JSONLinesSink", "LoggingSink"],
+    "privugger.inference.result_cache":         ["ResultCache", "ResultCacheInfo", "set_result_cache"],
+    "privugger.inference.sweeps":               ["sweep"],
+}, fallback=["privugger.transformer", "privugger.measures", "privugger.inference", "privugger.distributions", "privugger.data_structures"])
@@ -1,12 +1,14 @@
-from hypothesis import settings, given, Phase, HealthCheck, strategies as st
 import numpy as np
-import pymc3 as pm
+from privugger.lazy import lazy_import
 from privugger.attacker.generators import IntGenerator, IntList, FloatGenerator, FloatList, DiscreteUniform, Uniform
 from privugger.attacker.metrics import SimulationMetrics
 from sklearn.feature_selection import mutual_info_regression
 import typing
 import inspect
 
+hypothesis = lazy_import("hypothesis")
+pm         = lazy_import("pymc3")
+
 """
 The data privacy debugger, PRIVUGER, is a privacy risk analysis tool.
 """
@@ -59,8 +61,8 @@ def simulate(function, *args, **kwargs) -> SimulationMetrics:
         logger.setLevel(logging.ERROR)
         logger.propagate = False
 
-    @settings(max_examples=max_examples, deadline=None, phases=[Phase.generate], suppress_health_check=[HealthCheck.too_slow, HealthCheck.filter_too_much])
-    @given(st.data())
+    @hypothesis.settings(max_examples=max_examples, deadline=None, phases=[hypothesis.Phase.generate], suppress_health_check=[hypothesis.HealthCheck.too_slow, hypothesis.HealthCheck.filter_too_much])
+    @hypothesis.given(hypothesis.strategies.data())
     def helper(data):
 
         def parse(argument, islist=False, istuple=False, parameter_pos=0, ranges=ranges):
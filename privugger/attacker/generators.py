@@ -1,13 +1,15 @@
 """
 Probability distributions generators
 """
-import pymc3 as pm
-import pymc3.distributions as dist
 from privugger.attacker.distributions import *
-from hypothesis import strategies as st
+from privugger.lazy import lazy_import
 import numpy as np
 import scipy
 
+pm   = lazy_import("pymc3")
+dist = lazy_import("pymc3.distributions")
+st   = lazy_import("hypothesis.strategies")
+
 def IntList(name, data, length=1, possible_dist=POSSIBLE_INTS, ranges=(0, np.inf)):
     """
     Generates a list of probabilistics distributions to mimic all possible int values
@@ -1,10 +1,12 @@
-import matplotlib.pyplot as plt
 from sklearn.feature_selection import mutual_info_regression
 import numpy as np
-import pymc3 as pm
 import scipy.stats as st
 import pickle 
 import datetime
+from privugger.lazy import lazy_import
+
+plt = lazy_import("matplotlib.pyplot")
+pm  = lazy_import("pymc3")
 
 class SimulationMetrics:
     """
@@ -1,2 +1,6 @@
-from privugger.data_structures.dataset import *
-from privugger.data_structures.program import *
+from privugger.lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    "privugger.data_structures.dataset": ["Dataset"],
+    "privugger.data_structures.program": ["Program"],
+}, fallback=["privugger.data_structures.dataset", "privugger.data_structures.program"])
@@ -1,10 +1,12 @@
 from privugger.data_structures.dataset import *
 import re
-import pymc3 as pm
+from privugger.lazy import lazy_import
+
+pm = lazy_import("pymc3")
 
 class Program:
 
-    def __init__(self, name, dataset, output_type, function):
+    def __init__(self, name, dataset, output_type, function, precision=None):
         """
         A class representing the privacy preserving program to be analysed.
 
@@ -13,12 +15,15 @@ class Program:
         dataset: the dataset of type privugger.Dataset containg the values used in the program
         output_type: the output type specified as Int, Float, List(Int), List(Float)
         program: The program to be analysed, either string to location program, lambda method or def function
+        precision: String with the precision policy of the analysis, "double" or "single". Default None, i.e., the
+        policy set by privugger.set_precision
         """
         if isinstance(dataset, Dataset):
             self.dataset              = dataset
             self.output_type          = output_type
             self.name                 = name
             self.program              = function
+            self.precision            = precision
             self.observation          = None
             self.execute_observations = lambda a,b: None
         else:
@@ -103,11 +108,20 @@ class Program:
                 partial1(distribution)
                 partial2(distribution)
             self.execute_observations = inner
+            self.observation = (constraints, precision)
             return None # to avoid having a return value
         else:
             raise ValueError("Observation was not known. Make sure that the name is part of the names in privugger.Datastructure")
 
 
+    def has_observations(self):
+        """
+        Returns
+        ------------
+        True if an observation was added with `add_observation`
+        """
+        return self.observation is not None
+
     def _unwrap_constrain(self, value, cons, precision, i=0):
         if not i % 2:
             cons = cons.replace(">", "<")
@@ -1,2 +1,6 @@
-from privugger.distributions.discrete import *
-from privugger.distributions.continuous import *
+from privugger.lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    "privugger.distributions.discrete":   ["Bernoulli", "Categorical", "Binomial", "DiscreteUniform", "Geometric", "Constant"],
+    "privugger.distributions.continuous": ["Uniform", "Normal", "Exponential", "Beta"],
+}, fallback=["privugger.distributions.discrete", "privugger.distributions.continuous"])
@@ -1,6 +1,9 @@
-import pymc3 as pm
+from privugger.lazy import lazy_import
 from scipy import stats as st
 from abc import abstractmethod
+
+pm = lazy_import("pymc3")
+
 """
 By specifying our own interface for distributions we could ideally hide which specific backend is used to model the distributions
 """
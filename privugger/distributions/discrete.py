@@ -1,8 +1,13 @@
 
 
-import pymc3 as pm
+from privugger.lazy import lazy_import
+import numpy as np
 from scipy import stats as st
 from abc import abstractmethod
+from privugger.transformer.PyMC3.theano_types import int_dtype, is_shared
+
+pm = lazy_import("pymc3")
+
 """
 By specifying our own interface for distributions we could ideally hide which specific backend is used to model the distributions
 
@@ -25,6 +30,24 @@ class Discrete():
     def scipy_dist(self, name):
         return None
 
+    def exact_dist(self):
+        """
+        Returns the finite support of one element of the distribution as a tuple (values, probabilities)
+        of numpy arrays, or None if the support is not finite
+        """
+        return None
+
+    #NOTE pymc3 samples Bernoulli and Categorical priors with Gibbs steps, and the others with Metropolis
+    gibbs = False
+
+    def pymc3_dtype(self, hypers=[]):
+        """
+        Returns the integer dtype of the pymc3 variable under the precision policy in use. Priors with hyper
+        parameters or shared parameters have no fixed support, so they are int64
+        """
+        support = None if hypers or any(is_shared(p) for p in self.get_params()) else self.exact_dist()
+        return int_dtype(None if support is None else support[0], gibbs=self.gibbs)
+
 
 __all__ = [
 
@@ -54,6 +77,8 @@ class Bernoulli(Discrete):
     
     """
 
+    gibbs = True
+
     def __init__(self,name, p=0.5, num_elements=-1, is_hyper_param=False):
 
 
@@ -70,9 +95,9 @@ class Bernoulli(Discrete):
                 p = hyper_dist.pymc3_dist(hyper_name, [])
 
         if(self.num_elements==-1):
-            return pm.Bernoulli(name, p=p)
+            return pm.Bernoulli(name, p=p, dtype=self.pymc3_dtype(hypers))
         else:
-            return pm.Bernoulli(name, p=p, shape=self.num_elements)
+            return pm.Bernoulli(name, p=p, shape=self.num_elements, dtype=self.pymc3_dtype(hypers))
 
     def get_params(self):
         return [self.p]
@@ -81,6 +106,9 @@ class Bernoulli(Discrete):
         dist = (lambda siz : st.bernoulli(p=self.p).rvs(siz)) if self.num_elements == -1 else (lambda siz: st.bernoulli(p=self.p).rvs((self.num_elements, siz)))
         return name,dist
 
+    def exact_dist(self):
+        return np.array([0, 1]), np.array([1 - self.p, self.p])
+
 
 
 class Categorical(Discrete):
@@ -101,8 +129,8 @@ class Categorical(Discrete):
    
     """
 
+    gibbs = True
 
-    
     def __init__(self, name, p=None, num_elements=-1, is_hyper_param=False):
 
         if (p==None):
@@ -122,9 +150,9 @@ class Categorical(Discrete):
             p = hyper_dist.pymc3_dist(hyper_name, [])
             
         if(self.num_elements==-1):
-            return pm.Categorical(name, p=p)
+            return pm.Categorical(name, p=p, dtype=self.pymc3_dtype(hypers))
         else:
-            return pm.Categorical(name, p=p, shape=self.num_elements)
+            return pm.Categorical(name, p=p, shape=self.num_elements, dtype=self.pymc3_dtype(hypers))
 
     def get_params(self):
         return [self.p]
@@ -134,6 +162,9 @@ class Categorical(Discrete):
         dist = (lambda siz : st.rv_discrete(values=(range(len(theta)), theta)).rvs(siz)) if self.num_elements == -1 else (lambda siz: st.rv_discrete(values=(range(len(theta)), theta)).rvs((self.num_elements, siz)))
         return name, dist
 
+    def exact_dist(self):
+        return np.arange(len(self.p)), np.asarray(self.p, dtype=float)
+
 
 class Binomial(Discrete):
 
@@ -187,9 +218,9 @@ class Binomial(Discrete):
 
 
         if(self.num_elements==-1):
-            return pm.Binomial(name, n=n, p=p)
+            return pm.Binomial(name, n=n, p=p, dtype=self.pymc3_dtype(hypers))
         else:
-            return pm.Binomial(name, n=n, p=p, shape=self.num_elements)
+            return pm.Binomial(name, n=n, p=p, shape=self.num_elements, dtype=self.pymc3_dtype(hypers))
 
     def get_params(self):
         return [self.n, self.p]
@@ -198,6 +229,10 @@ class Binomial(Discrete):
         dist = (lambda siz : st.binom(n=self.n, p=self.p).rvs(siz)) if self.num_elements == -1 else (lambda siz: st.binom(n=self.n, p=self.p).rvs((self.num_elements, siz)))
         return name, dist
 
+    def exact_dist(self):
+        values = np.arange(self.n + 1)
+        return values, st.binom(n=self.n, p=self.p).pmf(values)
+
 class DiscreteUniform(Discrete):
 
     """
@@ -249,9 +284,9 @@ class DiscreteUniform(Discrete):
 
 
         if(self.num_elements==-1):
-            return pm.DiscreteUniform(name, lower=lower, upper=upper)
+            return pm.DiscreteUniform(name, lower=lower, upper=upper, dtype=self.pymc3_dtype(hypers))
         else:
-            return pm.DiscreteUniform(name, lower=lower, upper=upper, shape=self.num_elements)
+            return pm.DiscreteUniform(name, lower=lower, upper=upper, shape=self.num_elements, dtype=self.pymc3_dtype(hypers))
 
     def get_params(self):
         return [self.lower, self.upper]
@@ -260,6 +295,11 @@ class DiscreteUniform(Discrete):
         dist = (lambda siz : st.randint(lower=self.lower, upper=self.upper).rvs(siz)) if self.num_elements == -1 else (lambda siz: st.randint(lower=self.lower, upper=self.upper).rvs((self.num_elements, siz)))
         return name, dist
 
+    def exact_dist(self):
+        #NOTE the upper bound is inclusive, as in pymc3
+        values = np.arange(self.lower, self.upper + 1)
+        return values, np.full(len(values), 1 / len(values))
+
 class Geometric(Discrete):
 
     """
@@ -294,9 +334,9 @@ class Geometric(Discrete):
             p = hyper_dist.pymc3_dist(hyper_name, [])
 
         if(self.num_elements==-1):
-            return pm.Geometric(name, p=p)
+            return pm.Geometric(name, p=p, dtype=self.pymc3_dtype(hypers))
         else:
-            return pm.Geometric(name, p=p, shape=self.num_elements)
+            return pm.Geometric(name, p=p, shape=self.num_elements, dtype=self.pymc3_dtype(hypers))
         
     def get_params(self):
         return [self.p]
@@ -340,15 +380,19 @@ class Constant(Discrete):
             hyper_name = hypers[0][1]
             val = hyper_dist.pymc3_dist(hyper_name, [])
         if(self.num_elements==-1):
-            return pm.ConstantDist(name, self.val)
+            return pm.ConstantDist(name, self.val, dtype=self.pymc3_dtype(hypers))
         else:
-            return pm.ConstantDist(name, self.val, shape=self.num_elements)
+            return pm.ConstantDist(name, self.val, shape=self.num_elements, dtype=self.pymc3_dtype(hypers))
 
     def get_params(self):
         return [self.val]
     
     def scipy_dist(self, name):
-        return lambda siz: np.array([self.val for _ in range(siz)])
+        dist = (lambda siz : np.full(siz, self.val)) if self.num_elements == -1 else (lambda siz: np.full((self.num_elements, siz), self.val))
+        return name, dist
+
+    def exact_dist(self):
+        return np.array([self.val]), np.array([1.0])
 
 
 
@@ -1 +1,15 @@
-from privugger.inference.inference import *
+from privugger.lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    "privugger.inference.inference":     ["infer", "infer_batch", "extend", "concatenate", "stack", "get_model", "sample_prior"],
+    "privugger.inference.scipy_backend": ["infer_scipy", "infer_scipy_batch", "infer_stream", "load_samples"],
+    "privugger.inference.exact":         ["infer_exact", "ExactResult"],
+    "privugger.inference.session":       ["AnalysisSession", "current_session"],
+    "privugger.inference.pool":          ["SamplerPool"],
+    "privugger.inference.memmap_trace":  ["sample_memmap"],
+    "privugger.inference.continuation":  ["SampleRun", "forward_sample", "sample_until_converged", "sample_draws"],
+    "privugger.inference.warmup":        ["warm_up", "WarmUpRun"],
+    "privugger.inference.profiling":     ["profile", "add_sink", "remove_sink", "JSONLinesSink", "LoggingSink"],
+    "privugger.inference.result_cache":  ["ResultCache", "ResultCacheInfo", "set_result_cache"],
+    "privugger.inference.sweeps":        ["sweep"],
+}, fallback=["privugger.inference.inference"])
@@ -0,0 +1,534 @@
+from privugger.transformer.PyMC3.theano_types import unlocking_callback
+from pymc3.theanof import continuous_types
+import pymc3 as pm
+import theano
+import numpy as np
+import warnings
+import weakref
+import json
+import time
+import os
+import arviz as az
+import xarray as xr
+
+"""
+Sampling of a model in segments. A run keeps the state needed to continue sampling where the
+previous segment stopped: the last point of every chain and the tuned step methods.
+
+The tuned state of the samplers lives in the worker processes of `pm.sample`, so it is rebuilt
+from the trace: NUTS gets a diagonal mass matrix from the variance of the samples and the step
+size it ended its tuning with, Metropolis gets the scaling it ended its tuning with, and Slice gets
+widths from the standard deviation of the samples. Other step methods that tune their parameters,
+e.g. DEMetropolis, continue with the parameters they are created with, with a warning.
+"""
+
+
+def segment_seeds(entropy, segment, chains):
+    """
+    Returns the seeds of the chains for one segment of a run
+
+    Parameters
+    -----------
+    entropy: Int entropy of the run
+
+    segment: Int index of the segment
+
+    chains: Int number of chains
+    """
+    #NOTE the seeds of a segment only depend on the entropy and the index, so a resumed run draws the same numbers
+    seq = np.random.SeedSequence(entropy, spawn_key=(segment,))
+    #NOTE theano's random streams in the worker processes of pm.sample only take seeds below 2**31 - 21069
+    return [int(s) for s in seq.generate_state(chains) >> 2]
+
+
+#NOTE the functions of forward_sample per model and variables, so that a model sampled again, e.g., by sweep, is not compiled again
+_forward_functions = weakref.WeakKeyDictionary()
+
+
+def forward_sample(model, draws, chains, random_seed=None, var_names=None):
+    """
+    Draws samples by ancestral sampling through the priors and the program. This is exact when
+    there are no observations, since then the posterior equals the prior
+
+    Parameters
+    -------------
+    model : PyMC3 model without observed variables
+
+    draws : int number of draws per chain
+
+    chains : int number of chains
+
+    random_seed : int seed for the random number generator
+
+    var_names : list with the names of the variables to keep. Default None, i.e., all variables
+
+    Returns
+    ------------
+    Arviz InferenceData with the same posterior layout as `pm.sample`
+    """
+    variables = pm.util.get_default_varnames(model.unobserved_RVs, include_transformed=False)
+    names = var_names
+    if(names is None):
+        names = [v.name for v in variables]
+    #NOTE pymc3 squeezes the samples of priors with one element, which the lifted program then rejects. The priors
+    #are sampled first and reshaped, and the deterministics are evaluated on them draw by draw
+    priors = [v for v in variables if hasattr(v, "distribution")]
+    samples = pm.sample_prior_predictive(samples=draws*chains, model=model, var_names=[v.name for v in priors], random_seed=random_seed)
+    values = {v.name: np.asarray(samples[v.name], dtype=v.dtype).reshape((draws*chains,) + tuple(v.tag.test_value.shape)) for v in priors}
+    deterministics = [model.named_vars[name] for name in names if name not in values]
+    if(deterministics):
+        key = tuple(v.name for v in priors + deterministics)
+        evaluate = _forward_functions.setdefault(model, {}).get(key)
+        if(evaluate is None):
+            with model:
+                evaluate = _forward_functions[model][key] = theano.function(priors, deterministics, on_unused_input="ignore")
+        evaluated = [evaluate(*[values[v.name][i] for v in priors]) for i in range(draws*chains)]
+        for j, v in enumerate(deterministics):
+            values[v.name] = np.stack([np.asarray(e[j], dtype=v.dtype) for e in evaluated])
+    posterior = {}
+    for name in names:
+        posterior[name] = values[name].reshape((chains, draws) + values[name].shape[1:])
+    trace = az.from_dict(posterior=posterior)
+    trace.posterior.attrs["sampler"] = "forward"
+    return trace
+
+
+def free_values(model, trace):
+    """
+    Collects the samples of the free variables of a model, as seen by the samplers
+
+    Parameters
+    -----------
+    model: PyMC3 model
+
+    trace: PyMC3 MultiTrace or Arviz InferenceData sampled from the model
+
+    Returns
+    -----------
+    dict from the names of the free variables to numpy arrays with shape (chains, draws, ...)
+    """
+    if(isinstance(trace, az.InferenceData)):
+        posterior = trace.posterior
+        values = {}
+        for v in model.vars:
+            if(v.name in posterior):
+                values[v.name] = posterior[v.name].values
+                continue
+            #NOTE InferenceData leaves out the transformed variables, so they are computed from the original ones
+            for rv in model.free_RVs:
+                if(getattr(rv, "transformed", None) is v):
+                    values[v.name] = np.asarray(rv.transformation.forward_val(posterior[rv.name].values))
+        return values
+    return {v.name: np.stack([trace.get_values(v.name, chains=c) for c in trace.chains]) for v in model.vars}
+
+
+def tuning(model, values, step_sizes, scalings=None):
+    """
+    Computes the tuned parameters of the step methods from the samples of a run
+
+    Parameters
+    -----------
+    model: PyMC3 model
+
+    values: dict returned by `free_values`
+
+    step_sizes: list with the step size every chain ended its tuning with, or None if the run did not use NUTS
+
+    scalings: array with the scaling every chain ended its tuning with, one column per Metropolis step, or None if
+    the run did not use Metropolis
+
+    Returns
+    -----------
+    dict with the tuned parameters, or None if there are none
+
+    - NUTS: the diagonal of the mass matrix, `scaling`, and the step size, `step_size`
+    - Metropolis: the scaling of every Metropolis step, `metropolis_scaling`
+    - Slice: the width of the slices of every element of every continuous variable, `slice_w:<name>`. Slice does not
+      record the width its tuning ends with, so it is approximated by the standard deviation of the samples
+    """
+    tuned = {}
+    continuous = [v for v in model.vars if v.dtype in continuous_types]
+    if(continuous and step_sizes is not None):
+        samples = np.hstack([np.reshape(values[v.name], values[v.name].shape[:2] + (-1,)) for v in continuous])
+        variance = samples.reshape((-1, samples.shape[-1])).var(axis=0)
+        variance[~(variance > 0)] = 1.0
+        #NOTE every chain ends its tuning with its own step size
+        step_size = np.exp(np.mean(np.log(step_sizes)))
+        tuned.update({"scaling": variance, "step_size": np.asarray(step_size)})
+    elif(continuous):
+        for v in continuous:
+            samples = np.reshape(values[v.name], values[v.name].shape[:2] + (-1,))
+            w = samples.reshape((-1, samples.shape[-1])).std(axis=0)
+            w[~(w > 0)] = 1.0
+            tuned[f"slice_w:{v.name}"] = w
+    if(scalings is not None):
+        scalings = np.reshape(np.asarray(scalings, dtype=float), (len(scalings), -1))
+        tuned["metropolis_scaling"] = np.exp(np.mean(np.log(scalings), axis=0))
+    return tuned or None
+
+
+def _step_sizes(trace):
+    #NOTE after tuning NUTS uses the averaged step size
+    if(isinstance(trace, az.InferenceData)):
+        if("sample_stats" not in trace._groups or "step_size_bar" not in trace.sample_stats):
+            return None
+        return trace.sample_stats["step_size_bar"].values[:, -1]
+    if("step_size_bar" not in trace.stat_names):
+        return None
+    return [trace.get_sampler_stats("step_size_bar", chains=c)[-1] for c in trace.chains]
+
+
+def _scalings(trace):
+    #NOTE Metropolis records the scaling of its proposals, one column per Metropolis step of a compound step
+    if(isinstance(trace, az.InferenceData)):
+        if("sample_stats" not in trace._groups or "scaling" not in trace.sample_stats):
+            return None
+        values = trace.sample_stats["scaling"].values
+        return values.reshape(values.shape[:2] + (-1,))[:, -1]
+    if("scaling" not in trace.stat_names):
+        return None
+    return [np.ravel(trace.get_sampler_stats("scaling", chains=c)[-1]) for c in trace.chains]
+
+
+#NOTE step methods whose tuned parameters are carried over, or that are not tuned
+_CARRIED_OVER = ("NUTS", "Metropolis", "Slice", "BinaryGibbsMetropolis", "CategoricalGibbsMetropolis")
+
+
+def tuned_steps(model, tuned):
+    """
+    Builds step methods for all free variables of a model
+
+    Parameters
+    -----------
+    model: PyMC3 model
+
+    tuned: dict returned by `tuning`, or None
+
+    Returns
+    -----------
+    List of step methods. The continuous variables get a NUTS with the tuned parameters if the run used NUTS, the
+    other variables get the step methods pymc3 assigns to them, with the tuned scaling of Metropolis and the width
+    of Slice. Other step methods that tune their parameters continue untuned, with a warning
+    """
+    steps = []
+    tuned = tuned or {}
+    with model:
+        if("step_size" in tuned):
+            continuous = [v for v in model.vars if v.dtype in continuous_types]
+            scaling = tuned["scaling"]
+            steps.append(pm.NUTS(vars=continuous, scaling=scaling, is_cov=True, step_scale=float(tuned["step_size"]) * scaling.size ** 0.25))
+        step = pm.sampling.assign_step_methods(model, steps or None)
+        methods = list(step) if isinstance(step, list) else [step]
+        #NOTE the steps are assigned in the same order as in the run, so the scalings follow the Metropolis steps
+        scalings = list(np.atleast_1d(tuned.get("metropolis_scaling", [])))
+        for i, method in enumerate(methods):
+            if(type(method) is pm.Metropolis and scalings):
+                #NOTE pm.sample resets the tuning of Metropolis to the scaling it was created with
+                methods[i] = pm.Metropolis(vars=method.vars, scaling=scalings.pop(0))
+            elif(type(method) is pm.Slice and all(f"slice_w:{v.name}" in tuned for v in method.vars)):
+                methods[i] = pm.Slice(vars=method.vars, w=np.concatenate([tuned[f"slice_w:{v.name}"] for v in method.vars]))
+            elif(type(method) in (pm.Metropolis, pm.Slice) or type(method).__name__ not in _CARRIED_OVER):
+                warnings.warn(f"{type(method).__name__} on {[v.name for v in method.vars]} continues the run with untuned parameters")
+    return methods
+
+
+def concat_draws(first, second):
+    """
+    Appends the draws of one InferenceData to another
+
+    Parameters
+    -----------
+    first: Arviz InferenceData
+
+    second: Arviz InferenceData with the same groups, chains and variables
+
+    Returns
+    -----------
+    Arviz InferenceData with the draws of first followed by the draws of second. Groups without draws,
+    e.g. the observed data, and the attributes are taken from first
+    """
+    #NOTE az.concat(dim="draw") of arviz 0.9 puts the draws of the later arguments first
+    groups = {}
+    for group in first._groups_all:
+        data = getattr(first, group)
+        if("draw" in data.dims and group in second._groups_all):
+            data = xr.concat([data, getattr(second, group)], dim="draw")
+            data["draw"] = np.arange(data.dims["draw"])
+            data.attrs = getattr(first, group).attrs
+        groups[group] = data
+    return az.InferenceData(**groups)
+
+
+class SampleRun:
+    """
+    A sampling run that is continued segment by segment
+
+    Attributes
+    -----------
+    model: PyMC3 model
+
+    chains: Int number of chains
+
+    cores: Int number of cores
+
+    entropy: Int entropy from which the seeds of every segment are derived
+
+    tune: Int number of tuning steps of the first segment
+
+    forward: Boolean. Draw independent forward samples instead of running MCMC
+
+    checkpoint_dir: path to a directory. If given, the run is saved there after every segment and can be
+    continued with `SampleRun.load`. Default None
+
+    segments: Int number of segments sampled so far
+
+    trace: Arviz InferenceData with all draws sampled so far
+    """
+
+    def __init__(self, model, chains=2, cores=2, random_seed=None, tune=1000, forward=False, checkpoint_dir=None):
+        self.model          = model
+        self.chains         = chains
+        self.cores          = cores
+        self.entropy        = np.random.SeedSequence(random_seed).entropy
+        self.tune           = tune
+        self.forward        = forward
+        self.checkpoint_dir = checkpoint_dir
+        self.segments       = 0
+        self.trace          = None
+        self.tuned          = None
+        self.start          = None
+
+    def sample(self, draws):
+        """
+        Samples one more segment of draws per chain and appends it to the trace
+
+        Returns
+        -----------
+        Arviz InferenceData with all draws sampled so far
+        """
+        seeds = segment_seeds(self.entropy, self.segments, self.chains)
+        if(self.forward):
+            segment = forward_sample(self.model, draws, self.chains, seeds[0])
+        else:
+            first = self.segments == 0
+            steps = None if first else tuned_steps(self.model, self.tuned)
+            with self.model:
+                multitrace = pm.sample(draws=draws, tune=self.tune if first else 0, chains=self.chains, cores=self.cores, step=steps,
+                                       start=self.start, random_seed=seeds, return_inferencedata=False, compute_convergence_checks=False,
+                                       callback=unlocking_callback())
+                segment = az.from_pymc3(multitrace, model=self.model)
+            self.tuned = tuning(self.model, free_values(self.model, multitrace), _step_sizes(multitrace), _scalings(multitrace))
+            self.start = [multitrace.point(-1, chain=c) for c in multitrace.chains]
+        self.segments += 1
+        self.trace = segment if self.trace is None else concat_draws(self.trace, segment)
+        if(self.checkpoint_dir is not None):
+            self.save(self.checkpoint_dir)
+        return self.trace
+
+    @property
+    def draws(self):
+        """
+        Int number of draws per chain sampled so far
+        """
+        return 0 if self.trace is None else self.trace.posterior.dims["draw"]
+
+    def save(self, path):
+        """
+        Saves the trace and the sampler state of the run to a directory. The files of every segment
+        are written before `run.json` is replaced, so a run that is interrupted while saving can
+        still be loaded from the previous segment
+        """
+        os.makedirs(path, exist_ok=True)
+        segment = self.segments
+        self.trace.to_netcdf(os.path.join(path, f"trace-{segment}.nc"))
+        state = {}
+        if(self.tuned is not None):
+            state.update(self.tuned)
+        for chain, point in enumerate(self.start or []):
+            for name, value in point.items():
+                state[f"start:{chain}:{name}"] = value
+        np.savez(os.path.join(path, f"state-{segment}.npz"), **state)
+
+        settings = {
+            "chains": self.chains,
+            "cores": self.cores,
+            "entropy": str(self.entropy),
+            "tune": self.tune,
+            "forward": self.forward,
+            "segments": segment,
+        }
+        with open(os.path.join(path, "run.json.tmp"), "w") as file:
+            json.dump(settings, file)
+        os.replace(os.path.join(path, "run.json.tmp"), os.path.join(path, "run.json"))
+
+        for file in os.listdir(path):
+            if(file.startswith(("trace-", "state-")) and file not in (f"trace-{segment}.nc", f"state-{segment}.npz")):
+                os.remove(os.path.join(path, file))
+
+    @classmethod
+    def load(cls, path, model, checkpoint_dir=None):
+        """
+        Loads a run saved with `save`
+
+        Parameters
+        -----------
+        path: path to the directory of the saved run
+
+        model: PyMC3 model, built the same way as the model of the saved run
+
+        checkpoint_dir: path to the directory where the continued run is saved. Default None, i.e., the run is not saved
+
+        Returns
+        -----------
+        SampleRun with the chains, seeds, trace and sampler state of the saved run
+        """
+        with open(os.path.join(path, "run.json")) as file:
+            settings = json.load(file)
+        segment = settings["segments"]
+        run = cls(model, chains=settings["chains"], cores=settings["cores"], tune=settings["tune"], forward=settings["forward"],
+                  checkpoint_dir=checkpoint_dir)
+        run.entropy = int(settings["entropy"])
+        run.segments = segment
+
+        run.trace = az.from_netcdf(os.path.join(path, f"trace-{segment}.nc"))
+        for group in run.trace._groups_all:
+            #NOTE the file is replaced by the next checkpoint, so it must not be read lazily
+            getattr(run.trace, group).load()
+            getattr(run.trace, group).close()
+
+        with np.load(os.path.join(path, f"state-{segment}.npz")) as state:
+            run.tuned = {key: state[key] for key in state.files if not key.startswith("start:")} or None
+            starts = {}
+            for key in state.files:
+                if(key.startswith("start:")):
+                    _, chain, name = key.split(":", 2)
+                    starts.setdefault(int(chain), {})[name] = state[key]
+            run.start = [starts[c] for c in sorted(starts)] or None
+        return run
+
+
+    @classmethod
+    def from_trace(cls, model, trace, cores=2, random_seed=None):
+        """
+        Creates a run that continues a trace sampled from a model
+
+        Parameters
+        -----------
+        model: PyMC3 model the trace was sampled from
+
+        trace: Arviz InferenceData
+
+        cores: Int number of cores. Default 2
+
+        random_seed: Int seed for the random number generator. Default None
+
+        Returns
+        -----------
+        SampleRun that starts from the last draws of the trace, with the step methods tuned from its samples and
+        sampler statistics, see `tuning`
+        """
+        chains = trace.posterior.dims["chain"]
+        forward = trace.posterior.attrs.get("sampler") == "forward"
+        run = cls(model, chains=chains, cores=cores, random_seed=random_seed, forward=forward)
+        run.trace = trace
+        run.segments = 1
+        if(not forward):
+            values = free_values(model, trace)
+            run.tuned = tuning(model, values, _step_sizes(trace), _scalings(trace))
+            run.start = [{name: value[c, -1] for name, value in values.items()} for c in range(chains)]
+        return run
+
+def convergence(trace, var_name):
+    """
+    Returns the largest R-hat and the smallest effective sample size over the elements of a variable
+
+    Parameters
+    -----------
+    trace: Arviz InferenceData
+
+    var_name: String name of the variable
+    """
+    #NOTE R-hat and the ESS are NaN for constant elements, which are skipped. They are NaN for all elements of a
+    #constant variable, or with a single chain, and then the variable is not converged
+    rhat = np.asarray(az.rhat(trace, var_names=[var_name])[var_name])
+    ess  = np.asarray(az.ess(trace, var_names=[var_name])[var_name])
+    rhat = float(np.nanmax(rhat)) if not np.all(np.isnan(rhat)) else float("nan")
+    ess  = float(np.nanmin(ess)) if not np.all(np.isnan(ess)) else float("nan")
+    return rhat, ess
+
+
+def sample_until_converged(run, var_name, round_draws, target_rhat=None, target_ess=None, max_draws=None, max_time=None):
+    """
+    Samples a run in rounds until the convergence targets on a variable are met or a budget runs out
+
+    Parameters
+    -----------
+    run: SampleRun
+
+    var_name: String name of the variable whose convergence is checked, usually the output of the program
+
+    round_draws: Int number of draws per chain in every round
+
+    target_rhat: Float. Stop once the R-hat of the variable is at most this value. Default None, i.e., not checked
+
+    target_ess: Float. Stop once the effective sample size of the variable is at least this value. Default None, i.e., not checked
+
+    max_draws: Int maximum number of draws per chain. Default None, i.e., 20 rounds if max_time is not given either
+
+    max_time: Float maximum wall-clock time in seconds. The round that is running when the time runs out is finished. Default None
+
+    Returns
+    -----------
+    Arviz InferenceData. A variable whose R-hat or ESS is NaN, e.g. a constant variable, does not converge, so sampling
+    stops at the budget. A resumed run whose draws already meet the targets or use up the draw budget is not sampled.
+    The attributes `stopping_rule` ("converged", "max_draws" or "max_time"), `rounds`, `rhat` and `ess` of the
+    posterior report why and when sampling stopped
+    """
+    if(target_rhat is not None and run.chains < 2):
+        raise ValueError("R-hat needs at least two chains")
+    if(max_draws is None and max_time is None):
+        max_draws = 20 * round_draws
+    if(max_draws is not None and max_draws < 1 and run.trace is None):
+        raise ValueError("The draw budget must allow at least one draw")
+    started = time.monotonic()
+    rounds = 0
+    trace = run.trace
+    rhat, ess = convergence(trace, var_name) if trace is not None else (float("nan"), float("nan"))
+    #NOTE the budget is checked before every round, a resumed run may have used it up already
+    while True:
+        #NOTE NaN fails the comparisons, so R-hat and ESS that cannot be computed never meet the targets
+        if(trace is not None and not (target_rhat is not None and not rhat <= target_rhat) and not (target_ess is not None and not ess >= target_ess)):
+            stopping_rule = "converged"
+        elif(max_draws is not None and run.draws >= max_draws):
+            stopping_rule = "max_draws"
+        elif(max_time is not None and trace is not None and time.monotonic() - started >= max_time):
+            stopping_rule = "max_time"
+        else:
+            draws = round_draws if max_draws is None else min(round_draws, max_draws - run.draws)
+            trace = run.sample(draws)
+            rounds += 1
+            rhat, ess = convergence(trace, var_name)
+            continue
+        break
+    trace.posterior.attrs["stopping_rule"] = stopping_rule
+    trace.posterior.attrs["rounds"] = rounds
+    trace.posterior.attrs["rhat"] = rhat
+    trace.posterior.attrs["ess"] = ess
+    return trace
+
+
+def sample_draws(run, draws, segment_draws):
+    """
+    Samples a run in segments until it has a given number of draws per chain
+
+    Parameters
+    -----------
+    run: SampleRun
+
+    draws: Int total number of draws per chain
+
+    segment_draws: Int number of draws per chain in every segment
+    """
+    while run.draws < draws:
+        run.sample(min(segment_draws, draws - run.draws))
+    return run.trace
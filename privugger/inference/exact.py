@@ -0,0 +1,163 @@
+from privugger.inference.scipy_backend import load_program, evaluate
+from functools import reduce
+import operator
+import numpy as np
+import pandas as pd
+
+"""
+Exact inference for programs whose inputs are all finite discrete distributions.
+
+The joint support of the inputs is enumerated in chunks of assignments. Every chunk is laid out
+as the scipy backend lays out samples, with the assignments on the last axis, so the program is
+evaluated by the same vectorized/per-sample machinery, and the assignments are weighted by their
+prior probability instead of being drawn at random.
+"""
+
+PROBABILITY = "probability"
+
+
+class ExactResult:
+    """
+    Result of exact inference
+
+    Attributes
+    -----------
+    joint: pandas DataFrame with one row per assignment of the inputs, one column per input element,
+    one column per output element and the column `probability`
+
+    output: pandas DataFrame with one row per output value and the column `probability`, i.e., the exact
+    distribution of the output
+
+    support_size: int number of enumerated assignments
+    """
+
+    def __init__(self, joint, output, support_size):
+        self.joint = joint
+        self.output = output
+        self.support_size = support_size
+
+    def probability(self, value):
+        """
+        Returns the probability that the output equals value
+        """
+        columns = [c for c in self.output.columns if c != PROBABILITY]
+        mask = np.all(np.isclose(self.output[columns].values, np.atleast_1d(value)), axis=1)
+        return float(self.output[PROBABILITY].values[mask].sum())
+
+
+def finite_supports(input_specs):
+    """
+    Collects the finite supports of the inputs
+
+    Parameters
+    -----------
+    input_specs: list of distributions
+
+    Returns
+    -----------
+    List of tuples (name, num_elements, values, probabilities), one per input
+    """
+    supports = []
+    for spec in input_specs:
+        if(isinstance(spec, str)):
+            raise TypeError("Method exact does not support concatenated or stacked distributions")
+        if(spec.is_hyper_param):
+            raise TypeError("Method exact does not support hyper parameters")
+        exact_dist = getattr(spec, "exact_dist", None)
+        support = exact_dist() if exact_dist is not None else None
+        if(support is None):
+            raise TypeError(f"Method exact needs finite discrete distributions, {spec.name} is a {type(spec).__name__}")
+        values, probabilities = support
+        supports.append((spec.name, spec.num_elements, np.asarray(values), np.asarray(probabilities, dtype=float)))
+    return supports
+
+
+def _support_size(sizes):
+    #NOTE python ints, since the size of a large support overflows int64
+    return reduce(operator.mul, sizes, 1)
+
+
+def product_chunks(sizes, chunk_size):
+    """
+    Iterates over the cartesian product of ranges in chunks
+
+    Parameters
+    -----------
+    sizes: list of ints with the size of every range
+
+    chunk_size: int maximum number of tuples per chunk
+
+    Returns
+    -----------
+    Generator of tuples of index arrays, one array per range with one entry per tuple of the chunk
+    """
+    total = _support_size(sizes)
+    for start in range(0, total, chunk_size):
+        stop = min(start + chunk_size, total)
+        yield np.unravel_index(np.arange(start, stop), sizes)
+
+
+def _columns(name, values):
+    if(values.ndim == 1):
+        return {name: values}
+    return {f"{name}[{i}]": values[:, i] for i in range(values.shape[1])}
+
+
+def infer_exact(prog, max_support=10**6, chunk_size=100000, vectorize=True):
+    """
+    Computes the exact distribution of the output of a program with finite discrete inputs
+
+    Parameters
+    -----------
+    prog: the program type specified as a privugger.Program type
+
+    max_support: int maximum number of assignments of the inputs. Default 10**6
+
+    chunk_size: int number of assignments evaluated at a time. Default 100000
+
+    vectorize: Boolean. Call the program once per chunk when it is array-safe. Default True
+
+    Returns
+    -----------
+    ExactResult with the joint and output probability tables
+    """
+    if(prog.has_observations()):
+        raise TypeError("Method exact does not support observations")
+    supports = finite_supports(prog.dataset.input_specs)
+
+    #NOTE every element of an input is its own site of the enumeration
+    sizes = []
+    for _, num_elements, values, _ in supports:
+        sizes += [len(values)] * (1 if num_elements == -1 else num_elements)
+    support_size = _support_size(sizes)
+    if(support_size > max_support):
+        raise ValueError(f"The joint support has {support_size} assignments, which exceeds max_support={max_support}")
+
+    f = load_program(prog.program)
+    tables = []
+    for indices in product_chunks(sizes, chunk_size):
+        size = len(indices[0])
+        priors = []
+        probabilities = np.ones(size)
+        site = 0
+        for name, num_elements, values, weights in supports:
+            count = 1 if num_elements == -1 else num_elements
+            elements = indices[site:site+count]
+            site += count
+            for i in elements:
+                probabilities = probabilities * weights[i]
+            assignment = np.stack([values[i] for i in elements])
+            priors.append(assignment[0] if num_elements == -1 else assignment)
+
+        outputs, _ = evaluate(f, priors, size, vectorize=vectorize, chunk_size=size)
+        table = {}
+        for (name, _, _, _), prior in zip(supports, priors):
+            table.update(_columns(name, np.moveaxis(prior, -1, 0)))
+        table.update(_columns(prog.name, outputs))
+        table[PROBABILITY] = probabilities
+        tables.append(pd.DataFrame(table))
+
+    joint = pd.concat(tables, ignore_index=True)
+    output_columns = list(_columns(prog.name, outputs).keys())
+    output = joint.groupby(output_columns, as_index=False)[PROBABILITY].sum()
+    return ExactResult(joint, output, support_size)
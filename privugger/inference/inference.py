@@ -2,24 +2,33 @@
 from privugger.transformer.PyMC3.type_decoration import *
 from privugger.distributions.continuous import Continuous
 from privugger.distributions.discrete import Discrete, Constant
-from privugger.transformer.PyMC3.theano_types import TheanoToken
+from privugger.transformer.PyMC3.theano_types import TheanoToken, set_precision, get_precision, use_precision, float_dtype
 from privugger.transformer.PyMC3.program_output import *
+from privugger.inference.scipy_backend import infer_scipy, infer_scipy_batch, infer_stream, load_samples
+from privugger.inference.session import AnalysisSession, current_session
+from privugger.inference.exact import infer_exact, ExactResult
+from privugger.inference import profiling
+from privugger.inference.result_cache import get_result_cache
+from privugger.transformer.PyMC3 import op_stats
+from privugger.lazy import lazy_import
 
 import astor
-import pymc3 as pm
-import theano.tensor as tt
-import arviz as az
-import os
-import importlib
-
-## Create a global pymc3 model and list of priors
-global_model  = None
-global_priors = []
-
-## Set global variables for indicating if there was a concat/stack before infer
-concatenated     = False
-stacked          = False
-global_model_set = False
+import numpy as np
+import warnings
+import weakref
+import time
+
+#NOTE the modules that need pymc3 or theano are imported when method "pymc3" is first used
+pm           = lazy_import("pymc3")
+tt           = lazy_import("theano.tensor")
+lifted       = lazy_import("privugger.transformer.PyMC3.lifted")
+compiler     = lazy_import("privugger.transformer.PyMC3.symbolic")
+continuation = lazy_import("privugger.inference.continuation")
+memmap_trace = lazy_import("privugger.inference.memmap_trace")
+
+## Models and runs of the traces returned by infer, so that they can be extended
+_models = weakref.WeakKeyDictionary()
+_runs   = weakref.WeakKeyDictionary()
 
 def _from_distributions_to_theano(input_specs, output):
     
@@ -77,7 +86,7 @@ def _from_distributions_to_theano(input_specs, output):
 
     return (itypes, otype)
 
-def concatenate(distribution_a, distribution_b,  type_of_dist, axis=0):
+def concatenate(distribution_a, distribution_b,  type_of_dist, axis=0, session=None):
 
     """
     
@@ -91,6 +100,8 @@ def concatenate(distribution_a, distribution_b,  type_of_dist, axis=0):
     type_of_dist: String that specifies if it is a continuous or discrete distribution
     
     axis: Int value giving the axis to stack
+
+    session: AnalysisSession that owns the model. Default None, i.e., the active session of the current thread
      
     Returns
     -----------
@@ -99,25 +110,17 @@ def concatenate(distribution_a, distribution_b,  type_of_dist, axis=0):
     
     #NOTE we just return a tuple and then actually concat later. First element is the distributions and second specify the axis and
     #if we are concatenating or stacking
-    global global_model
-    global global_model_set
-    global global_priors
-    
-    if(not global_model_set):
-        global_model     = pm.Model()
-        global_priors    = []
-        global_model_set = True
-    with global_model as model:
+    session = current_session(session)
+    with session.ensure_model() as model:
         val = pm.math.concatenate( (distribution_a.pymc3_dist(distribution_a.name, []), distribution_b.pymc3_dist(distribution_b.name, [])), axis=axis )
-        global_priors.append(val)
+        session.priors.append(val)
 
-    global concatenated
-    concatenated = True
+    session.concatenated = True
     return type_of_dist
     #return ((distribution_a, distribution_b), (axis, "concat"))
 
 
-def stack(distributions,  type_of_dist, axis=0):
+def stack(distributions,  type_of_dist, axis=0, session=None):
     """
     
     Parameters
@@ -128,6 +131,8 @@ def stack(distributions,  type_of_dist, axis=0):
     type_of_dist: String that specifies if it is a continuous or discrete distribution
 
     axis: Int value giving the axis to stack
+
+    session: AnalysisSession that owns the model. Default None, i.e., the active session of the current thread
      
     Returns
     -----------
@@ -136,32 +141,24 @@ def stack(distributions,  type_of_dist, axis=0):
      
     #NOTE we just return a tuple and then actually stack later. First element is the distributions and second specify the axis and
     #if we are concatenating or stacking
-    global global_model
-    global global_model_set
-    global global_priors
-    
-    if(not global_model_set):
-        global_model     = pm.Model()
-        global_priors    = []
-        global_model_set = True
-        
-    with global_model as model:
+    session = current_session(session)
+    with session.ensure_model() as model:
         stacked_variables = []
         for i in range(len(distributions)):
-            stacked_variables.append(distributions[i].pymc3_dist(distriutions[i].name, []))
-            global_priors.append(pm.math.stack(stacked_variables, axis=axis))
+            stacked_variables.append(distributions[i].pymc3_dist(distributions[i].name, []))
+        session.priors.append(pm.math.stack(stacked_variables, axis=axis))
 
-    global stacked
-    stacked = True
+    session.stacked = True
     return type_of_dist
     #return (distributions, (axis, "stack"))
 
 
-def get_model():
-    if (not global_model_set):
+def get_model(session=None):
+    session = current_session(session)
+    if (not session.model_set):
         return None
     else:
-        return global_model
+        return session.model
 
 def sample_prior(model, samples=50):
 
@@ -185,7 +182,97 @@ def sample_prior(model, samples=50):
 
         return prior_checks
     
-def infer(prog, cores=2 , chains=2, draws=500, method="pymc3", return_model=False):
+def _register(trace, model, run=None):
+    _models[trace] = model
+    if(run is not None):
+        _runs[trace] = run
+
+def _kept_variables(model, keep):
+    """
+    Resolves the keep argument of infer. Kept elements of a variable become a Deterministic of the model
+
+    Returns
+    ----------
+    Tuple with the names of the variables to record, or None if all variables are recorded, and a dict from the
+    names of the Deterministics of kept elements to tuples with the name of their variable and the indices
+    """
+    if(keep is None):
+        return None, {}
+    if(not isinstance(keep, dict)):
+        keep = {name: None for name in keep}
+    kept = []
+    renames = {}
+    for name, indices in keep.items():
+        if(name not in model.named_vars):
+            raise ValueError(f"Cannot keep {name}, it is not a variable of the model")
+        if(indices is None):
+            kept.append(name)
+        else:
+            indices = [int(i) for i in indices]
+            internal = f"{name}__kept"
+            with model:
+                pm.Deterministic(internal, model.named_vars[name][np.asarray(indices)])
+            kept.append(internal)
+            renames[internal] = (name, indices)
+    return kept, renames
+
+def _rename_kept(trace, renames):
+    for internal, (name, indices) in renames.items():
+        posterior = trace.posterior.rename({internal: name, f"{internal}_dim_0": f"{name}_dim_0"})
+        trace.posterior = posterior.assign_coords({f"{name}_dim_0": indices})
+
+def _create_priors(session, input_specs):
+    """
+    Adds the priors of the input specs to the model of the session. Must be called within the model context
+    """
+    hyper_params = []
+    for prior in input_specs:
+
+        #This is for the case when our prior comes from a concatenated/stacked distribution
+        if(isinstance(prior, str)):
+            continue
+
+        if(prior.is_hyper_param):
+            hyper_params.append((prior, prior.name))
+        else:
+            params = prior.get_params()
+            hypers_for_prior = []
+            for p_idx in range(len(params)):
+                p = params[p_idx]
+                if(isinstance(p, Continuous) or isinstance(p, Discrete)):
+                    for hyper in hyper_params:
+                        if(p.name == hyper[1]):
+                            hypers_for_prior.append((hyper[0],hyper[1], p_idx))
+
+            session.priors.append(prior.pymc3_dist(prior.name, hypers_for_prior))
+
+def _lift(prog, priors, decorators, symbolic):
+    """
+    Lifts the program of prog and applies it to the priors
+
+    Returns
+    ----------
+    Tuple with the theano expression of the output and the lifting used, "symbolic" or "as_op"
+    """
+    #NOTE compact integer priors are widened to int64 when passed to the program, whose arithmetic could overflow them
+    priors = [tt.cast(p, "int64") if p.dtype.startswith("int") and p.dtype != "int64" else p for p in priors]
+    expression = None
+    if(symbolic):
+        try:
+            tree = FunctionTypeDecorator().parse_program(prog.program)
+            expression, lifting = compiler.compile_program(tree, priors, decorators[1][0]), "symbolic"
+        except (compiler.UnsupportedConstruct, TypeError, ValueError):
+            #NOTE theano rejects some supported constructs on operands of the wrong type, e.g., a bitwise operator on floats
+            pass
+    if(expression is None):
+        t = lifted.lift_program(prog.program, decorators)
+        expression, lifting = t.method(*priors), "as_op"
+    if(expression.dtype.startswith("float") and expression.dtype != float_dtype()):
+        expression = tt.cast(expression, float_dtype())
+    return expression, lifting
+
+@profiling.profiled
+def infer(prog, cores=2 , chains=2, draws=500, method="pymc3", return_model=False, vectorize=True, workers=1, random_seed=None, forward_sampling=True, symbolic=False, session=None, max_support=10**6, target_rhat=None, target_ess=None, max_draws=None, max_time=None, checkpoint_dir=None, checkpoint_draws=100, resume_from=None, memmap_dir=None, keep=None, cache=None):
     """
     
     Parameters
@@ -199,13 +286,74 @@ def infer(prog, cores=2 , chains=2, draws=500, method="pymc3", return_model=Fals
 
     draws: Int number of draws. Default 2
 
-    method: String specifying which backend to use
+    method: String specifying which backend to use: "pymc3", "scipy" or "exact". The exact method enumerates the
+    joint support of finite discrete inputs and returns an ExactResult with exact probability tables instead of a trace
 
     return_model: Boolean. Returns the probabilistic model if true and the trace if false
 
+    vectorize: Boolean. With method "scipy", calls the program once on whole sample arrays and falls back
+    to calling it once per sample only if it is not array-safe. Default True
+
+    workers: Int number of processes used by method "scipy". The draws are split in chunks that are sampled
+    and evaluated in parallel with independent random streams. Default 1
+
+    random_seed: Int seed for the random number generator. Default None
+
+    forward_sampling: Boolean. If the program has no observations the posterior equals the prior, so method "pymc3"
+    samples the priors and the program forward instead of running MCMC. Default True
+
+    symbolic: Boolean. With method "pymc3", translates the program into native theano expressions so it can be
+    sampled with gradient based samplers. Programs using unsupported constructs fall back to an opaque `as_op`.
+    The lifting used is recorded in the attribute `lifting` of the posterior. Default False
+
+    session: AnalysisSession that owns the model. Infer builds the program on the model of the session and resets the
+    session afterwards. If the session has a sampler pool (see `AnalysisSession.start_pool`), MCMC runs in its warm
+    workers and `cores` is ignored. Default None, i.e., the active session of the current thread
+
+    max_support: Int maximum number of input assignments enumerated by method "exact". Default 10**6
+
+    target_rhat: Float. With method "pymc3", samples in rounds of `draws` draws per chain until the R-hat of the output
+    is at most this value or the budget runs out. Default None
+
+    target_ess: Float. With method "pymc3", samples in rounds of `draws` draws per chain until the effective sample size
+    of the output is at least this value or the budget runs out. Default None
+
+    max_draws: Int maximum number of draws per chain when sampling in rounds. Default None, i.e., 20 rounds if max_time is not given
+
+    max_time: Float maximum wall-clock time in seconds when sampling in rounds. The attributes `stopping_rule`, `rounds`,
+    `rhat` and `ess` of the posterior report how sampling in rounds ended. Default None
+
+    checkpoint_dir: path to a directory. With method "pymc3", samples in segments of `checkpoint_draws` draws per chain
+    (or in the rounds of `draws` draws when sampling until convergence) and saves the partial trace and the sampler
+    state to the directory after every segment. Default None
+
+    checkpoint_draws: Int number of draws per chain between checkpoints. Default 100
+
+    resume_from: path to a checkpoint directory. Continues the saved run instead of starting a new one. The chains
+    and seeds are taken from the checkpoint, and new checkpoints are saved to `checkpoint_dir`, or to `resume_from`
+    if it is not given. The program must be the same as in the saved run. Default None
+
+    memmap_dir: path to a directory. With method "pymc3", the samples are written to one memory mapped `.npy` file per
+    variable while sampling, and the posterior of the returned trace holds views of these files, which are only loaded
+    when read. Forward sampling and sampling in rounds keep their samples in memory. Default None
+
+    keep: list of variable names, or dict from variable names to lists of indices of elements of vector variables (None
+    for the whole variable). With method "pymc3", only these variables, or elements, are recorded while sampling and
+    stored in the trace. Kept elements of a variable have their indices as coordinates of its first dimension. Traces
+    with kept variables cannot be extended or sampled in rounds. Default None, i.e., all variables are kept
+
+    cache: ResultCache or path to its directory. With methods "pymc3" and "scipy" and a fixed `random_seed`, a trace
+    of an analysis with the same program, input specs, output type, observation, precision, seed and sampler settings
+    is returned from the cache instead of sampled, and new traces are stored in it. Analyses with `return_model`,
+    checkpoints, `memmap_dir`, `max_time` or concatenated or stacked priors are not cached, and cached traces cannot
+    be extended. Default None, i.e., the cache set with `set_result_cache`, if any
+
     Returns
     ----------
-    Trace produced by the probabilistic programming inference: Arviz trace
+    Trace produced by the probabilistic programming inference: Arviz trace. While the calls of lifted programs are
+    instrumented (see `instrument_ops`), the posterior of a trace of method "pymc3" that is not sampled in rounds
+    records them in the attributes `program_calls`, `program_seconds`, `program_time_share`, `program_calls_per_draw`
+    and `program_calls_per_accepted`
     """
     data_spec      = prog.dataset
     output         = prog.output_type
@@ -213,126 +361,246 @@ def infer(prog, cores=2 , chains=2, draws=500, method="pymc3", return_model=Fals
     input_specs    = data_spec.input_specs
     program        = prog.program
 
-    global global_priors
-    global global_model
+    session        = current_session(session)
+
+    cache = get_result_cache(cache)
+    key   = None
+    if(cache is not None and method in ("pymc3", "scipy") and random_seed is not None and not return_model and max_time is None
+       and checkpoint_dir is None and resume_from is None and memmap_dir is None and not any(isinstance(s, str) for s in input_specs)):
+        #NOTE the sampler pool seeds its chains with segment_seeds and pm.sample derives the seeds of the chains itself, and
+        #pm.sample may seed them differently with several cores, so both are part of the key
+        key = cache.key(prog, prog.precision or get_precision(), method=method, draws=draws, chains=chains, random_seed=random_seed,
+                        pool=method == "pymc3" and session.pool is not None, cores=cores if method == "pymc3" else None,
+                        forward_sampling=forward_sampling, symbolic=symbolic, vectorize=vectorize, workers=workers,
+                        target_rhat=target_rhat, target_ess=target_ess, max_draws=max_draws,
+                        keep=sorted(keep.items()) if isinstance(keep, dict) else keep)
+        with profiling.phase("cache") as fields:
+            trace = cache.get(key)
+            fields["hit"] = trace is not None
+        if(trace is not None):
+            return trace
 
-    global concatenated
-    global stacked
-    global global_model_set
-    
-    if not (concatenated or stacked or global_model_set):
-        
-        global_model = pm.Model()
-        global_priors = []
-        global_model_set = True
-
-    # global_model = pm.Model()
-    # global_priors = []
-    
     #### ##################
     ###### Lift program ###
     #######################
     if method == "pymc3":
         if(program is not  None):
-            ftp = FunctionTypeDecorator()
             decorators = _from_distributions_to_theano(input_specs, output)
             
-            lifted_program = ftp.lift(program, decorators)
-            lifted_program_w_import = ftp.wrap_with_theano_import(lifted_program)
-        
-            #print(astor.to_source(lifted_program_w_import))
-        
-            f = open("typed.py", "w")
-            f.write(astor.to_source(lifted_program_w_import))
-            f.close()
-            import typed as t 
-            importlib.reload(t)
-            
             #################
             ## Create model #
             #################
             trace = None
-            with global_model:
-                
-                priors = []
-                hyper_params = []
-                
-                for idx in range(num_specs):
-                    prior = input_specs[idx]
-
-                    #This is for the case when our prior comes from a concatenated/stacked distribution
-                    if(isinstance(prior, str)):
-                        continue
-                  
-                    if(prior.is_hyper_param):
-                        hyper_params.append((prior, prior.name))
+            mcmc = not forward_sampling or prog.has_observations()
+            #NOTE a failed analysis must not leave its half built model in the session
+            try:
+                with use_precision(prog.precision, mcmc=mcmc) as precision, session.ensure_model() as model:
+
+                    with profiling.phase("priors"):
+                        _create_priors(session, input_specs)
+
+                    with profiling.phase("lift") as fields:
+                        expression, fields["lifting"] = _lift(prog, session.priors, decorators, symbolic)
+                    lifting = fields["lifting"]
+                    output = pm.Deterministic(prog.name, expression)
+
+                    # Add observations
+                    prog.execute_observations(session.priors, output)
+
+                    forward = forward_sampling and not prog.has_observations() and not model.observed_RVs and not model.potentials
+                    run = None
+                    kept, renames = _kept_variables(model, keep)
+                    #NOTE the calls of the program are counted per thread, and split at the end of tuning by the callback of pm.sample
+                    counter, start = op_stats.CallCounter(), time.perf_counter()
+                    callback = counter if op_stats.instrumented() else None
+                    with op_stats.counting(counter):
+                        if(return_model):
+                            return model
+                        elif(kept is not None and (target_rhat is not None or target_ess is not None or checkpoint_dir is not None or resume_from is not None)):
+                            raise ValueError("keep cannot be combined with sampling in rounds or checkpoints, which need all free variables")
+                        elif(target_rhat is not None or target_ess is not None or checkpoint_dir is not None or resume_from is not None):
+                            if(resume_from is not None):
+                                run = continuation.SampleRun.load(resume_from, model, checkpoint_dir=checkpoint_dir or resume_from)
+                            else:
+                                run = continuation.SampleRun(model, chains=chains, cores=cores, random_seed=random_seed, forward=forward, checkpoint_dir=checkpoint_dir)
+                            with profiling.phase("sample", sampler="rounds"):
+                                if(target_rhat is not None or target_ess is not None):
+                                    trace = continuation.sample_until_converged(run, prog.name, draws, target_rhat, target_ess, max_draws, max_time)
+                                else:
+                                    trace = continuation.sample_draws(run, draws, checkpoint_draws)
+                        elif(forward):
+                            with profiling.phase("sample", sampler="forward"):
+                                trace = continuation.forward_sample(model, draws, chains, random_seed, var_names=kept)
+                        elif(memmap_dir is not None):
+                            trace = memmap_trace.sample_memmap(model, memmap_dir, draws=draws, chains=chains, cores=cores, random_seed=random_seed, var_names=kept, callback=callback)
+                        elif(session.pool is not None):
+                            with profiling.phase("sample", sampler="pool"):
+                                trace = session.pool.sample(model, draws=draws, chains=chains, random_seed=random_seed, var_names=kept)
+                        elif(kept is not None):
+                            #NOTE the log likelihood is evaluated on full points of the model, which are not kept, and pymc3
+                            #fails its convergence checks when no free variable is kept
+                            trace = profiling.sample(draws=draws, chains=chains, cores=cores, random_seed=random_seed, trace=[model.named_vars[n] for n in kept],
+                                                     return_inferencedata=True, idata_kwargs={"log_likelihood": False}, compute_convergence_checks=False, callback=callback)
+                        else:
+                            trace = profiling.sample(draws=draws, chains=chains, cores=cores, random_seed=random_seed, return_inferencedata=True, callback=callback)
+                    trace.posterior.attrs["lifting"] = lifting
+                    trace.posterior.attrs["precision"] = precision
+                    if(op_stats.instrumented() and lifting == "as_op" and run is None):
+                        #NOTE the calls of chains sampled in worker processes are not counted, see op_stats
+                        in_workers = not forward and ((memmap_dir is None and session.pool is not None) or (cores > 1 and chains > 1))
+                        if(in_workers):
+                            warnings.warn("The program calls are not added to the trace, its chains were sampled in worker processes. Sample with cores=1 to count them")
+                        else:
+                            op_stats.annotate(trace, counter, time.perf_counter() - start, chains * draws)
+                    if(kept is None):
+                        _register(trace, model, run)
                     else:
-                        params = prior.get_params()
-                        hypers_for_prior = []
-                        for p_idx in range(len(params)):
-                            p = params[p_idx]
-                            if(isinstance(p, Continuous) or isinstance(p, Discrete)):
-                                for hyper in hyper_params:
-                                    if(p.name == hyper[1]):
-                                        hypers_for_prior.append((hyper[0],hyper[1], p_idx))
-                            
-                        #priors.append(prior.pymc3_dist(prior.name, hypers_for_prior))
-                        global_priors.append(prior.pymc3_dist(prior.name, hypers_for_prior))
-                
-                if(program is not None):
-                    #output = pm.Deterministic("output", t.method(*priors) )
-                    output = pm.Deterministic(prog.name, t.method(*global_priors) )
-
-                # Add observations
-                prog.execute_observations(prior, output)
-
-                if(return_model):
-                    return global_model
+                        _rename_kept(trace, renames)
+
+                    if(key is not None):
+                        cache.put(key, trace)
+                    return trace
+            finally:
+                session.reset()
+
+    elif method == "scipy":
+        trace = infer_scipy(prog, draws=draws, vectorize=vectorize, workers=workers, random_seed=random_seed)
+        if(key is not None):
+            cache.put(key, trace)
+        return trace
+    elif method == "exact":
+        return infer_exact(prog, max_support=max_support, vectorize=vectorize)
+    else:
+        raise TypeError("Unsupported probabilistic framework")
+
+
+@profiling.profiled
+def infer_batch(programs, cores=2, chains=2, draws=500, method="pymc3", vectorize=True, random_seed=None, forward_sampling=True, symbolic=False, session=None):
+    """
+    Analyses several programs over one dataset. The priors are built once, and all programs are
+    evaluated on the same random inputs
+
+    Parameters
+    -----------
+
+    programs: list of privugger.Program types sharing the same privugger.Dataset. The names of the programs must be unique
+
+    cores: Int number of cores to use for sampling. Default 2
+
+    chains: Int number of chains. Default 2
+
+    draws: Int number of draws. Default 500
+
+    method: String specifying which backend to use. With "pymc3" every program becomes a Deterministic of one model,
+    with "scipy" every program is run on one shared set of samples of the priors
+
+    vectorize: Boolean. With method "scipy", calls the programs once on whole sample arrays when they are array-safe. Default True
+
+    random_seed: Int seed for the random number generator. Default None
+
+    forward_sampling: Boolean. With method "pymc3", samples forward instead of running MCMC if no program has observations. Default True
+
+    symbolic: Boolean. With method "pymc3", translates the programs into native theano expressions when possible. The lifting
+    used for every program is recorded in the attribute `lifting` of its variable. Default False
+
+    session: AnalysisSession that owns the model. Default None, i.e., the active session of the current thread
+
+    Returns
+    ----------
+    Arviz trace with the random variables of the dataset and one variable per program, named after the program
+    """
+    if(len(programs) == 0):
+        raise ValueError("infer_batch needs at least one program")
+    dataset = programs[0].dataset
+    if(any(prog.dataset is not dataset for prog in programs)):
+        raise ValueError("All programs in a batch must share the same privugger.Dataset")
+    names = [prog.name for prog in programs]
+    if(len(set(names)) != len(names)):
+        raise ValueError("The programs in a batch must have unique names")
+    observed = [prog for prog in programs if prog.has_observations()]
+    #NOTE the programs share their inputs, so an observation on one program conditions all of them
+    if(len(observed) > 1):
+        raise ValueError("At most one program in a batch can have observations")
+    input_specs = dataset.input_specs
+    precisions = {prog.precision for prog in programs}
+    if(len(precisions) > 1):
+        raise ValueError("The programs in a batch must have the same precision")
+
+    if method == "pymc3":
+        session = current_session(session)
+        mcmc = not forward_sampling or bool(observed)
+        try:
+            with use_precision(precisions.pop(), mcmc=mcmc) as precision, session.ensure_model() as model:
+                with profiling.phase("priors"):
+                    _create_priors(session, input_specs)
+
+                liftings = {}
+                outputs = {}
+                for prog in programs:
+                    decorators = _from_distributions_to_theano(input_specs, prog.output_type)
+                    with profiling.phase("lift", program=prog.name) as fields:
+                        expression, fields["lifting"] = _lift(prog, session.priors, decorators, symbolic)
+                    liftings[prog.name] = fields["lifting"]
+                    outputs[prog.name] = pm.Deterministic(prog.name, expression)
+
+                for prog in observed:
+                    prog.execute_observations(session.priors, outputs[prog.name])
+
+                if(forward_sampling and not observed and not model.observed_RVs and not model.potentials):
+                    with profiling.phase("sample", sampler="forward"):
+                        trace = continuation.forward_sample(model, draws, chains, random_seed)
+                elif(session.pool is not None):
+                    with profiling.phase("sample", sampler="pool"):
+                        trace = session.pool.sample(model, draws=draws, chains=chains, random_seed=random_seed)
                 else:
-                    trace = pm.sample(draws=draws, chains=chains, cores=cores,return_inferencedata=True)
-
-                concatenated     = False
-                stacked          = False
-                global_model_set = False
-                del global_model
-                del global_priors
-                #global_model = pm.Model()
+                    trace = profiling.sample(draws=draws, chains=chains, cores=cores, random_seed=random_seed, return_inferencedata=True)
+                for name, lifting in liftings.items():
+                    trace.posterior[name].attrs["lifting"] = lifting
+                trace.posterior.attrs["precision"] = precision
+
                 return trace
-            
+        finally:
+            session.reset()
+
     elif method == "scipy":
-        if isinstance(program, str):
-            import re
-            f = open(program, "r")
-            new = open("typed.py", "w")
-            for l in f.readlines():
-                res = re.findall("def [a-zA-Z]+\(", l)
-                if len(res):
-                    new.write(re.sub("def [a-zA-Z]+\(", "def method(", l))
-                else:
-                    new.write(l)
-            f.close()
-            new.close()
-            import typed as t
-            importlib.reload(t)
-            f = t.method
-        else:
-            f = program
-        priors = []
-        trace = {}
-        for idx in range(num_specs):
-            name, dist = input_specs[idx].scipy_dist(input_sepcs[idx].name)
-            dist = dist(draws)
-            priors.append(dist)
-            trace[name] = dist
-        outputs = []
-        for pi in list(zip(*priors)):
-            if len(pi) == 1:
-                pi = pi[0]
-            outputs.append(f(*pi))
-        trace["output"] = outputs
-        return az.convert_to_inference_data(trace)
+        return infer_scipy_batch(programs, draws=draws, vectorize=vectorize, random_seed=random_seed)
     else:
         raise TypeError("Unsupported probabilistic framework")
 
 
-    
+@profiling.profiled
+def extend(trace, draws, model=None, cores=2, random_seed=None):
+    """
+    Appends more draws to every chain of a trace, continuing the chains where they stopped
+
+    Parameters
+    -----------
+
+    trace: Arviz trace returned by infer with method "pymc3", or by extend
+
+    draws: Int number of draws per chain to add
+
+    model: PyMC3 model the trace was sampled from, e.g., built with infer(..., return_model=True). Default None,
+    i.e., the model infer sampled the trace from
+
+    cores: Int number of cores to use for sampling. Default 2
+
+    random_seed: Int seed for the random number generator. Default None
+
+    Returns
+    ----------
+    Arviz trace with the draws of trace followed by the new draws. The new draws reuse the tuned step size and mass matrix
+    of NUTS, the scaling of Metropolis and the slice widths of Slice, so lifting, model construction and tuning are not
+    repeated. Other step methods continue with untuned parameters, with a warning
+    """
+    run = _runs.get(trace)
+    if(run is None or run.trace is not trace or (model is not None and model is not run.model)):
+        if(model is None):
+            model = _models.get(trace)
+        if(model is None):
+            raise ValueError("The model of the trace is unknown, please pass the model it was sampled from")
+        run = continuation.SampleRun.from_trace(model, trace, cores=cores, random_seed=random_seed)
+    with use_precision(trace.posterior.attrs.get("precision")), profiling.phase("sample", sampler="rounds"):
+        extended = run.sample(draws)
+    _register(extended, run.model, run)
+    return extended
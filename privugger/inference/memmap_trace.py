@@ -0,0 +1,185 @@
+from pymc3.backends.ndarray import NDArray
+from pymc3.backends.base import BaseTrace, MultiTrace
+from privugger.inference import profiling
+import pymc3 as pm
+import numpy as np
+import arviz as az
+import os
+
+"""
+Trace backend that stores the samples of pm.sample in memory mapped `.npy` files.
+
+There is one file per variable, `<name>.npy`, with shape (chains, draws, ...). Every chain writes its
+kept draws straight to its rows of the file, so the samples are never held in RAM, and the
+InferenceData returned by `sample_memmap` wraps views of the files that the operating system
+loads lazily when they are read. The values of the tuning draws are not stored, only their
+sampler statistics.
+"""
+
+
+class MemmapStore:
+    """
+    The memory mapped files of one sampling run
+
+    Attributes
+    -----------
+    directory: path to the directory of the files
+
+    chains: Int number of chains
+
+    tune: Int number of tuning draws of every chain, which are not written to the files
+
+    arrays: dict from variable names to the memory mapped arrays
+    """
+
+    def __init__(self, directory, chains, tune=0):
+        self.directory = directory
+        self.chains    = chains
+        self.tune      = tune
+        self.arrays    = {}
+
+    def allocate(self, name, shape, dtype, draws):
+        """
+        Returns the memory mapped array of a variable with rows for the kept draws, creating its file on first use
+
+        Parameters
+        -----------
+        draws: Int number of draws of every chain, including the tuning draws
+        """
+        if(name not in self.arrays):
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{name}.npy")
+            self.arrays[name] = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(self.chains, draws - self.tune) + tuple(shape))
+        return self.arrays[name]
+
+    def flush(self):
+        for array in self.arrays.values():
+            array.flush()
+
+
+class MemmapTrace(NDArray):
+    """
+    NDArray trace of one chain whose kept samples are rows of the memory mapped files of a MemmapStore.
+    The samples of the tuning draws are dropped as they are recorded, so the samples are indexed from the first
+    kept draw. Sampler statistics are small and are kept in memory for all draws
+
+    Parameters
+    -----------
+    store: MemmapStore
+
+    chain: Int number of the chain
+
+    model: PyMC3 model. If None, the model is taken from the `with` context
+
+    vars: list of variables to record. If None, `model.unobserved_RVs` is used
+    """
+
+    def __init__(self, store, chain, model=None, vars=None):
+        super().__init__(model=model, vars=vars)
+        self.store = store
+        self.chain = chain
+
+    def setup(self, draws, chain, sampler_vars=None):
+        BaseTrace.setup(self, draws, chain, sampler_vars)
+        #NOTE every chain gets its own dicts, pm.sample shallow copies the traces it is given
+        self.chain    = chain
+        self.draws    = draws
+        self.draw_idx = 0
+        self.samples  = {name: self.store.allocate(name, shape, self.var_dtypes[name], draws)[chain]
+                         for name, shape in self.var_shapes.items()}
+        self._stats   = None
+        if(sampler_vars is not None):
+            self._stats = [{name: np.zeros(draws, dtype=dtype) for name, dtype in sampler.items()} for sampler in sampler_vars]
+
+    def record(self, point, sampler_stats=None):
+        if(self.draw_idx >= self.store.tune):
+            for name, value in zip(self.varnames, self.fn(point)):
+                self.samples[name][self.draw_idx - self.store.tune] = value
+        if(sampler_stats is not None):
+            for data, stats in zip(self._stats, sampler_stats):
+                for key, value in stats.items():
+                    data[key][self.draw_idx] = value
+        self.draw_idx += 1
+
+    def close(self):
+        if(self.draw_idx == self.draws):
+            return
+        #NOTE an interrupted chain keeps the draws it recorded
+        kept = max(self.draw_idx - self.store.tune, 0)
+        self.samples = {name: values[:kept] for name, values in self.samples.items()}
+        if(self._stats is not None):
+            self._stats = [{name: values[:self.draw_idx] for name, values in stats.items()} for stats in self._stats]
+
+    def _slice(self, idx):
+        #NOTE pm.sample drops the tuning draws with trace[tune:], whose samples are the rows of the files
+        start, stop, step = idx.indices(len(self))
+        if(start < self.store.tune):
+            raise ValueError("The samples of the tuning draws of a memory mapped trace are not stored")
+        sliced = super()._slice(slice(start, stop, step))
+        sliced.samples = {name: values[start - self.store.tune:stop - self.store.tune:step] for name, values in self.samples.items()}
+        return sliced
+
+    def point(self, idx):
+        idx = int(idx)
+        if(idx >= 0):
+            idx -= self.store.tune
+        return {name: values[idx] for name, values in self.samples.items()}
+
+
+class _ChainTraces(MultiTrace):
+    #NOTE pm.sample copies the trace it is given for every chain, and copying a MultiTrace that has not been
+    #set up fails. The chains are picked by number from the same object instead
+
+    def __copy__(self):
+        return self
+
+
+def sample_memmap(model, directory, draws=500, chains=2, cores=2, tune=1000, random_seed=None, var_names=None, callback=None):
+    """
+    Samples a model with pm.sample, storing the samples in memory mapped files
+
+    Parameters
+    -----------
+    model: PyMC3 model
+
+    directory: path to the directory where the `.npy` files are written
+
+    draws: Int number of draws per chain. Default 500
+
+    chains: Int number of chains. Default 2
+
+    cores: Int number of cores. Default 2
+
+    tune: Int number of tuning steps. The tuning samples are not written to the files. Default 1000
+
+    random_seed: Int seed for the random number generator. Default None
+
+    var_names: list with the names of the variables to record. Default None, i.e., all variables
+
+    callback: function called after every draw, see pm.sample. Default None
+
+    Returns
+    -----------
+    Arviz InferenceData whose posterior variables are views of the memory mapped files
+    """
+    store = MemmapStore(directory, chains, tune)
+    with model:
+        variables = None if var_names is None else [model.named_vars[name] for name in var_names]
+        straces = [MemmapTrace(store, chain, vars=variables) for chain in range(chains)]
+        multitrace = profiling.sample(draws=draws, tune=tune, chains=chains, cores=cores, random_seed=random_seed,
+                                      trace=_ChainTraces(straces), return_inferencedata=False,
+                                      compute_convergence_checks=var_names is None, callback=callback)
+    store.flush()
+
+    names = var_names
+    if(names is None):
+        names = [v.name for v in pm.util.get_default_varnames(model.unobserved_RVs, include_transformed=False)]
+    posterior = {name: store.arrays[name] for name in names}
+    sample_stats = {}
+    for stat in multitrace.stat_names:
+        #NOTE the same name as az.from_pymc3 uses
+        name = "lp" if stat == "model_logp" else stat
+        sample_stats[name] = np.asarray(multitrace.get_sampler_stats(stat, combine=False))
+    trace = az.from_dict(posterior=posterior, sample_stats=sample_stats or None)
+    trace.posterior.attrs["memmap_dir"] = directory
+    return trace
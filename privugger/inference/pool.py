@@ -0,0 +1,211 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from privugger.inference.continuation import segment_seeds
+from privugger.transformer.PyMC3.theano_types import unlocked
+import multiprocessing
+import threading
+import pickle
+import time
+import os
+import pymc3 as pm
+import theano
+import numpy as np
+import arviz as az
+
+"""
+A pool of long-lived sampler processes. `pm.sample(cores=N)` starts new worker processes on every
+call, which import pymc3 and theano again before they sample. The workers of a SamplerPool are
+started once, warm up by importing and compiling a small theano function (which also populates
+theano's compiledir), and then sample one chain per job until the pool is idle for too long.
+
+Jobs carry the pickled model, so the workers can sample any model, including lifted programs.
+"""
+
+
+def _warm_up():
+    import theano
+    import theano.tensor as tt
+    x = tt.dvector()
+    theano.function([x], (x ** 2).sum())(np.zeros(1))
+
+
+def _ping():
+    return os.getpid()
+
+
+def _sample_chain(model_bytes, draws, tune, seed, var_names, float_x):
+    import theano
+    model = pickle.loads(model_bytes)
+    #NOTE the precision policy of the model, see theano_types
+    with theano.configparser.change_flags(floatX=float_x), model:
+        trace = None if var_names is None else [model.named_vars[name] for name in var_names]
+        multitrace = pm.sample(draws=draws, tune=tune, chains=1, cores=1, random_seed=seed, trace=trace,
+                               progressbar=False, return_inferencedata=False, compute_convergence_checks=False)
+    samples = {name: multitrace.get_values(name) for name in multitrace.varnames}
+    stats = {stat: multitrace.get_sampler_stats(stat) for stat in multitrace.stat_names}
+    return samples, stats
+
+
+class SamplerPool:
+    """
+    Long-lived worker processes that sample the chains of models
+
+    Parameters
+    -----------
+    workers: Int number of worker processes. Default 2
+
+    idle_timeout: Float number of seconds after the last job when the workers are stopped. They are started again by
+    the next job. Default 300
+
+    mp_context: multiprocessing context or name of a start method. Default None, i.e., "forkserver", or "spawn" where
+    it is not available
+    """
+
+    def __init__(self, workers=2, idle_timeout=300.0, mp_context=None):
+        if(mp_context is None):
+            #NOTE workers forked from the analysis process inherit the locks held by its threads, and a pool restarted
+            #after a worker died breaks. The workers are started from a clean process instead
+            mp_context = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        if(isinstance(mp_context, str)):
+            mp_context = multiprocessing.get_context(mp_context)
+        self.workers      = workers
+        self.idle_timeout = idle_timeout
+        self.mp_context   = mp_context
+        self.last_used    = None
+        self._executor    = None
+        self._timer       = None
+        self._active      = 0
+        self._lock        = threading.RLock()
+
+    @property
+    def running(self):
+        return self._executor is not None
+
+    def start(self):
+        """
+        Starts the workers and waits until all of them are warm
+        """
+        with self._lock:
+            if(self._executor is None):
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.mp_context, initializer=_warm_up)
+                #NOTE the executor starts its processes on demand, a ping per worker starts all of them
+                wait([self._executor.submit(_ping) for _ in range(self.workers)])
+            self._touch()
+        return self
+
+    def check(self, timeout=10.0):
+        """
+        Health check of the workers. Idle workers are pinged. While jobs are outstanding the workers are busy sampling and
+        cannot answer in time, so only their processes are checked to be alive
+
+        Parameters
+        -----------
+        timeout: Float number of seconds the workers have to answer. Default 10
+
+        Returns
+        -----------
+        Boolean, True if the pool is running and all workers answered in time, or are alive while jobs are outstanding
+        """
+        with self._lock:
+            if(self._executor is None):
+                return False
+            if(self._active > 0):
+                processes = list(self._executor._processes.values())
+                return not self._executor._broken and all(process.is_alive() for process in processes)
+            try:
+                futures = [self._executor.submit(_ping) for _ in range(self.workers)]
+                for future in futures:
+                    future.result(timeout=timeout)
+            except (BrokenProcessPool, TimeoutError, OSError):
+                return False
+            return True
+
+    def restart(self):
+        """
+        Replaces the workers with new ones
+        """
+        with self._lock:
+            if(self._executor is not None):
+                #NOTE workers that hang would block the shutdown, so they are terminated first
+                for process in list(self._executor._processes.values()):
+                    process.terminate()
+            self.shutdown()
+            return self.start()
+
+    def shutdown(self, wait=True):
+        """
+        Stops the workers. The next job starts them again
+        """
+        with self._lock:
+            if(self._timer is not None):
+                self._timer.cancel()
+                self._timer = None
+            if(self._executor is not None):
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+    def _touch(self):
+        self.last_used = time.monotonic()
+        if(self._timer is not None):
+            self._timer.cancel()
+        if(self.idle_timeout is not None):
+            self._timer = threading.Timer(self.idle_timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _expire(self):
+        with self._lock:
+            if(self._active == 0 and self.last_used is not None and time.monotonic() - self.last_used >= self.idle_timeout):
+                self.shutdown(wait=False)
+
+    def sample(self, model, draws=500, chains=2, tune=1000, random_seed=None, var_names=None):
+        """
+        Samples a model with pm.sample, one chain per job. A pool that is not running, or whose workers do not pass the
+        health check, is (re)started first
+
+        Parameters
+        -----------
+        model: PyMC3 model
+
+        draws: Int number of draws per chain. Default 500
+
+        chains: Int number of chains. Default 2
+
+        tune: Int number of tuning steps. Default 1000
+
+        random_seed: Int seed for the random number generator. Default None
+
+        var_names: list with the names of the variables to record. Default None, i.e., all variables
+
+        Returns
+        -----------
+        Arviz InferenceData
+        """
+        with self._lock:
+            if(not self.check()):
+                self.restart()
+            model_bytes = pickle.dumps(model)
+            seeds = segment_seeds(random_seed, 0, chains)
+            futures = [self._executor.submit(_sample_chain, model_bytes, draws, tune, seeds[chain], var_names, theano.config.floatX)
+                       for chain in range(chains)]
+            self._active += 1
+        try:
+            #NOTE other threads build their models while the chains are sampled
+            with unlocked():
+                results = [future.result() for future in futures]
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._touch()
+
+        names = var_names
+        if(names is None):
+            names = [v.name for v in pm.util.get_default_varnames(model.unobserved_RVs, include_transformed=False)]
+        posterior = {name: np.stack([samples[name] for samples, _ in results]) for name in names}
+        sample_stats = {}
+        for stat in results[0][1]:
+            #NOTE the same name as az.from_pymc3 uses
+            sample_stats["lp" if stat == "model_logp" else stat] = np.stack([stats[stat] for _, stats in results])
+        trace = az.from_dict(posterior=posterior, sample_stats=sample_stats or None)
+        trace.posterior.attrs["sampler"] = "pool"
+        return trace
@@ -0,0 +1,297 @@
+from privugger.transformer.PyMC3 import theano_types
+from privugger.lazy import lazy_import
+import contextlib
+import functools
+import threading
+import inspect
+import logging
+import json
+import time
+import uuid
+import sys
+try:
+    import resource
+except ImportError:
+    #NOTE the resource module is not available on Windows, the events then have no peak memory
+    resource = None
+
+"""
+Profiling of the phases of an analysis. While a sink is registered, `infer` emits one event per
+phase, a dict with the fields
+
+- "event": "phase"
+- "phase": name of the phase, e.g. "priors", "lift", "compile", "tune", "sample", "convert"
+- "seconds": Float wall-clock duration of the phase
+- "start": Float unix time when the phase started
+- "peak_rss": Int peak resident set size in bytes of the process and its finished child processes when the phase ended
+- "run": String id shared by the events of one `infer` call, together with the fields of the run, e.g. "program"
+  and "method"
+
+and a last event with "event": "run" and the duration of the whole call. A sink is any callable that takes an event,
+e.g. a callback, a `JSONLinesSink` or a `LoggingSink`. A sink that raises is logged and skipped. Without sinks a phase
+costs a check of the list of sinks, so the hooks stay in place in production.
+"""
+
+pm = lazy_import("pymc3")
+
+_sinks  = []
+_lock   = threading.Lock()
+_local  = threading.local()
+_logger = logging.getLogger(__name__)
+
+#NOTE ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+class JSONLinesSink:
+    """
+    Sink that appends every event as one line of JSON to a file
+
+    Parameters
+    -----------
+    path: path to the file
+    """
+
+    def __init__(self, path):
+        self.path  = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class LoggingSink:
+    """
+    Sink that logs every event as JSON
+
+    Parameters
+    -----------
+    logger: logging.Logger. Default None, i.e., the logger "privugger.profiling"
+
+    level: Int logging level. Default logging.INFO
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("privugger.profiling")
+        self.level  = level
+
+    def __call__(self, event):
+        self.logger.log(self.level, json.dumps(event, default=str))
+
+
+def add_sink(sink):
+    """
+    Registers a sink that receives the profiling events of the process
+    """
+    with _lock:
+        _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    """
+    Unregisters a sink added with `add_sink`
+    """
+    with _lock:
+        _sinks.remove(sink)
+
+
+def enabled():
+    """
+    Returns True if any sink is registered
+    """
+    return bool(_sinks)
+
+
+@contextlib.contextmanager
+def profile(*sinks):
+    """
+    Registers sinks for the duration of a `with` block
+
+    Parameters
+    -----------
+    sinks: callables that take an event, or paths of JSON-lines files
+    """
+    sinks = [JSONLinesSink(s) if isinstance(s, str) else s for s in sinks]
+    for sink in sinks:
+        add_sink(sink)
+    try:
+        yield sinks
+    finally:
+        for sink in sinks:
+            remove_sink(sink)
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size in bytes of the process and of its finished child processes, or None if it is
+    not available
+    """
+    if(resource is None):
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * _RSS_UNIT
+
+
+def emit(event):
+    """
+    Sends an event to the registered sinks, adding the fields of the current run
+    """
+    if(not _sinks):
+        return
+    event = {**getattr(_local, "run", {}), **event}
+    for sink in list(_sinks):
+        try:
+            sink(event)
+        except Exception:
+            #NOTE a failing sink, e.g. a full disk, must not abort the analysis it profiles
+            _logger.exception("Profiling sink %r failed", sink)
+
+
+def _emit_phase(name, start, seconds, fields, rss=None):
+    emit({"event": "phase", "phase": name, "seconds": seconds, "start": start, "peak_rss": rss if rss is not None else peak_rss(), **fields})
+
+
+@contextlib.contextmanager
+def phase(name, **fields):
+    """
+    Times a phase and emits its event when the phase ends. Yields a dict whose items are added to the event
+
+    Parameters
+    -----------
+    name: String with the name of the phase
+
+    fields: extra fields of the event
+    """
+    if(not _sinks):
+        yield fields
+        return
+    start, begin = time.time(), time.perf_counter()
+    try:
+        yield fields
+    finally:
+        _emit_phase(name, start, time.perf_counter() - begin, fields)
+
+
+@contextlib.contextmanager
+def run(**fields):
+    """
+    Groups the phases of one analysis. The fields, e.g. the name of the program, are added to all of its events,
+    and a "run" event with the total duration is emitted when it ends. Nested runs belong to the outer run
+    """
+    if(not _sinks or hasattr(_local, "run")):
+        yield
+        return
+    _local.run = {"run": uuid.uuid4().hex, **fields}
+    start, begin = time.time(), time.perf_counter()
+    try:
+        yield
+    finally:
+        try:
+            emit({"event": "run", "seconds": time.perf_counter() - begin, "start": start, "peak_rss": peak_rss()})
+        finally:
+            del _local.run
+
+
+def profiled(f):
+    """
+    Decorator that runs every call of an analysis function, e.g. `infer`, as a profiling run. The name of the
+    function, the names of its programs and its method are the fields of the run
+    """
+    signature = inspect.signature(f)
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if(not _sinks):
+            return f(*args, **kwargs)
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        fields = {"function": f.__name__}
+        if(getattr(arguments.arguments.get("prog"), "name", None) is not None):
+            fields["program"] = arguments.arguments["prog"].name
+        if(arguments.arguments.get("programs") is not None):
+            fields["programs"] = [prog.name for prog in arguments.arguments["programs"]]
+        if("method" in arguments.arguments):
+            fields["method"] = arguments.arguments["method"]
+        with run(**fields):
+            return f(*args, **kwargs)
+    return wrapper
+
+
+class _DrawClock:
+    #NOTE the callback of pm.sample is called in the analysis process after every draw of every chain, also when the
+    #chains run in worker processes. With one core the chains run one after the other, so the boundary between tuning
+    #and sampling is kept per chain
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.first  = None
+        self.last   = None
+        self.draws  = 0
+        self.tuning = 0
+        self.rss    = {}
+        self.chains = {}
+
+    def __call__(self, trace, draw):
+        now = time.perf_counter()
+        if(self.first is None):
+            self.first = now
+            self.rss["compile"] = peak_rss()
+        #NOTE [first draw, first kept draw, last draw] of the chain
+        chain = self.chains.setdefault(draw.chain, [now, None, now])
+        if(draw.tuning):
+            self.tuning += 1
+        else:
+            self.draws += 1
+            if(chain[1] is None):
+                chain[1] = now
+                self.rss["tune"] = peak_rss()
+        chain[2] = now
+        self.last = now
+        if(self.callback is not None):
+            self.callback(trace, draw)
+
+    def durations(self):
+        """
+        Returns the seconds of tuning and of sampling, summed over the chains
+        """
+        tune = sum((tuned or last) - first for first, tuned, last in self.chains.values())
+        sample = sum(last - tuned for _, tuned, last in self.chains.values() if tuned is not None)
+        return tune, sample
+
+
+def sample(callback=None, **kwargs):
+    """
+    Calls pm.sample with the given arguments, emitting the phases. The callback, if any, is called after every draw
+    as by pm.sample. Other threads build and compile their models while the draws are sampled, see
+    `theano_types.unlocking_callback`
+
+    - "compile": until the first draw. The step methods are assigned and their theano functions compiled, the chains
+      are initialized and, with several cores, the worker processes are started
+    - "tune": the tuning draws of every chain
+    - "sample": the kept draws of every chain
+    - "convert": from the last draw until pm.sample returns, e.g. the conversion to arviz and the convergence checks
+
+    The seconds of "tune" and "sample" are summed over the chains, so with several cores they can add up to more than
+    the wall-clock time
+    """
+    callback = theano_types.unlocking_callback(callback)
+    if(not _sinks):
+        return pm.sample(callback=callback, **kwargs)
+    clock = _DrawClock(callback)
+    start, begin = time.time(), time.perf_counter()
+    result = pm.sample(callback=clock, **kwargs)
+    end = time.perf_counter()
+    first = clock.first or end
+    last  = clock.last or first
+    tune, draws = clock.durations()
+    tuned = min([t for _, t, _ in clock.chains.values() if t is not None], default=last)
+    for name, a, seconds, fields in [("compile", begin, first - begin, {}),
+                                     ("tune",    first, tune,          {"draws": clock.tuning, "chains": len(clock.chains)}),
+                                     ("sample",  tuned, draws,         {"draws": clock.draws, "chains": len(clock.chains)}),
+                                     ("convert", last,  end - last,    {})]:
+        _emit_phase(name, start + (a - begin), seconds, fields, clock.rss.get(name))
+    return result
@@ -0,0 +1,238 @@
+from privugger.transformer.PyMC3.type_decoration import FunctionTypeDecorator
+from privugger.distributions.continuous import Continuous
+from privugger.distributions.discrete import Discrete
+from privugger.lazy import lazy_import
+from collections import namedtuple
+import threading
+import tempfile
+import hashlib
+import ast
+import os
+import numpy as np
+
+"""
+On-disk cache of the results of `infer`. An analysis is keyed by a hash of the normalized AST of its
+program, the class, name and parameters (`get_params`) of every input spec, the output type, the
+observation, the precision, the seed and the sampler settings, including whether the chains are sampled
+by a sampler pool, which seeds them differently. The traces are stored as netcdf files,
+one per key, and the least recently used files are evicted when the cache grows beyond its size bound.
+
+Only analyses with a fixed `random_seed` are cached, since an unseeded analysis is expected to draw new
+samples. The key does not see the values a program reads from outside its source, e.g., the variables a
+lambda closes over or the modules a program file imports.
+"""
+
+az = lazy_import("arviz")
+xr = lazy_import("xarray")
+nc = lazy_import("netCDF4")
+
+#NOTE bump when the layout of the entries or the fields of the key change, so that old entries are not read
+FORMAT_VERSION = 2
+
+ResultCacheInfo = namedtuple("ResultCacheInfo", ["hits", "misses", "entries", "size", "max_bytes"])
+
+_default = None
+
+
+def _param(p):
+    if(isinstance(p, Continuous) or isinstance(p, Discrete)):
+        #NOTE hyper parameters are input specs themselves, so their parameters are part of the key already
+        return ("hyper", type(p).__qualname__, p.name)
+    if(isinstance(p, np.ndarray)):
+        return ("array", str(p.dtype), p.shape, p.tolist())
+    return repr(p)
+
+
+def _spec(spec):
+    if(isinstance(spec, str)):
+        raise ValueError("Concatenated or stacked priors cannot be keyed, they are built outside of infer")
+    return (type(spec).__module__, type(spec).__qualname__, spec.name, getattr(spec, "num_elements", None),
+            spec.is_hyper_param, [_param(p) for p in spec.get_params() or []])
+
+
+def _output(output):
+    if(isinstance(output, type)):
+        return output.__name__
+    return (type(output).__name__, output.output.__name__)
+
+
+class ResultCache:
+    """
+    Size-bounded on-disk cache of analysis results
+
+    Parameters
+    -----------
+    path: path to the directory of the cache. It is created if it does not exist, and can be shared by several processes
+
+    max_bytes: Int maximum total size of the stored traces. Default 1 GiB
+
+    Attributes
+    -----------
+    hits: Int number of lookups of this object that found a trace
+
+    misses: Int number of lookups of this object that did not find a trace
+    """
+
+    SUFFIX = ".nc"
+
+    def __init__(self, path, max_bytes=2**30):
+        if(max_bytes <= 0):
+            raise ValueError("The size of the result cache must be positive")
+        self.path      = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.hits      = 0
+        self.misses    = 0
+        self._lock     = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(prog, precision, **settings):
+        """
+        Computes the key of an analysis
+
+        Parameters
+        -----------
+        prog: privugger.Program
+
+        precision: String with the precision policy of the analysis
+
+        settings: the seed and the sampler settings, e.g., method, draws and chains
+
+        Returns
+        -----------
+        String with the hex digest of the key
+        """
+        tree = FunctionTypeDecorator().parse_program(prog.program)
+        parts = (FORMAT_VERSION,
+                 ast.dump(tree, include_attributes=False),
+                 prog.name,
+                 [_spec(s) for s in prog.dataset.input_specs],
+                 _output(prog.output_type),
+                 prog.observation,
+                 precision,
+                 sorted((name, repr(value)) for name, value in settings.items()))
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + self.SUFFIX)
+
+    def get(self, key):
+        """
+        Returns the trace stored under key, or None
+        """
+        path = self._file(key)
+        try:
+            trace = _load(path)
+            #NOTE the modification time orders the entries for eviction
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            #NOTE a missing entry, or one evicted or being replaced by another process
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return trace
+
+    def put(self, key, trace):
+        """
+        Stores a trace under key and evicts the least recently used traces beyond the size bound. Returns False if
+        the trace cannot be written as netcdf, e.g., because of attributes that netcdf does not support
+        """
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.path)
+        os.close(fd)
+        try:
+            trace.to_netcdf(tmp)
+            #NOTE readers never see a partially written entry
+            os.replace(tmp, self._file(key))
+        except (OSError, TypeError, ValueError, RuntimeError):
+            if(os.path.exists(tmp)):
+                os.remove(tmp)
+            return False
+        self.evict()
+        return True
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if(name.endswith(self.SUFFIX)):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Removes the least recently used traces until the cache fits in max_bytes
+        """
+        entries = self._entries()
+        size = sum(e[1] for e in entries)
+        for _, bytes_, name in entries:
+            if(size <= self.max_bytes):
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            size -= bytes_
+
+    def info(self):
+        """
+        Returns
+        -----------
+        ResultCacheInfo named tuple with the hits, misses, number of entries, total size in bytes and maximum size of the cache
+        """
+        entries = self._entries()
+        return ResultCacheInfo(self.hits, self.misses, len(entries), sum(e[1] for e in entries), self.max_bytes)
+
+    def clear(self):
+        """
+        Removes all traces of the cache and resets its statistics
+        """
+        for _, _, name in self._entries():
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+        with self._lock:
+            self.hits   = 0
+            self.misses = 0
+
+
+def _load(path):
+    #NOTE arviz opens netcdf files lazily, the trace is loaded in memory so that its entry can be evicted while it is used
+    with nc.Dataset(path, mode="r") as data:
+        groups = list(data.groups)
+    datasets = {}
+    for group in groups:
+        with xr.open_dataset(path, group=group) as data:
+            datasets[group] = data.load()
+    return az.InferenceData(**datasets)
+
+
+def set_result_cache(cache):
+    """
+    Sets the result cache used by `infer` when it is not given one
+
+    Parameters
+    -----------
+    cache: ResultCache, path to the directory of a cache, or None to turn caching off
+    """
+    global _default
+    _default = ResultCache(cache) if isinstance(cache, str) else cache
+
+
+def get_result_cache(cache=None):
+    """
+    Resolves the cache argument of `infer`: a ResultCache, a path to the directory of a cache, or None for the
+    cache set with `set_result_cache`
+    """
+    if(cache is None):
+        return _default
+    if(isinstance(cache, str)):
+        return ResultCache(cache)
+    if(isinstance(cache, ResultCache)):
+        return cache
+    raise TypeError("The result cache must be a privugger.ResultCache or a path to a directory")
@@ -0,0 +1,341 @@
+from privugger.transformer.PyMC3.loading import load_program_file
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+from privugger.lazy import lazy_import
+from privugger.inference import profiling
+
+"""
+Backend that samples the priors with scipy and runs the program directly on the samples.
+
+Samples are laid out as scipy_dist returns them: the draws are on the last axis of every prior,
+so a scalar prior has shape (draws,) and a prior with num_elements n has shape (n, draws).
+"""
+
+az = lazy_import("arviz")
+
+VECTORIZED = "vectorized"
+PER_SAMPLE = "per-sample"
+
+
+def load_program(program):
+    """
+    Returns the program as a python callable
+
+    Parameters
+    -----------
+    program: path to program, a lambda or a function
+    """
+    if isinstance(program, str):
+        return load_program_file(program).method
+    return program
+
+
+def sampled_specs(input_specs):
+    """
+    Returns the input specs that are passed to the program. Hyper parameters and the
+    type strings of concatenated/stacked distributions are not sampled by this backend
+    """
+    return [s for s in input_specs if not isinstance(s, str) and not s.is_hyper_param]
+
+
+def draw_priors(input_specs, draws):
+    """
+    Draws samples from the priors
+
+    Parameters
+    -----------
+    input_specs: list of distributions
+
+    draws: Int number of draws
+
+    Returns
+    -----------
+    names: list with the names of the random variables
+
+    priors: list of numpy arrays with the draws on the last axis
+    """
+    names = []
+    priors = []
+    for spec in sampled_specs(input_specs):
+        name, dist = spec.scipy_dist(spec.name)
+        names.append(name)
+        priors.append(np.asarray(dist(draws)))
+    return names, priors
+
+
+def _sample(priors, i):
+    return tuple(p[..., i] for p in priors)
+
+
+def _evaluate_per_sample(f, priors, draws, chunk_size):
+    outputs = None
+    for start in range(0, draws, chunk_size):
+        stop = min(start + chunk_size, draws)
+        chunk = [np.asarray(f(*_sample(priors, i))) for i in range(start, stop)]
+        if outputs is None:
+            outputs = np.empty((draws,) + chunk[0].shape, dtype=np.result_type(*chunk))
+        outputs[start:stop] = chunk
+    return outputs
+
+
+def _evaluate_vectorized(f, priors, draws, probe):
+    try:
+        outputs = np.asarray(f(*priors))
+    except Exception:
+        return None
+    if outputs.ndim == 0 or outputs.shape[-1] != draws:
+        return None
+    outputs = np.moveaxis(outputs, -1, 0)
+
+    #NOTE a program that runs on arrays is not necessarily array-safe, e.g. `age.sum()` also
+    #sums over the draws, so the first samples are checked against the per-sample program
+    expected = _evaluate_per_sample(f, [p[..., :probe] for p in priors], min(probe, draws), probe)
+    if expected.shape[1:] != outputs.shape[1:]:
+        return None
+    try:
+        if not np.allclose(outputs[:probe], expected, equal_nan=True):
+            return None
+    except TypeError:
+        if not np.array_equal(outputs[:probe], expected):
+            return None
+    return outputs
+
+
+def evaluate(f, priors, draws, vectorize=True, chunk_size=10000, probe=4):
+    """
+    Runs the program on the samples of the priors
+
+    Parameters
+    -----------
+    f: the program as a python callable
+
+    priors: list of numpy arrays with the draws on the last axis
+
+    draws: Int number of draws
+
+    vectorize: Boolean. If true the program is called once with the whole sample arrays, and
+    only if it is not array-safe it is called once per sample. Default True
+
+    chunk_size: Int number of samples evaluated per chunk in the per-sample loop. Default 10000
+
+    probe: Int number of samples used to check that the vectorized program is array-safe. Default 4
+
+    Returns
+    -----------
+    outputs: numpy array with the outputs, draws on the first axis
+
+    path: String, either VECTORIZED or PER_SAMPLE
+    """
+    if vectorize:
+        outputs = _evaluate_vectorized(f, priors, draws, probe)
+        if outputs is not None:
+            return outputs, VECTORIZED
+    return _evaluate_per_sample(f, priors, draws, chunk_size), PER_SAMPLE
+
+
+def to_inference_data(names, priors, outputs, output_name="output"):
+    """
+    Converts samples into an arviz InferenceData with a single chain
+
+    Parameters
+    -----------
+    names: list with the names of the random variables
+
+    priors: list of numpy arrays with the draws on the last axis
+
+    outputs: numpy array with the outputs, draws on the first axis
+
+    output_name: String with the name of the output variable. Default "output"
+    """
+    trace = {}
+    for name, prior in zip(names, priors):
+        trace[name] = np.moveaxis(prior, -1, 0)[np.newaxis]
+    trace[output_name] = outputs[np.newaxis]
+    return az.convert_to_inference_data(trace)
+
+
+def _split(draws, n):
+    sizes = [draws // n + (1 if i < draws % n else 0) for i in range(n)]
+    return [size for size in sizes if size > 0]
+
+
+def _chunk_seeds(random_seed, n):
+    #NOTE spawned seed sequences give statistically independent streams for every chunk
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(random_seed).spawn(n)]
+
+
+def _run_chunk(program, input_specs, draws, seed, vectorize, chunk_size):
+    if seed is not None:
+        np.random.seed(seed)
+    f = load_program(program)
+    with profiling.phase("priors", draws=draws):
+        names, priors = draw_priors(input_specs, draws)
+    with profiling.phase("program", draws=draws) as fields:
+        outputs, path = evaluate(f, priors, draws, vectorize=vectorize, chunk_size=chunk_size)
+        fields["scipy_path"] = path
+    return names, priors, outputs, path
+
+
+def infer_scipy(prog, draws=500, vectorize=True, chunk_size=10000, workers=1, random_seed=None):
+    """
+    Samples the priors of a program with scipy and runs the program on the samples
+
+    Parameters
+    -----------
+    prog: the program type specified as a privugger.Program type
+
+    draws: Int number of draws. Default 500
+
+    vectorize: Boolean. Call the program once on whole sample arrays when it is array-safe. Default True
+
+    chunk_size: Int number of samples evaluated per chunk when the program runs per sample. Default 10000
+
+    workers: Int number of processes. If larger than 1 the draws are split in one chunk per worker,
+    and every chunk is sampled and evaluated in its own process with an independent random stream.
+    The program must then be picklable, i.e., a path to a file or a module level function. Default 1
+
+    random_seed: Int seed for the random number generator. Default None
+
+    Returns
+    -----------
+    Arviz InferenceData. The attribute `scipy_path` of the posterior records whether the program
+    was evaluated vectorized or per sample. With several workers the attributes `chunk_draws`,
+    `chunk_seeds` and `chunk_paths` record the provenance of every chunk, in the order in which
+    the chunks appear along the draw dimension
+    """
+    if workers <= 1:
+        names, priors, outputs, path = _run_chunk(prog.program, prog.dataset.input_specs, draws, random_seed, vectorize, chunk_size)
+        with profiling.phase("convert"):
+            trace = to_inference_data(names, priors, outputs)
+        trace.posterior.attrs["scipy_path"] = path
+        return trace
+
+    sizes = _split(draws, workers)
+    seeds = _chunk_seeds(random_seed, len(sizes))
+    n = len(sizes)
+    #NOTE the phases of the chunks run in the worker processes, which have no sinks
+    with profiling.phase("sample", sampler="processes", workers=workers), ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = list(executor.map(_run_chunk, [prog.program] * n, [prog.dataset.input_specs] * n, sizes, seeds, [vectorize] * n, [chunk_size] * n))
+
+    names = chunks[0][0]
+    priors = [np.concatenate([c[1][i] for c in chunks], axis=-1) for i in range(len(names))]
+    outputs = np.concatenate([c[2] for c in chunks], axis=0)
+    paths = [c[3] for c in chunks]
+
+    with profiling.phase("convert"):
+        trace = to_inference_data(names, priors, outputs)
+    trace.posterior.attrs["scipy_path"] = VECTORIZED if all(p == VECTORIZED for p in paths) else PER_SAMPLE
+    trace.posterior.attrs["chunk_draws"] = sizes
+    trace.posterior.attrs["chunk_seeds"] = seeds
+    trace.posterior.attrs["chunk_paths"] = paths
+    return trace
+
+
+def infer_scipy_batch(programs, draws=500, vectorize=True, chunk_size=10000, random_seed=None):
+    """
+    Samples the priors of a dataset once with scipy and runs several programs on the same samples
+
+    Parameters
+    -----------
+    programs: list of privugger.Program types over the same dataset
+
+    draws: Int number of draws. Default 500
+
+    vectorize: Boolean. Call the programs once on whole sample arrays when they are array-safe. Default True
+
+    chunk_size: Int number of samples evaluated per chunk when a program runs per sample. Default 10000
+
+    random_seed: Int seed for the random number generator. Default None
+
+    Returns
+    -----------
+    Arviz InferenceData with the random variables and one variable per program, named after the program.
+    The attribute `scipy_path` of every program variable records how it was evaluated
+    """
+    if random_seed is not None:
+        np.random.seed(random_seed)
+    names, priors = draw_priors(programs[0].dataset.input_specs, draws)
+    trace = {name: np.moveaxis(prior, -1, 0)[np.newaxis] for name, prior in zip(names, priors)}
+    paths = {}
+    for prog in programs:
+        outputs, paths[prog.name] = evaluate(load_program(prog.program), priors, draws, vectorize=vectorize, chunk_size=chunk_size)
+        trace[prog.name] = outputs[np.newaxis]
+    trace = az.convert_to_inference_data(trace)
+    for name, path in paths.items():
+        trace.posterior[name].attrs["scipy_path"] = path
+    return trace
+
+
+def infer_stream(prog, draws, chunk_size=100000, vectorize=True, random_seed=None, memmap_dir=None):
+    """
+    Streaming variant of the scipy backend. Samples and evaluates the program in chunks of fixed
+    size, so only one chunk is kept in memory at a time
+
+    Parameters
+    -----------
+    prog: the program type specified as a privugger.Program type
+
+    draws: Int total number of draws
+
+    chunk_size: Int number of draws per chunk. Default 100000
+
+    vectorize: Boolean. Call the program once on whole sample arrays when it is array-safe. Default True
+
+    random_seed: Int seed for the random number generator. Default None
+
+    memmap_dir: path to a directory. If given, every chunk is also appended to one `.npy` file per
+    variable in this directory (`<name>.npy` and `output.npy`), which can be loaded lazily
+    with `load_samples`. Default None
+
+    Returns
+    -----------
+    Generator of (inputs, outputs) tuples, where inputs is a dict from the names of the random
+    variables to numpy arrays and outputs is a numpy array. All arrays have the draws of the
+    chunk on the first axis
+    """
+    if random_seed is not None:
+        np.random.seed(random_seed)
+    f = load_program(prog.program)
+    specs = prog.dataset.input_specs
+    files = None
+    for start in range(0, draws, chunk_size):
+        size = min(chunk_size, draws - start)
+        names, priors = draw_priors(specs, size)
+        outputs, _ = evaluate(f, priors, size, vectorize=vectorize, chunk_size=size)
+        inputs = {name: np.moveaxis(prior, -1, 0) for name, prior in zip(names, priors)}
+
+        if memmap_dir is not None:
+            if files is None:
+                os.makedirs(memmap_dir, exist_ok=True)
+                files = {}
+                for name, values in list(inputs.items()) + [("output", outputs)]:
+                    path = os.path.join(memmap_dir, f"{name}.npy")
+                    files[name] = np.lib.format.open_memmap(path, mode="w+", dtype=values.dtype, shape=(draws,) + values.shape[1:])
+            for name, values in inputs.items():
+                files[name][start:start+size] = values
+            files["output"][start:start+size] = outputs
+            for memmap in files.values():
+                memmap.flush()
+
+        yield inputs, outputs
+
+
+def load_samples(memmap_dir):
+    """
+    Loads the samples written by `infer_stream` as read-only memory mapped arrays. The samples
+    are read from disk only when accessed
+
+    Parameters
+    -----------
+    memmap_dir: path to the directory given to `infer_stream`
+
+    Returns
+    -----------
+    dict from variable names to memory mapped numpy arrays with the draws on the first axis
+    """
+    samples = {}
+    for file in sorted(os.listdir(memmap_dir)):
+        if file.endswith(".npy"):
+            samples[file[:-len(".npy")]] = np.load(os.path.join(memmap_dir, file), mmap_mode="r")
+    return samples
@@ -0,0 +1,116 @@
+import threading
+from privugger.lazy import lazy_import
+
+pm   = lazy_import("pymc3")
+pool = lazy_import("privugger.inference.pool")
+
+"""
+Analysis sessions own the probabilistic model that is built by `concatenate`, `stack` and `infer`.
+
+Every thread has its own default session, so independent analyses can be built and sampled
+concurrently in one process. Theano's floatX flag is process wide, so analyses whose precision
+policies need different float dtypes wait for each other, see `use_precision`. A session can also
+be created explicitly and passed to these functions, or activated for the current thread with a
+`with` statement.
+
+A session can own a SamplerPool of warm worker processes, which then samples the models of the
+session instead of starting new processes in every call to `pm.sample`.
+"""
+
+_local = threading.local()
+
+
+class AnalysisSession:
+    """
+    Holds the pymc3 model and the list of priors of one analysis, together with the flags that
+    record whether distributions were concatenated or stacked before calling infer, and the
+    sampler pool of the session, if any
+    """
+
+    def __init__(self):
+        self.model        = None
+        self.priors       = []
+        self.concatenated = False
+        self.stacked      = False
+        self.pool         = None
+
+    def start_pool(self, workers=2, idle_timeout=300.0, mp_context=None):
+        """
+        Starts a pool of warm sampler processes that samples the models of the session. The pool is kept
+        across analyses until `close_pool` is called; idle workers are stopped and restarted on demand
+
+        Parameters
+        -----------
+        workers: Int number of worker processes. Default 2
+
+        idle_timeout: Float number of seconds after the last job when the workers are stopped. Default 300
+
+        mp_context: multiprocessing context or name of a start method. Default None, i.e., "forkserver" or "spawn"
+
+        Returns
+        -----------
+        SamplerPool of the session
+        """
+        if(self.pool is None):
+            self.pool = pool.SamplerPool(workers=workers, idle_timeout=idle_timeout, mp_context=mp_context)
+        return self.pool.start()
+
+    def close_pool(self):
+        """
+        Stops the workers of the sampler pool, and samples in new processes again
+        """
+        if(self.pool is not None):
+            self.pool.shutdown()
+            self.pool = None
+
+    @property
+    def model_set(self):
+        return self.model is not None
+
+    def ensure_model(self):
+        """
+        Creates the model of the session if it does not exist yet
+
+        Returns
+        -----------
+        PyMC3 model of the session
+        """
+        if(not self.model_set):
+            self.model  = pm.Model()
+            self.priors = []
+        return self.model
+
+    def reset(self):
+        """
+        Discards the model and the priors, so the next analysis starts from an empty model
+        """
+        self.model        = None
+        self.priors       = []
+        self.concatenated = False
+        self.stacked      = False
+
+    def __enter__(self):
+        _stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _stack().pop()
+
+
+def _stack():
+    if(not hasattr(_local, "sessions")):
+        _local.sessions = [AnalysisSession()]
+    return _local.sessions
+
+
+def current_session(session=None):
+    """
+    Returns the given session, or the active session of the current thread if it is None
+
+    Parameters
+    -----------
+    session: AnalysisSession or None
+    """
+    if(session is not None):
+        return session
+    return _stack()[-1]
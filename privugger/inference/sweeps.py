@@ -0,0 +1,204 @@
+from privugger.inference.session import current_session
+from privugger.transformer.PyMC3.theano_types import use_precision, get_precision, float_dtype, unlocked
+from privugger.distributions.continuous import Continuous
+from privugger.distributions.discrete import Discrete
+from privugger.inference import profiling
+from privugger.lazy import lazy_import
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import itertools
+import inspect
+import hashlib
+import pickle
+import numpy as np
+
+"""
+Sweeps of the parameters of the priors. The swept parameters of the input specs are replaced by theano
+shared variables (`pm.Data`), so the model is built, the program lifted and the samplers compiled once.
+Every point of the grid sets the shared variables in place and samples the model again.
+
+With several workers, the grid points are sampled in worker processes that unpickle the model once and
+keep it, together with its step methods, for all the points they sample.
+"""
+
+pm           = lazy_import("pymc3")
+theano       = lazy_import("theano")
+inference    = lazy_import("privugger.inference.inference")
+continuation = lazy_import("privugger.inference.continuation")
+pool         = lazy_import("privugger.inference.pool")
+
+#NOTE the model last unpickled by a worker process and its step methods, by the hash of the pickled model
+_worker_model = {}
+
+
+def _parameter_names(spec):
+    signature = inspect.signature(type(spec).__init__)
+    return [name for name in signature.parameters if name not in ("self", "name", "num_elements", "is_hyper_param")]
+
+
+def _parameters(prog, grid, precision):
+    """
+    Checks the grid and returns a list of tuples (key, spec, attribute, values) with the values of every swept
+    parameter as an array with the dtype of its shared variable
+    """
+    if(len(grid) == 0):
+        raise ValueError("The grid of a sweep needs at least one parameter")
+    specs = {s.name: s for s in prog.dataset.input_specs if not isinstance(s, str)}
+    parameters = []
+    for key, values in grid.items():
+        name, _, attribute = key.rpartition(".")
+        spec = specs.get(name)
+        if(spec is None):
+            raise ValueError(f"Cannot sweep {key}, {name} is not an input spec of the program")
+        if(attribute not in _parameter_names(spec)):
+            raise ValueError(f"Cannot sweep {key}, {attribute} is not a parameter of {type(spec).__name__}")
+        if(isinstance(getattr(spec, attribute), (Continuous, Discrete))):
+            raise ValueError(f"Cannot sweep {key}, it is given by a hyper parameter")
+        values = np.asarray(values)
+        if(len(values) == 0):
+            raise ValueError(f"The grid of {key} has no values")
+        if(values.dtype.kind == "f"):
+            values = values.astype(float_dtype(precision))
+        elif(values.dtype.kind in "iub"):
+            values = values.astype("int64")
+        else:
+            raise TypeError(f"The values of {key} must be numbers")
+        parameters.append((key, spec, attribute, values))
+    return parameters
+
+
+def sweep_model(prog, parameters, symbolic=False, forward_sampling=True, session=None):
+    """
+    Builds the model of a program whose swept parameters are shared variables
+
+    Parameters
+    -----------
+    prog: privugger.Program
+
+    parameters: list of tuples (key, spec, attribute, values) as returned by `_parameters`. The shared variable of a
+    parameter is the variable of the model named by its key, and it is initialized with its first value
+
+    symbolic: Boolean, see `infer`. Default False
+
+    forward_sampling: Boolean, see `infer`. Default True
+
+    session: AnalysisSession that owns the model. Default None, i.e., the active session of the current thread
+
+    Returns
+    -----------
+    PyMC3 model
+    """
+    session = current_session(session)
+    originals = [(spec, attribute, getattr(spec, attribute)) for _, spec, attribute, _ in parameters]
+    with session.ensure_model():
+        for key, spec, attribute, values in parameters:
+            setattr(spec, attribute, pm.Data(key, values[0]))
+    try:
+        #NOTE the specs hold the shared variables only while the model is built, so they can be analysed as before
+        return inference.infer(prog, return_model=True, symbolic=symbolic, forward_sampling=forward_sampling, session=session)
+    finally:
+        for spec, attribute, value in originals:
+            setattr(spec, attribute, value)
+
+
+def _sample_point(model, step, forward, values, draws, chains, cores, random_seed):
+    for shared, value in values:
+        shared.set_value(value)
+    if(forward):
+        return continuation.forward_sample(model, draws, chains, random_seed)
+    with model:
+        return profiling.sample(draws=draws, chains=chains, cores=cores, step=step, random_seed=random_seed,
+                                progressbar=False, return_inferencedata=True)
+
+
+def _sample_point_worker(model_bytes, names, values, draws, chains, random_seed, forward, float_x):
+    key = hashlib.sha256(model_bytes).hexdigest()
+    if(key not in _worker_model):
+        _worker_model.clear()
+        model = pickle.loads(model_bytes)
+        with theano.configparser.change_flags(floatX=float_x), model:
+            step = None if forward else pm.sampling.assign_step_methods(model)
+        _worker_model[key] = (model, step)
+    model, step = _worker_model[key]
+    with theano.configparser.change_flags(floatX=float_x):
+        return _sample_point(model, step, forward, [(model.named_vars[n], v) for n, v in zip(names, values)],
+                             draws, chains, 1, random_seed)
+
+
+@profiling.profiled
+def sweep(prog, grid, draws=500, chains=2, cores=1, workers=1, random_seed=None, forward_sampling=True, symbolic=False, session=None, mp_context=None):
+    """
+    Analyses a program over a grid of values of the parameters of its priors, without building the model again
+
+    Parameters
+    -----------
+    prog: the program type specified as a privugger.Program type
+
+    grid: dict from parameters, given as "<name of the input spec>.<parameter>", e.g., "age.mu", to lists of values.
+    The program is analysed for every combination of the values
+
+    draws: Int number of draws per chain. Default 500
+
+    chains: Int number of chains. Default 2
+
+    cores: Int number of cores to use for sampling one grid point. Default 1
+
+    workers: Int number of processes that sample grid points in parallel. Default 1, i.e., the grid points are sampled
+    one after the other in this process
+
+    random_seed: Int seed for the random number generator. All grid points are sampled with the same seed. Default None
+
+    forward_sampling: Boolean. If the program has no observations, samples the priors and the program forward instead
+    of running MCMC. Default True
+
+    symbolic: Boolean. Translates the program into native theano expressions when possible, see `infer`. Default False
+
+    session: AnalysisSession that owns the model. Default None, i.e., the active session of the current thread
+
+    mp_context: multiprocessing context or name of a start method of the workers. Default None, i.e., "forkserver",
+    or "spawn" where it is not available
+
+    Returns
+    ----------
+    Dict from tuples with the values of the parameters, in the order of grid, to the Arviz traces of the grid points
+    """
+    precision  = prog.precision or get_precision()
+    parameters = _parameters(prog, grid, precision)
+    model      = sweep_model(prog, parameters, symbolic=symbolic, forward_sampling=forward_sampling, session=session)
+    forward    = forward_sampling and not prog.has_observations() and not model.observed_RVs and not model.potentials
+    names      = [key for key, _, _, _ in parameters]
+    points     = list(itertools.product(*[range(len(values)) for _, _, _, values in parameters]))
+
+    def values_of(point):
+        return [values[i] for (_, _, _, values), i in zip(parameters, point)]
+
+    def key_of(point):
+        return tuple(list(grid[key])[i] for key, i in zip(names, point))
+
+    results = {}
+    with use_precision(precision, mcmc=not forward):
+        if(workers == 1):
+            with model:
+                #NOTE the step methods are assigned and compiled once, pm.sample resets their tuning for every point
+                step = None if forward else pm.sampling.assign_step_methods(model)
+            for point in points:
+                with profiling.phase("sample", sampler="sweep", point=list(zip(names, key_of(point)))):
+                    results[key_of(point)] = _sample_point(model, step, forward, list(zip([model.named_vars[n] for n in names], values_of(point))),
+                                                           draws, chains, cores, random_seed)
+        else:
+            if(mp_context is None):
+                mp_context = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            if(isinstance(mp_context, str)):
+                mp_context = multiprocessing.get_context(mp_context)
+            model_bytes = pickle.dumps(model)
+            with profiling.phase("sample", sampler="sweep", workers=workers), \
+                 ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=pool._warm_up) as executor:
+                futures = {key_of(point): executor.submit(_sample_point_worker, model_bytes, names, values_of(point), draws, chains,
+                                                          random_seed, forward, theano.config.floatX)
+                           for point in points}
+                with unlocked():
+                    for key, future in futures.items():
+                        results[key] = future.result()
+    for trace in results.values():
+        trace.posterior.attrs["precision"] = precision
+    return results
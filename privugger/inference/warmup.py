@@ -0,0 +1,136 @@
+from collections import namedtuple
+import argparse
+import tempfile
+import time
+import os
+import sys
+from privugger.data_structures.dataset import Dataset
+from privugger.data_structures.program import Program
+from privugger.distributions.continuous import Normal
+from privugger.distributions.discrete import DiscreteUniform
+from privugger.transformer.PyMC3.program_output import Int, Float, List, Matrix
+from privugger.transformer.PyMC3.theano_types import TheanoToken, PRECISIONS, get_precision
+from privugger.inference.session import AnalysisSession
+from privugger.inference.inference import infer
+
+"""
+Warm-up of the theano compile cache. The first `infer` of a process compiles the C code of the
+priors, the lifted program and the sampler, which takes much longer than sampling a small model.
+Theano keeps the compiled modules in its compiledir, so running `warm_up` once, e.g., when a container
+image is built, saves the compilation in every process that later uses the same compiledir.
+
+`warm_up` runs a tiny analysis for every combination of input and output TheanoTokens that `infer`
+lifts, with forward sampling and, unless disabled, with MCMC on a program with an observation.
+
+Command line: `python -m privugger.inference.warmup` or `privugger-warmup`, see `--help`.
+"""
+
+
+#NOTE the input tokens are the ones `_from_distributions_to_theano` produces for a single prior
+INPUTS = {
+    TheanoToken.float_scalar:                lambda: Normal("x"),
+    TheanoToken.single_element_float_vector: lambda: Normal("x", num_elements=1),
+    TheanoToken.float_vector:                lambda: Normal("x", num_elements=3),
+    TheanoToken.int_scalar:                  lambda: DiscreteUniform("x", 0, 3),
+    TheanoToken.single_element_int_vector:   lambda: DiscreteUniform("x", 0, 3, num_elements=1),
+    TheanoToken.int_vector:                  lambda: DiscreteUniform("x", 0, 3, num_elements=3),
+}
+
+OUTPUTS = {
+    TheanoToken.float_scalar: (lambda: Float,         "np.sum(x) * 1.0"),
+    TheanoToken.int_scalar:   (lambda: Int,           "np.asarray(np.sum(x), dtype=np.int64)"),
+    TheanoToken.float_vector: (lambda: List(Float),   "np.ravel(x).astype(np.float64)"),
+    TheanoToken.int_vector:   (lambda: List(Int),     "np.ravel(x).astype(np.int64)"),
+    TheanoToken.float_matrix: (lambda: Matrix(Float), "np.reshape(x, (1, -1)).astype(np.float64)"),
+    TheanoToken.int_matrix:   (lambda: Matrix(Int),   "np.reshape(x, (1, -1)).astype(np.int64)"),
+}
+
+WarmUpRun = namedtuple("WarmUpRun", ["itype", "otype", "precision", "seconds", "error"])
+
+
+def warm_up(itypes=None, otypes=None, precisions=None, draws=2, mcmc=True, verbose=False):
+    """
+    Compiles the theano graphs of representative programs, filling theano's compile cache
+
+    Parameters
+    -----------
+    itypes: list of TheanoTokens of the input of the programs. Default None, i.e., all tokens in `INPUTS`
+
+    otypes: list of TheanoTokens of the output of the programs. Default None, i.e., all tokens in `OUTPUTS`
+
+    precisions: list of precision policies, "double" or "single". Default None, i.e., the policy in use
+
+    draws: Int number of draws of every analysis. Default 2
+
+    mcmc: Boolean. Also samples every program with an observation, which compiles the graphs of the MCMC samplers.
+    Default True
+
+    verbose: Boolean. Prints every combination when it is done. Default False
+
+    Returns
+    -----------
+    List of WarmUpRun named tuples with the tokens, the precision, the seconds spent on every combination and the
+    error of the combinations whose analysis failed, or None
+    """
+    itypes = list(INPUTS) if itypes is None else itypes
+    otypes = list(OUTPUTS) if otypes is None else otypes
+    precisions = [get_precision()] if precisions is None else precisions
+    for token in itypes:
+        if(token not in INPUTS):
+            raise ValueError(f"Unknown input token {token}, expected one of {list(INPUTS)}")
+    for token in otypes:
+        if(token not in OUTPUTS):
+            raise ValueError(f"Unknown output token {token}, expected one of {list(OUTPUTS)}")
+    for precision in precisions:
+        if(precision not in PRECISIONS):
+            raise ValueError(f"Unknown precision {precision}, expected one of {list(PRECISIONS)}")
+
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for otype in otypes:
+            output_type, expression = OUTPUTS[otype]
+            #NOTE programs given as paths are parsed from the file, the lifted module imports numpy as np
+            path = os.path.join(directory, f"warm_up_{otype}.py")
+            with open(path, "w") as f:
+                f.write(f"def warm_up(x):\n    return {expression}\n")
+            for itype in itypes:
+                for precision in precisions:
+                    start = time.perf_counter()
+                    error = None
+                    prog = Program("output", Dataset([INPUTS[itype]()]), output_type(), path, precision=precision)
+                    #NOTE a combination that cannot be analysed does not stop the warm-up of the others
+                    try:
+                        infer(prog, draws=draws, chains=1, cores=1, random_seed=0, session=AnalysisSession())
+                        if(mcmc):
+                            prog.add_observation("output>0", precision=1.0)
+                            infer(prog, draws=draws, chains=1, cores=1, random_seed=0, session=AnalysisSession())
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                    run = WarmUpRun(itype, otype, precision, time.perf_counter() - start, error)
+                    if(verbose):
+                        status = "" if error is None else f" failed, {error}"
+                        print(f"{run.itype} -> {run.otype} ({run.precision}): {run.seconds:.2f}s{status}", flush=True)
+                    runs.append(run)
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="privugger-warmup", description="Fills theano's compile cache with the graphs of representative privugger programs")
+    parser.add_argument("--itypes", nargs="+", choices=list(INPUTS), help="input tokens of the programs, all by default")
+    parser.add_argument("--otypes", nargs="+", choices=list(OUTPUTS), help="output tokens of the programs, all by default")
+    parser.add_argument("--precisions", nargs="+", choices=list(PRECISIONS), help="precision policies, the default policy by default")
+    parser.add_argument("--draws", type=int, default=2, help="draws of every analysis, default 2")
+    parser.add_argument("--no-mcmc", action="store_true", help="only compile the graphs of forward sampling")
+    parser.add_argument("--quiet", action="store_true", help="do not print the combinations")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    runs = warm_up(args.itypes, args.otypes, args.precisions, draws=args.draws, mcmc=not args.no_mcmc, verbose=not args.quiet)
+    failed = [run for run in runs if run.error is not None]
+    if(not args.quiet):
+        print(f"Compiled {len(runs) - len(failed)} of {len(runs)} combinations in {time.perf_counter() - start:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
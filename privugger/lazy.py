@@ -0,0 +1,80 @@
+import importlib
+import types
+import sys
+
+"""
+Lazy imports. Importing pymc3, theano and arviz takes seconds, so the packages of privugger resolve
+their public names when they are first used, and modules that only need a heavy dependency in
+some of their functions import it through a proxy that loads it on first attribute access.
+"""
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is imported when one of its attributes is first accessed
+
+    Parameters
+    -----------
+    name: String with the name of the module
+    """
+
+    def __getattr__(self, attr):
+        if(attr.startswith("__")):
+            raise AttributeError(attr)
+        value = getattr(importlib.import_module(self.__name__), attr)
+        self.__dict__[attr] = value
+        return value
+
+
+def lazy_import(name):
+    """
+    Returns a LazyModule for the module name, or the module itself if it is already imported
+    """
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def lazy_exports(package, exports, fallback=()):
+    """
+    Builds the module `__getattr__` and `__dir__` of a package whose public names are imported on first use
+
+    Parameters
+    -----------
+    package: String with the name of the package
+
+    exports: dict from module names to the lists of names the package takes from them
+
+    fallback: list of modules the package used to star-import, in the order of the imports. Names that are neither in
+    exports nor submodules of the package are looked up in them, the later modules first. Default empty
+
+    Returns
+    -----------
+    Tuple (__getattr__, __dir__, __all__) to assign in the package
+    """
+    module_of = {name: module for module, names in exports.items() for name in names}
+    namespace = sys.modules[package].__dict__
+
+    def __getattr__(name):
+        if(name.startswith("__")):
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        if(name in module_of):
+            value = getattr(importlib.import_module(module_of[name]), name)
+        else:
+            try:
+                value = importlib.import_module(f"{package}.{name}")
+            except ModuleNotFoundError as e:
+                if(e.name != f"{package}.{name}"):
+                    raise
+                for module in reversed(fallback):
+                    module = importlib.import_module(module)
+                    if(hasattr(module, name)):
+                        value = getattr(module, name)
+                        break
+                else:
+                    raise AttributeError(f"module {package!r} has no attribute {name!r}") from None
+        namespace[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(namespace) | set(module_of))
+
+    return __getattr__, __dir__, list(module_of)
@@ -1,2 +1,5 @@
-from privugger.measures.mutual_information import *
-from privugger.measures.kl_divergence import *
\ No newline at end of file
+from privugger.lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    "privugger.measures.mutual_information": ["mi_sklearn", "mi_binned"],
+}, fallback=["privugger.measures.mutual_information", "privugger.measures.kl_divergence"])
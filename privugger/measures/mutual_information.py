@@ -40,8 +40,9 @@ def mi_sklearn(
     trace1 = trace2 = []
     if input_inferencedata:
         assert len(var_names)==2, "var_names must contain exactly two elements"
-        trace1 = trace.posterior[var_names[0]].values.flatten().reshape(-1,1)
-        trace2 = trace.posterior[var_names[1]].values.flatten()
+        #NOTE reshape instead of flatten, so posteriors backed by memory mapped files are not copied when possible
+        trace1 = trace.posterior[var_names[0]].values.reshape(-1,1)
+        trace2 = trace.posterior[var_names[1]].values.reshape(-1)
     else:
         assert len(trace) == 2, "trace must containt two subtraces for each of each random variables to compute mutual information"
         trace1 = trace[0].reshape(-1,1)
@@ -53,3 +54,81 @@ def mi_sklearn(
                                     n_neighbors=n_neigh)
     result = mi_nat/np.log(2) if log2 else mi_nat
     return result
+
+
+def _chunk_values(chunk):
+    if isinstance(chunk, dict):
+        return chunk
+    inputs, outputs = chunk
+    values = dict(inputs)
+    values["output"] = outputs
+    return values
+
+
+def _bin_edges(values, bins):
+    low, high = np.min(values), np.max(values)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, bins + 1)
+
+
+def mi_binned(
+        chunks,
+        var_names=[],
+        bins=20,
+        ranges=None,
+        log2=True
+):
+    """
+    Plug-in estimate of mutual information from a 2D histogram accumulated over a stream of samples.
+
+    Concretely, this function computes mutual information as I(var_names[0]; var_names[1]).
+    Only the histogram is kept in memory, so the stream is never materialized.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Chunks of samples, either (inputs, outputs) tuples as yielded by `infer_stream`, or dicts
+        from variable names to arrays with the draws on the first axis.
+    var_names: String \times String
+        String array with two elements indicating the variables used to compute mutual information.
+        The outputs of the program are named `output`. Both variables must be scalar.
+    bins : int
+        Number of bins per variable. Default 20.
+    ranges: (float \times float) \times (float \times float)
+        Lower and upper bounds of the bins of each variable. By default the bounds are the range of
+        the first chunk, and later samples outside of it are counted in the outermost bins.
+    log2: bool
+        Result in log2. Default True. If False, the result is in natural logarithm.
+
+    Returns
+    -------
+    result : float
+        Mutual information in log2 or ln.
+    """
+    assert len(var_names)==2, "var_names must contain exactly two elements"
+    counts = None
+    edges = None
+    for chunk in chunks:
+        values = _chunk_values(chunk)
+        x = np.asarray(values[var_names[0]])
+        y = np.asarray(values[var_names[1]])
+        if x.ndim != 1 or y.ndim != 1:
+            raise ValueError("mi_binned only supports scalar variables")
+        if edges is None:
+            if ranges is None:
+                edges = [_bin_edges(x, bins), _bin_edges(y, bins)]
+            else:
+                edges = [np.linspace(r[0], r[1], bins + 1) for r in ranges]
+            counts = np.zeros((bins, bins))
+        x = np.clip(x, edges[0][0], edges[0][-1])
+        y = np.clip(y, edges[1][0], edges[1][-1])
+        counts += np.histogram2d(x, y, bins=edges)[0]
+
+    p_xy = counts / counts.sum()
+    p_x = p_xy.sum(axis=1, keepdims=True)
+    p_y = p_xy.sum(axis=0, keepdims=True)
+    nonzero = p_xy > 0
+    mi_nat = np.sum(p_xy[nonzero] * np.log(p_xy[nonzero] / (p_x @ p_y)[nonzero]))
+    result = mi_nat/np.log(2) if log2 else mi_nat
+    return result
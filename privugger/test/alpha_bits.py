@@ -0,0 +1,2 @@
+def alpha_bits(age, bits):
+    return (age.sum())/(age.size) + bits.sum()
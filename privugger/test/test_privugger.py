@@ -1,6 +1,8 @@
 import os
+import ast
 import sys
 import inspect
+import tempfile
 import numpy as np
 
 #Use this on Windows
@@ -14,11 +16,38 @@ import numpy as np
 
 import privugger as pv
 import unittest
+import itertools
 
 program_alpha = "privugger/test/alpha.py"
 program_addition = "privugger/test/addition.py"
 program_multiplication = "privugger/test/multiplication.py"
 program_identity = "privugger/test/identity.py"
+program_alpha_bits = "privugger/test/alpha_bits.py"
+
+
+def program_int_and(n):
+    r = n and 1
+    return r * 1.0
+
+
+def program_float_and(x):
+    r = x and 1.0
+    return r
+
+
+def program_constant(age):
+    return age.sum() * 0.0
+
+
+def program_failing(age):
+    return age.sum() + missing_name
+
+
+def evaluate_op(op, value):
+    import theano
+    import theano.tensor as tt
+    x = tt.dvector()
+    return theano.function([x], op(x))(value)
     
 
 class TestProbabilityGenerators(unittest.TestCase):
@@ -59,7 +88,6 @@ class TestProbabilityGenerators(unittest.TestCase):
 
         # Call infer
         trace = pv.infer(prog, draws= 1000, cores=1)
-        os.remove("typed.py")
         for a,b, o in zip(trace.posterior["age"].values, trace.posterior["height"].values, trace.posterior["output"].values):
             for i in range(len(a)): 
                 self.assertEqual(a[i]+b[i], o[i])
@@ -83,7 +111,6 @@ class TestProbabilityGenerators(unittest.TestCase):
         prog = pv.Program("output", dataset=ds, output_type=pv.Float, function=program_multiplication)
         # Call infer
         trace = pv.infer(prog, draws= 1000, cores=1)
-        os.remove("typed.py")
         for a,b, o in zip(trace.posterior["age"], trace.posterior["height"], trace.posterior["output"]):
             for i in range(len(a)):
                 self.assertEqual(a[i]*b[i], o[i])
@@ -106,7 +133,6 @@ class TestProbabilityGenerators(unittest.TestCase):
 
         # Call infer
         trace = pv.infer(prog, draws= 1000, cores=1)
-        os.remove("typed.py")
         for ai, oi in zip(trace.posterior["age"], trace.posterior["output"]):
             for i in range(len(ai)):
                 self.assertTrue(50 >= ai[i] >= 10)
@@ -129,7 +155,6 @@ class TestProbabilityGenerators(unittest.TestCase):
 
         # Call infer
         trace = pv.infer(prog, draws= 1000, cores=1)
-        os.remove("typed.py")
         for ai, oi in zip(trace.posterior["age"], trace.posterior["output"]):
             for i in range(len(ai)):
                 self.assertTrue(50 >= ai[i] >= 10)
@@ -153,7 +178,6 @@ class TestProbabilityGenerators(unittest.TestCase):
 
         # Call infer
         trace = pv.infer(prog, draws= sample_size, cores=1, chains=1)
-        os.remove("typed.py")
         self.assertEqual(len(trace.posterior["age"][0]), sample_size)
         self.assertEqual(len(trace.posterior["output"][0]), sample_size)
         
@@ -179,10 +203,784 @@ class TestProbabilityGenerators(unittest.TestCase):
 
         # Call infer and specify program output
         trace = pv.infer(program, cores=2, draws=1000)
-        os.remove("typed.py")
 
         self.assertTrue(all(57 > (np.array(trace.posterior["output"] > 56).flatten())))
 
+    def test_lifting_does_not_write_files(self):
+        """
+        Ensures that lifting and inference happen in memory, without writing typed.py or temp.py
+        """
+        age  = pv.Normal("age", mu=55.2, std=3.5)
+        ds   = pv.Dataset(input_specs = [age])
+        prog = pv.Program("output", dataset=ds, output_type=pv.Float, function=program_identity)
+
+        before = set(os.listdir("."))
+        trace = pv.infer(prog, draws=100, cores=1, chains=1)
+        after = set(os.listdir("."))
+
+        self.assertFalse(os.path.exists("typed.py"))
+        self.assertFalse(os.path.exists("temp.py"))
+        self.assertEqual(before, after)
+        self.assertEqual(len(trace.posterior["output"][0]), 100)
+
+    def test_lifted_programs_are_cached(self):
+        """
+        Ensures that analysing the same program twice with different priors reuses the lifted op
+        """
+        pv.lift_cache_clear()
+        for mu in [10, 20]:
+            age  = pv.Normal("age", mu=mu, std=3.5)
+            ds   = pv.Dataset(input_specs = [age])
+            prog = pv.Program("output", dataset=ds, output_type=pv.Float, function=program_identity)
+            pv.infer(prog, draws=100, cores=1, chains=1)
+
+        info = pv.lift_cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 1)
+
+        #NOTE a source loaded by several threads at once is executed and registered once
+        import sys
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from privugger.transformer.PyMC3.loading import load_source
+        source = f"import time\ntime.sleep(0.2)\nloaded = {time.time()!r}\n"
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            modules = list(executor.map(load_source, [source] * 4))
+        self.assertTrue(all(module is modules[0] for module in modules))
+        del sys.modules[modules[0].__name__]
+
+    def test_scipy_vectorized_and_per_sample(self):
+        """
+        Ensures that the scipy backend runs array-safe programs once on whole arrays and falls back to a per sample loop otherwise
+        """
+        a = pv.Normal("age", mu=10, std=3.5)
+        b = pv.Normal("height", mu=40, std=3.5)
+        ds = pv.Dataset(input_specs = [a,b])
+        prog = pv.Program("output", dataset=ds, output_type=pv.Float, function=program_addition)
+        trace = pv.infer(prog, draws=1000, method="scipy")
+        self.assertEqual(trace.posterior.attrs["scipy_path"], "vectorized")
+        self.assertTrue(np.allclose(trace.posterior["age"] + trace.posterior["height"], trace.posterior["output"]))
+
+        age = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        ds = pv.Dataset(input_specs = [age])
+        prog = pv.Program("output", dataset=ds, output_type=pv.Float, function=program_alpha)
+        trace = pv.infer(prog, draws=1000, method="scipy")
+        self.assertEqual(trace.posterior.attrs["scipy_path"], "per-sample")
+        self.assertTrue(np.allclose(trace.posterior["age"].mean(axis=-1), trace.posterior["output"]))
+
+    def test_scipy_workers(self):
+        """
+        Ensures that the scipy backend merges the chunks evaluated by several workers
+        """
+        a = pv.Normal("age", mu=10, std=3.5)
+        b = pv.Normal("height", mu=40, std=3.5)
+        ds = pv.Dataset(input_specs = [a,b])
+        prog = pv.Program("output", dataset=ds, output_type=pv.Float, function=program_addition)
+        trace = pv.infer(prog, draws=1001, method="scipy", workers=2, random_seed=42)
+
+        self.assertEqual(trace.posterior["output"].shape, (1, 1001))
+        self.assertEqual(list(trace.posterior.attrs["chunk_draws"]), [501, 500])
+        self.assertEqual(len(set(trace.posterior.attrs["chunk_seeds"])), 2)
+        self.assertTrue(np.allclose(trace.posterior["age"] + trace.posterior["height"], trace.posterior["output"]))
+
+    def test_scipy_stream_with_memmap(self):
+        """
+        Ensures that streaming inference yields chunks of the given size and writes them to memory mapped files
+        """
+        a = pv.Normal("age", mu=10, std=3.5)
+        b = pv.Normal("height", mu=40, std=3.5)
+        ds = pv.Dataset(input_specs = [a,b])
+        prog = pv.Program("output", dataset=ds, output_type=pv.Float, function=program_addition)
+
+        with tempfile.TemporaryDirectory() as directory:
+            sizes = []
+            for inputs, outputs in pv.infer_stream(prog, draws=2500, chunk_size=1000, memmap_dir=directory):
+                sizes.append(len(outputs))
+                self.assertTrue(np.allclose(inputs["age"] + inputs["height"], outputs))
+            self.assertEqual(sizes, [1000, 1000, 500])
+
+            samples = pv.load_samples(directory)
+            self.assertEqual(samples["output"].shape, (2500,))
+            self.assertTrue(np.allclose(samples["age"] + samples["height"], samples["output"]))
+
+            mi = pv.mi_binned(pv.infer_stream(prog, draws=2500, chunk_size=1000), var_names=["age", "output"])
+            self.assertTrue(mi > 0)
+
+    def test_forward_sampling_without_observations(self):
+        """
+        Ensures that programs without observations are sampled forward, with the same layout as MCMC
+        """
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        ds   = pv.Dataset(input_specs = [age])
+        prog = pv.Program("output", dataset=ds, output_type=pv.Float, function=program_alpha)
+
+        trace = pv.infer(prog, draws=500, chains=2, cores=1)
+        self.assertEqual(trace.posterior.attrs["sampler"], "forward")
+        self.assertEqual(trace.posterior["age"].shape, (2, 500, 10))
+        self.assertEqual(trace.posterior["output"].shape, (2, 500))
+        self.assertTrue(np.allclose(trace.posterior["age"].mean(axis=-1), trace.posterior["output"]))
+
+        trace = pv.infer(prog, draws=500, chains=2, cores=1, forward_sampling=False)
+        self.assertNotIn("sampler", trace.posterior.attrs)
+        self.assertEqual(trace.posterior["output"].shape, (2, 500))
+
+    def test_sessions_are_isolated(self):
+        """
+        Ensures that analysis sessions do not share models, also when they are sampled in parallel threads
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        first, second = pv.AnalysisSession(), pv.AnalysisSession()
+        pv.concatenate(pv.Normal("a", mu=0, std=1, num_elements=2), pv.Normal("b", mu=1, std=1, num_elements=3), "continuous", session=first)
+        self.assertEqual(len(first.priors), 1)
+        self.assertIsNone(pv.get_model(session=second))
+        self.assertIsNone(pv.get_model())
+        first.reset()
+
+        def analysis(mu):
+            age  = pv.Normal("age", mu=mu, std=1.0, num_elements=10)
+            prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+            return pv.infer(prog, draws=200, chains=1, cores=1, session=pv.AnalysisSession())
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            traces = list(executor.map(analysis, [0.0, 100.0]))
+        self.assertAlmostEqual(float(traces[0].posterior["output"].mean()), 0.0, delta=1.0)
+        self.assertAlmostEqual(float(traces[1].posterior["output"].mean()), 100.0, delta=1.0)
+
+    def test_failed_analysis_resets_session(self):
+        """
+        Ensures that an analysis that fails while its model is built does not leave the model in the session
+        """
+        for analyse in [pv.infer, lambda prog, **kwargs: pv.infer_batch([prog], **kwargs)]:
+            age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+            prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_failing)
+            with self.assertRaises(NameError):
+                analyse(prog, draws=50, chains=1, cores=1)
+            self.assertIsNone(pv.get_model())
+            prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+            trace = analyse(prog, draws=50, chains=1, cores=1)
+            self.assertEqual(trace.posterior["output"].shape, (1, 50))
+
+    def test_batch_infer_shares_inputs(self):
+        """
+        Ensures that the programs of a batch are evaluated on the same random inputs
+        """
+        a  = pv.Normal("age", mu=10, std=3.5)
+        b  = pv.Normal("height", mu=40, std=3.5)
+        ds = pv.Dataset(input_specs = [a,b])
+        programs = [pv.Program("sum", dataset=ds, output_type=pv.Float, function=program_addition),
+                    pv.Program("product", dataset=ds, output_type=pv.Float, function=program_multiplication)]
+
+        for method in ["pymc3", "scipy"]:
+            trace = pv.infer_batch(programs, draws=200, chains=1, cores=1, method=method, random_seed=3)
+            age, height = trace.posterior["age"].values, trace.posterior["height"].values
+            self.assertTrue(np.allclose(trace.posterior["sum"], age + height))
+            self.assertTrue(np.allclose(trace.posterior["product"], age * height))
+
+        other = pv.Program("other", dataset=pv.Dataset(input_specs = [a,b]), output_type=pv.Float, function=program_addition)
+        with self.assertRaises(ValueError):
+            pv.infer_batch(programs + [other])
+
+    def test_exact_inference(self):
+        """
+        Ensures that the exact method computes the exact output distribution of finite discrete programs
+        """
+        secret = pv.DiscreteUniform("secret", lower=0, upper=9)
+        guess  = pv.Constant("guess", 3)
+        prog   = pv.Program("output", dataset=pv.Dataset(input_specs = [secret, guess]), output_type=pv.Int, function=lambda s, g: s == g)
+        result = pv.infer(prog, method="exact")
+        self.assertEqual(result.support_size, 10)
+        self.assertAlmostEqual(result.probability(1), 0.1)
+        self.assertAlmostEqual(result.joint["probability"].sum(), 1.0)
+
+        coins = pv.Bernoulli("coins", p=0.3, num_elements=3)
+        die   = pv.Categorical("die", p=[0.5, 0.25, 0.25])
+        prog  = pv.Program("output", dataset=pv.Dataset(input_specs = [coins, die]), output_type=pv.Int, function=lambda c, d: c.sum(axis=0) + d)
+        result = pv.infer(prog, method="exact", max_support=100)
+        self.assertEqual(len(result.joint), 24)
+        self.assertIn("coins[2]", result.joint.columns)
+        heads = {k: sum(np.prod([0.3 if c else 0.7 for c in flips]) for flips in itertools.product([0, 1], repeat=3) if sum(flips) == k) for k in range(4)}
+        for value in range(6):
+            expected = sum(heads[k] * [0.5, 0.25, 0.25][value - k] for k in range(4) if 0 <= value - k < 3)
+            self.assertAlmostEqual(result.probability(value), expected)
+
+        with self.assertRaises(ValueError):
+            pv.infer(prog, method="exact", max_support=10)
+        age  = pv.Normal("age", mu=55.2, std=3.5)
+        with self.assertRaises(TypeError):
+            pv.infer(pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_identity), method="exact")
+
+    def test_sampling_until_converged(self):
+        """
+        Ensures that sampling in rounds stops at the convergence targets or at the draw budget
+        """
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        prog.add_observation("57>output>56", precision=0.5)
+
+        trace = pv.infer(prog, draws=200, chains=2, cores=1, symbolic=True, random_seed=2, target_rhat=1.1, target_ess=100)
+        self.assertEqual(trace.posterior.attrs["stopping_rule"], "converged")
+        self.assertLessEqual(trace.posterior.attrs["rhat"], 1.1)
+        self.assertEqual(trace.posterior["output"].shape, (2, 200 * trace.posterior.attrs["rounds"]))
+
+        trace = pv.infer(prog, draws=100, chains=2, cores=1, symbolic=True, random_seed=2, target_ess=10**6, max_draws=250)
+        self.assertEqual(trace.posterior.attrs["stopping_rule"], "max_draws")
+        self.assertEqual(trace.posterior.attrs["rounds"], 3)
+        self.assertEqual(trace.posterior["output"].shape, (2, 250))
+        self.assertEqual(trace.sample_stats["step_size_bar"].shape, (2, 250))
+
+        #NOTE the R-hat and ESS of a constant output are NaN, which does not count as converged
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_constant)
+        trace = pv.infer(prog, draws=50, chains=2, cores=1, random_seed=2, target_rhat=1.1, target_ess=10, max_draws=150)
+        self.assertEqual(trace.posterior.attrs["stopping_rule"], "max_draws")
+        self.assertEqual(trace.posterior.attrs["rounds"], 3)
+        self.assertTrue(np.isnan(trace.posterior.attrs["rhat"]))
+        with self.assertRaises(ValueError):
+            pv.infer(prog, draws=50, chains=1, cores=1, target_rhat=1.1)
+
+        #NOTE a resumed run that has used up its draw budget stops without sampling
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        prog.add_observation("57>output>56", precision=0.5)
+        with tempfile.TemporaryDirectory() as directory:
+            pv.infer(prog, draws=100, chains=2, cores=1, symbolic=True, random_seed=2, target_ess=10**6, max_draws=100, checkpoint_dir=directory)
+            trace = pv.infer(prog, draws=100, chains=2, cores=1, symbolic=True, target_ess=10**6, max_draws=100, resume_from=directory)
+        self.assertEqual(trace.posterior.attrs["stopping_rule"], "max_draws")
+        self.assertEqual(trace.posterior.attrs["rounds"], 0)
+        self.assertEqual(trace.posterior["output"].shape, (2, 100))
+
+    def test_resume_from_checkpoint(self):
+        """
+        Ensures that a resumed run continues with the same chains and seeds as an uninterrupted run
+        """
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        prog.add_observation("57>output>56", precision=0.5)
+
+        with tempfile.TemporaryDirectory() as full, tempfile.TemporaryDirectory() as partial:
+            expected = pv.infer(prog, draws=200, chains=2, cores=1, symbolic=True, random_seed=4, checkpoint_dir=full, checkpoint_draws=100)
+            pv.infer(prog, draws=100, chains=2, cores=1, symbolic=True, random_seed=4, checkpoint_dir=partial, checkpoint_draws=100)
+            self.assertIn("run.json", os.listdir(partial))
+
+            trace = pv.infer(prog, draws=200, chains=3, cores=1, symbolic=True, resume_from=partial, checkpoint_draws=100)
+            self.assertEqual(trace.posterior["output"].shape, (2, 200))
+            self.assertTrue(np.array_equal(trace.posterior["output"].values, expected.posterior["output"].values))
+
+    def test_extend_trace(self):
+        """
+        Ensures that extending a trace appends draws that reuse the tuned step size
+        """
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        prog.add_observation("57>output>56", precision=0.5)
+
+        trace    = pv.infer(prog, draws=100, chains=2, cores=1, symbolic=True, random_seed=5)
+        extended = pv.extend(trace, 50, random_seed=5)
+        self.assertEqual(extended.posterior["output"].shape, (2, 150))
+        self.assertTrue(np.array_equal(extended.posterior["output"].values[:, :100], trace.posterior["output"].values))
+        step_sizes = trace.sample_stats["step_size_bar"].values[:, -1]
+        self.assertTrue(np.allclose(extended.sample_stats["step_size_bar"].values[:, 100:], np.exp(np.log(step_sizes).mean())))
+
+        extended = pv.extend(extended, 50)
+        self.assertEqual(extended.posterior["output"].shape, (2, 200))
+
+    def test_extend_trace_steps(self):
+        """
+        Ensures that extending a trace sampled by Metropolis and Slice reuses their tuned scaling and slice widths
+        """
+        import warnings
+        from privugger.inference import continuation
+        a    = pv.Normal("age", mu=10, std=3.5)
+        b    = pv.DiscreteUniform("height", lower=0, upper=20)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [a, b]), output_type=pv.Float, function=program_addition)
+        prog.add_observation("30>output>20", precision=0.5)
+
+        trace = pv.infer(prog, draws=100, chains=2, cores=1, random_seed=7)
+        self.assertIn("scaling", trace.sample_stats)
+        run = continuation.SampleRun.from_trace(pv.infer(prog, return_model=True), trace)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            steps = {type(s).__name__: s for s in continuation.tuned_steps(run.model, run.tuned)}
+        scaling = np.exp(np.log(trace.sample_stats["scaling"].values[:, -1]).mean())
+        self.assertTrue(np.allclose(steps["Metropolis"].scaling, scaling))
+        self.assertFalse(np.allclose(steps["Slice"].w, 1.0))
+
+        extended = pv.extend(trace, 50, random_seed=7)
+        self.assertEqual(extended.posterior["output"].shape, (2, 150))
+        self.assertTrue(np.allclose(extended.sample_stats["scaling"].values[:, 100], scaling))
+
+    def test_memmap_trace(self):
+        """
+        Ensures that pymc3 samples are written to memory mapped files and exposed without copies
+        """
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        prog.add_observation("57>output>56", precision=0.5)
+
+        with tempfile.TemporaryDirectory() as directory:
+            trace = pv.infer(prog, draws=100, chains=2, cores=1, symbolic=True, random_seed=6, memmap_dir=directory)
+            on_disk = np.load(os.path.join(directory, "age.npy"), mmap_mode="r")
+            self.assertEqual(on_disk.shape, (2, 100, 10))
+            self.assertEqual(os.path.getsize(os.path.join(directory, "age.npy")), on_disk.offset + on_disk.nbytes)
+            self.assertEqual(trace.posterior["age"].shape, (2, 100, 10))
+            self.assertFalse(trace.posterior["age"].values.flags.owndata)
+            self.assertTrue(np.array_equal(trace.posterior["age"].values, on_disk))
+            self.assertTrue(np.allclose(trace.posterior["age"].mean(axis=-1), trace.posterior["output"]))
+            self.assertEqual(trace.sample_stats["step_size_bar"].shape, (2, 100))
+            self.assertGreater(pv.mi_sklearn(trace, var_names=["output", "output"])[0], 0)
+            del trace
+
+    def test_keep_variables(self):
+        """
+        Ensures that only the kept variables, and elements of variables, are stored in the trace
+        """
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        trace = pv.infer(prog, draws=100, chains=2, cores=1, symbolic=True, random_seed=3, keep=["output"])
+        self.assertEqual(list(trace.posterior.data_vars), ["output"])
+
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        prog.add_observation("57>output>56", precision=0.5)
+        trace = pv.infer(prog, draws=100, chains=2, cores=1, symbolic=True, random_seed=3, keep={"output": None, "age": [0, 4]})
+        self.assertEqual(set(trace.posterior.data_vars), {"output", "age"})
+        self.assertEqual(trace.posterior["age"].shape, (2, 100, 2))
+        self.assertEqual(list(trace.posterior["age"]["age_dim_0"].values), [0, 4])
+        self.assertFalse(hasattr(trace, "log_likelihood"))
+
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        with self.assertRaises(ValueError):
+            pv.infer(prog, draws=100, chains=2, cores=1, symbolic=True, keep=["height"])
+
+    def test_single_precision(self):
+        """
+        Ensures that the single precision policy builds priors, lifted programs and traces in float32 and int16
+        """
+        for symbolic in [False, True]:
+            age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+            bit  = pv.Bernoulli("bit", p=0.3, num_elements=4)
+            prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age, bit]), output_type=pv.Float, function=program_alpha_bits, precision="single")
+            prog.add_observation("57>output>56", precision=0.5)
+            trace = pv.infer(prog, draws=100, chains=2, cores=1, symbolic=symbolic, random_seed=4)
+            self.assertEqual(trace.posterior.attrs["precision"], "single")
+            self.assertEqual(trace.posterior["age"].dtype, np.float32)
+            self.assertEqual(trace.posterior["bit"].dtype, np.int16)
+            self.assertEqual(trace.posterior["output"].dtype, np.float32)
+            expected = trace.posterior["age"].mean(axis=-1) + trace.posterior["bit"].sum(axis=-1)
+            self.assertTrue(np.allclose(expected, trace.posterior["output"], atol=1e-4))
+
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        trace = pv.infer(prog, draws=100, chains=2, cores=1)
+        self.assertEqual(pv.get_precision(), "double")
+        self.assertEqual(trace.posterior["output"].dtype, np.float64)
+
+    def test_mixed_precision_threads(self):
+        """
+        Ensures that threads analysing programs at different precisions do not change the float dtype of each other
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def analysis(precision):
+            age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+            prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha, precision=precision)
+            prog.add_observation("57>output>56", precision=0.5)
+            trace = pv.infer(prog, draws=50, chains=1, cores=1, symbolic=True, random_seed=1, session=pv.AnalysisSession())
+            return trace.posterior["age"].dtype, trace.posterior["output"].dtype
+
+        precisions = ["single", "double"] * 3
+        with ThreadPoolExecutor(max_workers=len(precisions)) as executor:
+            dtypes = list(executor.map(analysis, precisions))
+        for precision, (age, output) in zip(precisions, dtypes):
+            expected = np.float32 if precision == "single" else np.float64
+            self.assertEqual((age, output), (expected, expected))
+
+    def test_concurrent_sessions(self):
+        """
+        Ensures that the analyses of two sessions at the same precision sample their draws at the same time
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        events = []
+
+        def analysis(seed, draws=2000):
+            age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+            prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+            prog.add_observation("57>output>56", precision=0.5)
+            return pv.infer(prog, draws=draws, chains=1, cores=1, symbolic=True, random_seed=seed, session=pv.AnalysisSession())
+
+        #NOTE the functions of the model are compiled once, so the second thread builds its model while the first samples
+        analysis(0, draws=10)
+        with pv.profile(events.append), ThreadPoolExecutor(max_workers=2) as executor:
+            traces = list(executor.map(analysis, [1, 2]))
+        self.assertEqual([t.posterior["output"].shape for t in traces], [(1, 2000), (1, 2000)])
+        draws = {}
+        for event in events:
+            if(event.get("phase") == "tune"):
+                draws.setdefault(event["run"], [None, None])[0] = event["start"]
+            elif(event.get("phase") == "sample"):
+                draws.setdefault(event["run"], [None, None])[1] = event["start"] + event["seconds"]
+        (first, last), (other_first, other_last) = sorted(draws.values())
+        self.assertLess(other_first, last)
+
+    def test_lifted_ops_are_picklable(self):
+        """
+        Ensures that a lifted op is rebuilt from its source by a spawned process, which does not have its module
+        """
+        import pickle
+        import multiprocessing
+        from privugger.transformer.PyMC3.lifted import lift_program
+        op = lift_program(program_alpha, ([pv.TheanoToken.float_vector], [pv.TheanoToken.float_scalar])).alpha
+        self.assertIs(pickle.loads(pickle.dumps(op)), op)
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            result = pool.apply(evaluate_op, (op, np.arange(4.0)))
+        self.assertEqual(result, 1.5)
+
+    def test_multi_process_chains(self):
+        """
+        Ensures that chains of a lifted program sampled in worker processes give the same trace as sampled in this process
+        """
+        import pickle
+        from privugger.transformer.PyMC3.lifted import LiftedOp, lift_program
+        op = lift_program(program_alpha, ([pv.TheanoToken.float_vector], [pv.TheanoToken.float_scalar])).alpha
+        self.assertIsInstance(op, LiftedOp)
+        self.assertEqual(pickle.loads(pickle.dumps(op)), op)
+
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        prog.add_observation("57>output>56", precision=0.5)
+        traces = [pv.infer(prog, draws=100, chains=2, cores=cores, random_seed=5) for cores in [1, 2, 2]]
+        outputs = [trace.posterior["output"].values for trace in traces]
+        self.assertEqual(traces[1].posterior["age"].shape, (2, 100, 10))
+        self.assertTrue(np.allclose(traces[1].posterior["age"].mean(axis=-1), outputs[1]))
+        self.assertTrue(np.array_equal(outputs[1], outputs[2]))
+        #NOTE pm.sample tunes the chains that run one after the other with the same step, so only the first chain agrees
+        self.assertTrue(np.array_equal(outputs[1][0], outputs[0][0]))
+
+    def test_sampler_pool(self):
+        """
+        Ensures that a session with a sampler pool samples in warm workers that are reused, restarted when unhealthy
+        and stopped when idle
+        """
+        import time
+        session = pv.AnalysisSession()
+        pool = session.start_pool(workers=2, idle_timeout=60)
+        try:
+            pids = set()
+            for seed in [1, 2]:
+                age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+                prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+                prog.add_observation("57>output>56", precision=0.5)
+                trace = pv.infer(prog, draws=100, chains=2, symbolic=True, random_seed=seed, session=session)
+                self.assertEqual(trace.posterior.attrs["sampler"], "pool")
+                self.assertEqual(trace.posterior["age"].shape, (2, 100, 10))
+                self.assertTrue(np.allclose(trace.posterior["age"].mean(axis=-1), trace.posterior["output"]))
+                pids |= set(pool._executor._processes)
+            self.assertEqual(len(pids), 2)
+
+            #NOTE busy workers cannot answer a ping, the health check does not restart them while they sample
+            from concurrent.futures import ThreadPoolExecutor
+            model = pv.infer(prog, symbolic=True, return_model=True, session=pv.AnalysisSession())
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(pool.sample, model, draws=3000, chains=2)
+                while(pool._active == 0 and not future.done()):
+                    time.sleep(0.01)
+                self.assertTrue(pool.check(timeout=0.01))
+                self.assertEqual(set(pool._executor._processes), pids)
+                self.assertEqual(future.result().posterior["age"].shape, (2, 3000, 10))
+
+            for pid in pids:
+                os.kill(pid, 9)
+            time.sleep(1)
+            self.assertFalse(pool.check())
+            self.assertTrue(pool.restart().check())
+
+            pool.idle_timeout = 0.5
+            pool.start()
+            time.sleep(2)
+            self.assertFalse(pool.running)
+        finally:
+            session.close_pool()
+
+    def test_import_is_lazy(self):
+        """
+        Guards the lazy imports of privugger. Importing it, the scipy backend and the measures do not import pymc3 or
+        theano. The import time itself is measured by the benchmarks, it is too noisy for a test
+        """
+        import json
+        import subprocess
+        code = "\n".join([
+            "import sys, json",
+            "heavy = lambda: [m for m in ['pymc3', 'theano'] if m in sys.modules]",
+            "import privugger as pv",
+            "imported = heavy()",
+            "age = pv.Normal('age', mu=55.2, std=3.5, num_elements=10)",
+            f"prog = pv.Program('output', dataset=pv.Dataset(input_specs=[age]), output_type=pv.Float, function='{program_alpha}')",
+            "trace = pv.infer(prog, method='scipy', draws=100)",
+            "pv.mi_sklearn(trace, var_names=['output', 'output'])",
+            "print(json.dumps({'imported': imported, 'modules': heavy()}))",
+        ])
+        result = json.loads(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.splitlines()[-1])
+        self.assertEqual(result["imported"], [])
+        self.assertEqual(result["modules"], [])
+
+    def test_warm_up(self):
+        """
+        Ensures that the warm-up analyses every requested combination of tokens, including single element vectors and
+        compact integers
+        """
+        itypes = [pv.TheanoToken.single_element_float_vector, pv.TheanoToken.int_scalar]
+        runs = pv.warm_up(itypes=itypes, otypes=[pv.TheanoToken.float_scalar], precisions=["single"])
+        self.assertEqual([(run.itype, run.precision) for run in runs], [(itype, "single") for itype in itypes])
+        self.assertEqual([run.error for run in runs], [None, None])
+        with self.assertRaises(ValueError):
+            pv.warm_up(otypes=["VectorX"])
+
+    def test_profiling_events(self):
+        """
+        Ensures that infer emits one event per phase and one per run to every sink, and none without sinks
+        """
+        import json
+        import logging
+        pv.lift_cache_clear()
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        prog.add_observation("57>output>56", precision=0.5)
+        events = []
+        with tempfile.TemporaryDirectory() as d, self.assertLogs("privugger.profiling", level="INFO") as logs:
+            path = os.path.join(d, "events.jsonl")
+            with pv.profile(events.append, path, pv.LoggingSink()):
+                pv.infer(prog, draws=100, chains=2, cores=1, random_seed=4)
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(lines, json.loads(json.dumps(events)))
+        self.assertEqual(len(logs.records), len(events))
+        phases = [e["phase"] for e in events if e["event"] == "phase"]
+        self.assertEqual(phases, ["priors", "decorate", "load", "lift", "compile", "tune", "sample", "convert"])
+        self.assertEqual(events[-1]["event"], "run")
+        self.assertEqual({e["run"] for e in events}, {events[-1]["run"]})
+        self.assertEqual({e["program"] for e in events}, {"output"})
+        self.assertEqual([e["draws"] for e in events if e.get("phase") in ["tune", "sample"]], [2000, 200])
+        self.assertTrue(all(e["seconds"] >= 0 and e["peak_rss"] > 0 for e in events))
+
+        #NOTE with one core the chains run one after the other, and the 1000 tuning draws of the second chain are tuning,
+        #not sampling, time
+        seconds = {e["phase"]: e["seconds"] for e in events if e["event"] == "phase"}
+        self.assertGreater(seconds["tune"], 2 * seconds["sample"])
+        self.assertEqual([e["chains"] for e in events if e.get("phase") in ["tune", "sample"]], [2, 2])
+
+        pv.infer(prog, draws=100, chains=2, cores=1, random_seed=4)
+        self.assertEqual(len(lines), len(events))
+
+        #NOTE a sink that raises is logged, and the analysis and the other sinks go on
+        def failing(event):
+            raise OSError("No space left on device")
+        events = []
+        with self.assertLogs("privugger.inference.profiling", level="ERROR") as logs, pv.profile(failing, events.append):
+            trace = pv.infer(prog, draws=100, chains=2, cores=1, random_seed=4)
+        self.assertEqual(trace.posterior["output"].shape, (2, 100))
+        self.assertEqual(len(logs.records), len(events))
+        self.assertEqual(events[-1]["event"], "run")
+
+    def test_op_instrumentation(self):
+        """
+        Ensures that the calls of the lifted program are counted and timed only while they are instrumented, per thread
+        and apart for the tuning draws
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        with pv.instrument_ops() as stats:
+            trace = pv.infer(prog, draws=50, chains=2, cores=1, random_seed=4)
+        self.assertEqual(list(stats), [name for name in stats if name.startswith("alpha@")])
+        self.assertEqual(trace.posterior.attrs["program_calls"], 100)
+        self.assertEqual(trace.posterior.attrs["program_tune_calls"], 0)
+        self.assertEqual(trace.posterior.attrs["program_calls_per_draw"], 1.0)
+        self.assertEqual(trace.posterior.attrs["program_calls_per_accepted"], 1.0)
+
+        #NOTE an analysis in another thread is not counted by the block, and is not inflated by the calls of this thread
+        with pv.instrument_ops() as stats, ThreadPoolExecutor(max_workers=1) as executor:
+            other = executor.submit(pv.infer, prog, draws=50, chains=2, cores=1, random_seed=4)
+            trace = pv.infer(prog, draws=20, chains=2, cores=1, random_seed=4)
+            other = other.result()
+        self.assertEqual(trace.posterior.attrs["program_calls"], 40)
+        #NOTE the block also counts the call for the test value of the output
+        self.assertEqual(sum(s.calls for s in stats.values()), 41)
+        self.assertEqual(other.posterior.attrs["program_calls"], 100)
+
+        prog.add_observation("57>output>56", precision=0.5)
+        with pv.instrument_ops() as stats:
+            trace = pv.infer(prog, draws=100, chains=1, cores=1, random_seed=4)
+        [op] = stats.values()
+        attrs = trace.posterior.attrs
+        #NOTE the program is also called once for the test value of the output when the model is built
+        self.assertEqual(attrs["program_calls"], op.calls - 1)
+        self.assertEqual(sum(op.buckets), op.calls)
+        #NOTE pm.sample tunes for 1000 draws by default
+        self.assertGreater(attrs["program_tune_calls"], 0)
+        self.assertAlmostEqual(attrs["program_calls_per_tune_draw"], attrs["program_tune_calls"] / 1000)
+        self.assertLessEqual(attrs["program_tune_calls"] + 100 * attrs["program_calls_per_draw"], attrs["program_calls"])
+        self.assertGreaterEqual(attrs["program_calls_per_draw"], 1.0)
+        self.assertGreaterEqual(attrs["program_calls_per_accepted"], attrs["program_calls_per_draw"])
+        self.assertTrue(0 < attrs["program_time_share"] < 1)
+        self.assertTrue(op.quantile(0.5) <= op.quantile(0.99) and op.mean > 0)
+
+        calls = {name: s.calls for name, s in pv.op_stats().items()}
+        trace = pv.infer(prog, draws=100, chains=1, cores=1, random_seed=4)
+        self.assertEqual({name: s.calls for name, s in pv.op_stats().items()}, calls)
+        self.assertNotIn("program_calls", trace.posterior.attrs)
+
+        #NOTE chains sampled in worker processes are not counted, so their trace is not annotated
+        with pv.instrument_ops(), self.assertWarnsRegex(UserWarning, "worker processes"):
+            trace = pv.infer(prog, draws=50, chains=2, cores=2, random_seed=4)
+        self.assertEqual(trace.posterior["output"].shape, (2, 50))
+        self.assertNotIn("program_calls", trace.posterior.attrs)
+
+    def test_result_cache(self):
+        """
+        Ensures that a seeded analysis is returned from the result cache, and that changes of the spec or the sampler settings miss it
+        """
+        age   = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog  = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        with tempfile.TemporaryDirectory() as path:
+            cache = pv.ResultCache(path)
+            trace = pv.infer(prog, draws=100, chains=1, cores=1, random_seed=3, cache=cache)
+            with pv.instrument_ops() as stats:
+                cached = pv.infer(prog, draws=100, chains=1, cores=1, random_seed=3, cache=path)
+            self.assertEqual(len(stats), 0)
+            self.assertTrue(np.array_equal(cached.posterior["output"].values, trace.posterior["output"].values))
+            self.assertEqual(cached.posterior.attrs["lifting"], "as_op")
+
+            pv.infer(prog, draws=100, chains=1, cores=1, random_seed=4, cache=cache)
+            age.mu = 60
+            pv.infer(prog, draws=100, chains=1, cores=1, random_seed=3, cache=cache)
+            pv.infer(prog, draws=100, chains=1, cores=1, cache=cache)
+            self.assertEqual(cache.info()[:3], (0, 3, 3))
+
+            size = cache.info().size
+            cache.max_bytes = size - 1
+            cache.evict()
+            self.assertEqual(cache.info().entries, 2)
+
+    def test_sweep(self):
+        """
+        Ensures that a sweep samples every grid point from one model, and leaves the input specs as they were
+        """
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        events = []
+        with pv.profile(events.append):
+            results = pv.sweep(prog, {"age.mu": [40, 60.5], "age.std": [1, 5]}, draws=200, chains=1, random_seed=2)
+        self.assertEqual(list(results), [(40, 1), (40, 5), (60.5, 1), (60.5, 5)])
+        for (mu, std), trace in results.items():
+            self.assertAlmostEqual(float(trace.posterior["output"].mean()), mu, delta=1)
+        self.assertEqual([e["phase"] for e in events if e["event"] == "phase"].count("lift"), 1)
+        self.assertEqual((age.mu, age.std), (55.2, 3.5))
+
+        with self.assertRaises(ValueError):
+            pv.sweep(prog, {"age.sigma": [1, 2]})
+        with self.assertRaises(ValueError):
+            pv.sweep(prog, {"height.mu": [1, 2]})
+
+    def test_result_cache_pool(self):
+        """
+        Ensures that runs with and without a sampler pool, which seed their chains differently, do not share cached traces
+        """
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        prog = pv.Program("output", dataset=pv.Dataset(input_specs = [age]), output_type=pv.Float, function=program_alpha)
+        prog.add_observation("57>output>56", precision=0.5)
+        session = pv.AnalysisSession()
+        with tempfile.TemporaryDirectory() as path:
+            cache = pv.ResultCache(path)
+            local = pv.infer(prog, draws=50, chains=2, cores=1, symbolic=True, random_seed=5, cache=cache)
+            session.start_pool(workers=2, idle_timeout=60)
+            try:
+                pooled = pv.infer(prog, draws=50, chains=2, cores=1, symbolic=True, random_seed=5, cache=cache, session=session)
+            finally:
+                session.close_pool()
+            self.assertEqual(pooled.posterior.attrs["sampler"], "pool")
+            self.assertFalse(np.array_equal(local.posterior["age"].values, pooled.posterior["age"].values))
+            self.assertEqual(cache.info()[:3], (0, 2, 2))
+            cached = pv.infer(prog, draws=50, chains=2, cores=1, symbolic=True, random_seed=5, cache=cache)
+            self.assertTrue(np.array_equal(cached.posterior["age"].values, local.posterior["age"].values))
+
+    def test_symbolic_lifting(self):
+        """
+        Ensures that supported programs are lifted to native theano expressions and sampled with NUTS
+        """
+        age  = pv.Normal("age", mu=55.2, std=3.5, num_elements=10)
+        ds   = pv.Dataset(input_specs = [age])
+        prog = pv.Program("output", dataset=ds, output_type=pv.Float, function=program_alpha)
+
+        trace = pv.infer(prog, draws=500, chains=2, cores=1, symbolic=True, forward_sampling=False)
+        self.assertEqual(trace.posterior.attrs["lifting"], "symbolic")
+        self.assertIn("tree_size", trace.sample_stats)
+        self.assertTrue(np.allclose(trace.posterior["age"].mean(axis=-1), trace.posterior["output"]))
+
+    def test_symbolic_compiler(self):
+        """
+        Ensures that the symbolic compiler agrees with python, and rejects unsupported constructs
+        """
+        import theano
+        import theano.tensor as tt
+        from privugger.transformer.PyMC3.symbolic import compile_program, UnsupportedConstruct
+
+        source = """
+import numpy as np
+def f(xs, y):
+    s = sum([x * 2 for x in xs if x > y])
+    return s / len(xs) if y >= 0 else np.maximum(-y, xs.max())
+"""
+        def python(xs, y):
+            s = sum([x * 2 for x in xs if x > y])
+            return s / len(xs) if y >= 0 else np.maximum(-y, xs.max())
+
+        xs, y = tt.dvector("xs"), tt.dscalar("y")
+        #NOTE pymc3 models leave compute_test_value on after sampling, and these inputs have no test values
+        with theano.configparser.change_flags(compute_test_value="off"):
+            expression = compile_program(ast.parse(source), [xs, y], pv.TheanoToken.float_scalar)
+        f = theano.function([xs, y], expression)
+        for values, threshold in [([1.0, 5.0, 3.0], 2.0), ([1.0, 5.0, 3.0], -7.0)]:
+            self.assertAlmostEqual(float(f(values, threshold)), python(np.array(values), threshold))
+
+        with self.assertRaises(UnsupportedConstruct):
+            compile_program(ast.parse("def f(x):\n    for i in x:\n        pass\n    return x"), [xs], pv.TheanoToken.float_scalar)
+
+        ys = tt.dvector("ys")
+        unsupported = [("def f(xs, ys):\n    zs = ys * 2\n    return sum([a * zs for a in xs])", [xs, ys]),
+                       ("def f(xs, ys):\n    return sum([a + ys for a in xs])", [xs, ys]),
+                       ("def f(xs, y):\n    return xs", [xs, y]),
+                       ("def f(xs, y):\n    return 2 and y", [xs, y]),
+                       ("def f(xs, y):\n    return y and 1.0", [xs, y]),
+                       ("def f(xs, n):\n    return n or 1", [xs, tt.lscalar("n")])]
+        with theano.configparser.change_flags(compute_test_value="off"):
+            for program, inputs in unsupported:
+                with self.assertRaises(UnsupportedConstruct):
+                    compile_program(ast.parse(program), inputs, pv.TheanoToken.float_scalar)
+            expression = compile_program(ast.parse("def f(xs, y):\n    return 1.0 if y > 0 and y < 2 or y == 5 else 0.0"), [xs, y], pv.TheanoToken.float_scalar)
+        f = theano.function([y], expression)
+        self.assertEqual([float(f(v)) for v in [1.0, 3.0, 5.0]], [1.0, 0.0, 1.0])
+
+        #NOTE ties round to even, as in the as_op that runs the program with numpy
+        as_op = theano.compile.ops.as_op(itypes=[tt.dscalar], otypes=[tt.dscalar])(lambda v: np.round(v))
+        with theano.configparser.change_flags(compute_test_value="off"):
+            rounded = [compile_program(ast.parse(program), [xs, y], pv.TheanoToken.float_scalar)
+                       for program in ["import numpy as np\ndef f(xs, y):\n    return np.round(y)", "def f(xs, y):\n    return round(y)"]]
+            reference = as_op(y)
+        f = theano.function([y], rounded + [reference])
+        for v in [0.5, 1.5, 2.5, -0.5, -2.5]:
+            symbolic_numpy, symbolic_builtin, expected = f(v)
+            self.assertEqual(float(symbolic_numpy), float(expected))
+            self.assertEqual(float(symbolic_builtin), float(expected))
+
+    def test_symbolic_fallback(self):
+        """
+        Ensures that programs the symbolic compiler rejects, e.g., boolean operators on numbers, fall back to an as_op
+        """
+        for spec, function in [(pv.DiscreteUniform("n", 0, 3), program_int_and), (pv.Normal("x", mu=1.0, std=1.0), program_float_and)]:
+            prog = pv.Program("output", dataset=pv.Dataset(input_specs = [spec]), output_type=pv.Float, function=function)
+            trace = pv.infer(prog, draws=50, chains=1, cores=1, symbolic=True, random_seed=1)
+            self.assertEqual(trace.posterior.attrs["lifting"], "as_op")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,252 @@
+"""
+In-memory loading of lifted programs. Lifted programs used to be written to `typed.py` in the
+working directory and imported from there; here they are compiled straight into module objects.
+
+The modules are registered in `sys.modules` under a hash of their source, which is the registry of
+lifted programs of a process. Lifted ops pickle their source, so a process that unpickles one, e.g.
+a worker of `pm.sample(cores=N)` started with the spawn method, rebuilds the module from source.
+"""
+import ast
+import sys
+import hashlib
+import threading
+import time
+import astor
+from collections import OrderedDict, namedtuple
+from theano.compile.ops import FromFunctionOp
+from privugger.transformer.PyMC3.type_decoration import FunctionTypeDecorator
+from privugger.transformer.PyMC3.theano_types import get_precision
+from privugger.transformer.PyMC3.loading import LIFTED_MODULE_PREFIX, load_source, load_program_file, _module_name
+from privugger.inference import profiling
+from privugger.transformer.PyMC3 import op_stats
+
+
+class LiftedOp(FromFunctionOp):
+    """
+    The `as_op` of a lifted program, together with the source of its module. It is pickled as its
+    source and name, and unpickled by loading the module from the registry, compiling it if it is not there
+
+    Attributes
+    -----------
+    source: String with the python source of the lifted module
+
+    name: String with the name of the op in the module
+
+    key: String with the name and a hash of the source, under which the calls of the op are counted, see op_stats
+    """
+
+    def __init__(self, fn, itypes, otypes, source, name):
+        super().__init__(fn, itypes, otypes, None)
+        self.source = source
+        self.name = name
+        self.key = f"{name}@{hashlib.sha256(source.encode('utf-8')).hexdigest()[:8]}"
+
+    def perform(self, node, inputs, outputs):
+        if(not op_stats.instrumented()):
+            return super().perform(node, inputs, outputs)
+        start = time.perf_counter()
+        try:
+            super().perform(node, inputs, outputs)
+        finally:
+            op_stats.record(self.key, time.perf_counter() - start)
+
+    def __reduce__(self):
+        return (lifted_op, (self.source, self.name))
+
+
+def lifted_op(source, name):
+    """
+    Returns an op of a lifted module given by its source, loading the module if needed
+    """
+    return getattr(load_lifted_source(source), name)
+
+
+def _split_as_ops(source):
+    """
+    Removes the `as_op` decorators from the functions of a lifted source
+
+    Returns
+    ------------
+    Tuple with the source of the undecorated functions and a dict from function name to the keywords of its decorator
+    """
+    tree = ast.parse(source)
+    decorators = {}
+    for node in tree.body:
+        if(isinstance(node, ast.FunctionDef)):
+            for decorator in list(node.decorator_list):
+                if(isinstance(decorator, ast.Call) and isinstance(decorator.func, ast.Attribute) and decorator.func.attr == "as_op"):
+                    node.decorator_list.remove(decorator)
+                    decorators[node.name] = decorator.keywords
+    return astor.to_source(tree), decorators
+
+
+def load_lifted_source(source):
+    """
+    Compiles the source of a lifted program into a module object, whose `as_op` ops are picklable LiftedOps.
+    `method` looks them up in the module when it is called, so it applies the LiftedOps
+    """
+    #NOTE the functions are loaded without their as_op decorators, so the LiftedOps wrap the program functions themselves.
+    #The module is named after the lifted source, programs that only differ in the types of their ops get their own modules
+    undecorated, decorators = _split_as_ops(source)
+    module = load_source(undecorated, name=_module_name(source))
+    for name, keywords in decorators.items():
+        fn = getattr(module, name)
+        if(isinstance(fn, LiftedOp)):
+            continue
+        types = {k.arg: eval(compile(ast.Expression(k.value), module.__file__, "eval"), vars(module)) for k in keywords}
+        setattr(module, name, LiftedOp(fn, types["itypes"], types["otypes"], source, name))
+    return module
+
+
+def load_lifted_module(program):
+    """
+    Compiles a lifted program into a module object without touching the filesystem
+
+    Parameters
+    ------------
+    program: Python AST node with the lifted program, as returned by `FunctionTypeDecorator.wrap_with_theano_import`
+
+    Returns
+    ------------
+    The module object containing the lifted `method`
+    """
+    return load_lifted_source(astor.to_source(program))
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class LiftCache:
+    """
+    Content-addressed LRU cache of lifted programs
+
+    Entries are keyed by a hash of the normalized program AST together with the itypes/otype of
+    the theano op. A program whose source and type signature did not change is neither lifted nor
+    decorated again, and the op built when its module was loaded is reused.
+
+    Attributes
+    -----------
+    maxsize: int maximum number of lifted programs kept. Default: 128
+
+    hits: int number of lookups that found a lifted program
+
+    misses: int number of lookups that had to lift the program
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        #NOTE analysis sessions in different threads share the cache
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(tree, decorators, precision="double"):
+        """
+        Computes the cache key of a parsed (not yet lifted) program
+
+        Parameters
+        ------------
+        tree: Python AST of the program as returned by `FunctionTypeDecorator.parse_program`
+        decorators: tuple (itypes, otype) as given to `FunctionTypeDecorator.lift`
+        precision: String with the precision policy the program is lifted with. Default "double"
+
+        Returns
+        ------------
+        String with the hex digest of the key
+        """
+        #NOTE ast.dump leaves out line numbers and columns, so formatting and comments do not change the key
+        normalized = ast.dump(tree, include_attributes=False)
+        itypes, otype = decorators
+        signature = repr((tuple(itypes), tuple(otype), precision))
+        return hashlib.sha256((normalized + signature).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            module = self._entries.get(key)
+            if module is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return module
+
+    def put(self, key, module):
+        with self._lock:
+            self._entries[key] = module
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                if(evicted not in self._entries.values() and sys.modules.get(evicted.__name__) is evicted):
+                    del sys.modules[evicted.__name__]
+
+    def info(self):
+        """
+        Returns
+        ------------
+        CacheInfo named tuple with the hits, misses, maxsize and current size of the cache
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            for module in self._entries.values():
+                if(sys.modules.get(module.__name__) is module):
+                    del sys.modules[module.__name__]
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+lift_cache = LiftCache()
+
+
+def lift_cache_info():
+    """
+    Reports the hits and misses of the cache of lifted programs used by `infer`
+
+    Returns
+    ------------
+    CacheInfo named tuple with the hits, misses, maxsize and current size of the cache
+    """
+    return lift_cache.info()
+
+
+def lift_cache_clear():
+    """
+    Empties the cache of lifted programs used by `infer` and resets its statistics
+    """
+    lift_cache.clear()
+
+
+def lift_program(program, decorators, cache=None, precision=None):
+    """
+    Lifts a program and loads it as a module, reusing a previously lifted program when its
+    normalized AST and type signature are already in the cache
+
+    Parameters
+    ------------
+    program: path to program, a lambda or a function
+    decorators: tuple (itypes, otype) with the types of the theano op
+    cache: LiftCache to use. Default: the module wide `lift_cache`
+    precision: String with the precision policy of the theano op. Default: the policy in use
+
+    Returns
+    ------------
+    The module object containing the lifted `method`
+    """
+    if(cache is None):
+        cache = lift_cache
+    precision = precision or get_precision()
+    ftp = FunctionTypeDecorator(precision=precision)
+    tree = ftp.parse_program(program)
+    key = cache.key(tree, decorators, precision)
+    module = cache.get(key)
+    if(module is None):
+        with profiling.phase("decorate"):
+            lifted_program = ftp.lift(tree, decorators)
+        with profiling.phase("load"):
+            module = load_lifted_module(ftp.wrap_with_theano_import(lifted_program))
+        cache.put(key, module)
+    return module
@@ -0,0 +1,68 @@
+"""
+Compilation of python source into module objects, without touching the filesystem. This module
+does not import theano, so the backends that run programs directly on samples can use it.
+"""
+import sys
+import types
+import hashlib
+import threading
+
+LIFTED_MODULE_PREFIX = "privugger_lifted_"
+
+#NOTE analyses in different threads may load the same source, which must be compiled and registered once
+_lock = threading.Lock()
+
+
+def _module_name(source):
+    return LIFTED_MODULE_PREFIX + hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+
+
+def load_source(source, name=None):
+    """
+    Compiles python source code into a module object without touching the filesystem
+
+    Parameters
+    ------------
+    source: String with the python source of the module
+    name: String with the name of the module. Default: a name derived from a hash of the source
+
+    Returns
+    ------------
+    The module object. Modules are named after a hash of their source and registered in
+    `sys.modules`, so loading the same source twice returns the same module
+    """
+    name = name or _module_name(source)
+    with _lock:
+        module = sys.modules.get(name)
+        if module is None:
+            module = types.ModuleType(name)
+            module.__file__ = f"<{name}>"
+            code = compile(source, module.__file__, "exec")
+            exec(code, module.__dict__)
+            sys.modules[name] = module
+    return module
+
+
+def load_program_file(path):
+    """
+    Loads a program given as a path to a file, renaming its function definitions to `method`.
+    This is used by the backends that run the program directly on samples
+
+    Parameters
+    ------------
+    path: String with the path to the program
+
+    Returns
+    ------------
+    The module object containing `method`
+    """
+    import re
+    with open(path, "r") as f:
+        lines = []
+        for l in f.readlines():
+            res = re.findall(r"def [a-zA-Z]+\(", l)
+            if len(res):
+                lines.append(re.sub(r"def [a-zA-Z]+\(", "def method(", l))
+            else:
+                lines.append(l)
+    return load_source("".join(lines))
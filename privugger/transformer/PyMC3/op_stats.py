@@ -0,0 +1,277 @@
+import contextlib
+import threading
+import copy
+import math
+import numpy as np
+
+"""
+Call-level instrumentation of lifted programs. When it is switched on, every call of the `as_op` of a
+lifted program is counted and timed, and its latency is added to a histogram with buckets whose upper
+edges double from 1 microsecond (`BUCKET_EDGES`).
+
+The statistics of `op_stats` are kept per process and per op. `instrument_ops` and the attributes that
+`infer` adds to a trace only count the calls made by the thread that uses them, so analyses running in
+other threads do not inflate them. The chains of `pm.sample(cores=N)` and of the sampler pool run in worker
+processes, whose calls are not counted, so the program should be sampled with `cores=1` while it is
+measured. `infer` warns and leaves the attributes out of a trace whose chains ran in worker processes.
+Forward sampling calls the program in the analysis process.
+"""
+
+BUCKET_EDGES = [1e-6 * 2 ** k for k in range(25)]
+
+_enabled = False
+_stats   = {}
+_lock    = threading.Lock()
+_local   = threading.local()
+
+
+class OpStats:
+    """
+    Calls and latencies of one lifted op
+
+    Attributes
+    -----------
+    name: String with the name of the op
+
+    calls: Int number of calls
+
+    seconds: Float total time spent in the program
+
+    buckets: list with the number of calls per latency bucket. The last bucket has the calls slower than the
+    last edge of BUCKET_EDGES
+    """
+
+    def __init__(self, name):
+        self.name    = name
+        self.calls   = 0
+        self.seconds = 0.0
+        self.min     = math.inf
+        self.max     = 0.0
+        self.buckets = [0] * (len(BUCKET_EDGES) + 1)
+
+    def record(self, seconds):
+        self.calls   += 1
+        self.seconds += seconds
+        self.min      = min(self.min, seconds)
+        self.max      = max(self.max, seconds)
+        bucket = 0 if seconds <= BUCKET_EDGES[0] else math.ceil(math.log2(seconds / BUCKET_EDGES[0]))
+        self.buckets[min(bucket, len(BUCKET_EDGES))] += 1
+
+    @property
+    def mean(self):
+        return self.seconds / self.calls if self.calls else 0.0
+
+    def quantile(self, q):
+        """
+        Returns the upper edge of the latency bucket that contains the q-quantile of the calls, in seconds
+        """
+        if(self.calls == 0):
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.buckets), q * self.calls))
+        return BUCKET_EDGES[index] if index < len(BUCKET_EDGES) else self.max
+
+    def since(self, before):
+        """
+        Returns the OpStats of the calls made after the snapshot `before` of the same op. The minimum and maximum
+        latencies are the ones of all calls
+        """
+        delta = copy.copy(self)
+        delta.calls   = self.calls - before.calls
+        delta.seconds = self.seconds - before.seconds
+        delta.buckets = [a - b for a, b in zip(self.buckets, before.buckets)]
+        return delta
+
+    def as_dict(self):
+        return {"name": self.name, "calls": self.calls, "seconds": self.seconds, "mean": self.mean,
+                "min": self.min if self.calls else 0.0, "max": self.max,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99),
+                "buckets": list(self.buckets)}
+
+    def __repr__(self):
+        return f"OpStats({self.name!r}, calls={self.calls}, seconds={self.seconds:.6f}, mean={self.mean:.2e})"
+
+
+def set_op_instrumentation(enabled):
+    """
+    Switches the counting and timing of the calls of lifted programs on or off
+    """
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def instrumented():
+    """
+    Returns True if the calls of lifted programs are counted
+    """
+    return _enabled
+
+
+def op_stats():
+    """
+    Returns a dict from the names of the lifted ops to their OpStats
+    """
+    with _lock:
+        return dict(_stats)
+
+
+def reset_op_stats():
+    """
+    Drops the statistics of all lifted ops
+    """
+    with _lock:
+        _stats.clear()
+
+
+class CallCounter:
+    """
+    Calls of the lifted programs made by one thread while it samples, split into the calls of the tuning draws and
+    of the kept draws. It is the callback of `pm.sample`: the calls made since the previous draw of the thread are
+    assigned to the phase of the draw that ends, so the calls of the initialization of a chain count as tuning calls.
+    Without draws, e.g. in forward sampling, all calls are pending
+
+    Attributes
+    -----------
+    tune_calls: Int number of calls of the tuning draws
+
+    draw_calls: Int number of calls of the kept draws
+
+    pending: Int number of calls made after the last draw, or without draws
+
+    tune_draws: Int number of tuning draws of all chains
+
+    draws: Int number of kept draws of all chains
+
+    seconds: Float time spent in the programs
+    """
+
+    def __init__(self):
+        self.tune_calls = 0
+        self.draw_calls = 0
+        self.pending    = 0
+        self.tune_draws = 0
+        self.draws      = 0
+        self.seconds    = 0.0
+
+    @property
+    def calls(self):
+        return self.tune_calls + self.draw_calls + self.pending
+
+    def record(self, name, seconds):
+        self.pending += 1
+        self.seconds += seconds
+
+    def __call__(self, trace, draw):
+        if(draw.tuning):
+            self.tune_calls += self.pending
+            self.tune_draws += 1
+        else:
+            self.draw_calls += self.pending
+            self.draws      += 1
+        self.pending = 0
+
+
+class _OpCollector(dict):
+    #NOTE the OpStats of the calls of one thread, by op name
+
+    def record(self, name, seconds):
+        stats = self.get(name)
+        if(stats is None):
+            stats = self[name] = OpStats(name)
+        stats.record(seconds)
+
+
+def _collectors():
+    if(not hasattr(_local, "collectors")):
+        _local.collectors = []
+    return _local.collectors
+
+
+@contextlib.contextmanager
+def counting(counter):
+    """
+    Adds the calls of lifted programs made by the current thread in a `with` block to counter, e.g. a CallCounter
+    """
+    collectors = _collectors()
+    collectors.append(counter)
+    try:
+        yield counter
+    finally:
+        collectors.remove(counter)
+
+
+@contextlib.contextmanager
+def instrument_ops():
+    """
+    Counts and times the calls of lifted programs in a `with` block. Yields a dict from op names to the OpStats of
+    the calls made by the current thread in the block
+    """
+    previous = _enabled
+    set_op_instrumentation(True)
+    calls = _OpCollector()
+    try:
+        with counting(calls):
+            yield calls
+    finally:
+        set_op_instrumentation(previous)
+
+
+def record(name, seconds):
+    with _lock:
+        stats = _stats.get(name)
+        if(stats is None):
+            stats = _stats[name] = OpStats(name)
+        stats.record(seconds)
+    for collector in _collectors():
+        collector.record(name, seconds)
+
+
+def acceptance_rate(trace):
+    """
+    Returns the fraction of the draws of an arviz trace in which any variable changed from the previous draw of its chain
+    """
+    moved = None
+    for values in trace.posterior.data_vars.values():
+        values = np.asarray(values)
+        if(values.shape[1] < 2):
+            return 1.0
+        changed = (values[:, 1:] != values[:, :-1]).reshape(values.shape[0], values.shape[1] - 1, -1).any(axis=-1)
+        moved = changed if moved is None else moved | changed
+    return float(moved.mean()) if moved is not None else 1.0
+
+
+def annotate(trace, counter, seconds, draws):
+    """
+    Records the calls of the lifted programs made while a trace was sampled in the attributes of its posterior
+
+    - "program_calls": Int number of calls
+    - "program_seconds": Float time spent in the programs
+    - "program_time_share": Float fraction of the sampling time spent in the programs. The rest is the sampler
+    - "program_tune_calls": Int number of calls of the tuning draws
+    - "program_calls_per_tune_draw": Float calls per tuning draw of every chain
+    - "program_calls_per_draw": Float calls per kept draw of every chain
+    - "program_calls_per_accepted": Float calls per kept draw in which the chain moved
+
+    Parameters
+    -----------
+    trace: Arviz InferenceData
+
+    counter: CallCounter that counted the calls while the trace was sampled
+
+    seconds: Float wall-clock time of the sampling
+
+    draws: Int total number of kept draws of all chains, used when the counter saw no draws, e.g. in forward sampling
+    """
+    if(counter.draws or counter.tune_draws):
+        draw_calls, draws = counter.draw_calls, counter.draws
+    else:
+        draw_calls = counter.pending
+    attrs = trace.posterior.attrs
+    attrs["program_calls"]               = counter.calls
+    attrs["program_seconds"]             = counter.seconds
+    attrs["program_time_share"]          = counter.seconds / seconds if seconds > 0 else 0.0
+    attrs["program_tune_calls"]          = counter.tune_calls
+    attrs["program_calls_per_tune_draw"] = counter.tune_calls / counter.tune_draws if counter.tune_draws else 0.0
+    attrs["program_calls_per_draw"]      = draw_calls / draws if draws else 0.0
+    #NOTE the trace only has the kept draws, so the acceptance rate and the calls per draw are of the same draws
+    rate = acceptance_rate(trace)
+    attrs["program_calls_per_accepted"] = attrs["program_calls_per_draw"] / rate if rate > 0 else math.inf
@@ -0,0 +1,366 @@
+import ast
+import functools
+import theano.tensor as tt
+from privugger.transformer.PyMC3.theano_types import TheanoToken
+
+"""
+Symbolic lifting. Instead of wrapping the program in an opaque `as_op`, the supported subset of
+python is translated into a native theano expression over the priors. The resulting graph has
+gradients, so it can be sampled with NUTS, and it is optimized and compiled by theano.
+"""
+
+
+class UnsupportedConstruct(TypeError):
+    """
+    Raised when the program uses a construct that the symbolic lifting does not support
+    """
+    pass
+
+
+_ELEMENTWISE_FUNCTIONS = {
+    "exp": tt.exp,
+    "log": tt.log,
+    "sqrt": tt.sqrt,
+    "abs": tt.abs_,
+    "absolute": tt.abs_,
+    "fabs": tt.abs_,
+    "floor": tt.floor,
+    "ceil": tt.ceil,
+    #NOTE python and numpy round halves to even, older theano releases round them away from zero by default
+    "round": functools.partial(tt.round, mode="half_to_even"),
+    "maximum": tt.maximum,
+    "minimum": tt.minimum,
+    "where": tt.switch,
+    "clip": tt.clip,
+    "power": tt.pow,
+    "pow": tt.pow,
+    "square": tt.sqr,
+}
+
+_REDUCTIONS = {
+    "sum": tt.sum,
+    "mean": tt.mean,
+    "prod": tt.prod,
+    "max": tt.max,
+    "min": tt.min,
+    "var": tt.var,
+    "std": tt.std,
+    "any": tt.any,
+    "all": tt.all,
+    "size": lambda x: tt.as_tensor_variable(x).size,
+    "count_nonzero": lambda x: tt.sum(tt.neq(x, 0)),
+    "dot": tt.dot,
+}
+
+_METHODS = {"sum", "mean", "prod", "max", "min", "var", "std", "any", "all"}
+
+_ATTRIBUTES = {"size", "shape", "T"}
+
+_COMPARISONS = {
+    ast.Lt: tt.lt,
+    ast.LtE: tt.le,
+    ast.Gt: tt.gt,
+    ast.GtE: tt.ge,
+    ast.Eq: tt.eq,
+    ast.NotEq: tt.neq,
+}
+
+_BINARY_OPERATORS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.FloorDiv: lambda a, b: a // b,
+    ast.Mod: lambda a, b: a % b,
+    ast.Pow: lambda a, b: a ** b,
+}
+
+
+def _ndim(value):
+    return getattr(value, "ndim", 0)
+
+
+def _output_ndim(otype):
+    if otype in (TheanoToken.int_scalar, TheanoToken.float_scalar):
+        return 0
+    if otype in (TheanoToken.int_matrix, TheanoToken.float_matrix):
+        return 2
+    return 1
+
+
+def _output_dtype(otype):
+    if otype in (TheanoToken.int_scalar, TheanoToken.int_vector, TheanoToken.int_matrix, TheanoToken.single_element_int_vector):
+        return "int64"
+    return "float64"
+
+
+class SymbolicCompiler(ast.NodeVisitor):
+    """
+    Translates a function definition into a theano expression over the given inputs.
+
+    Supported constructs are assignments to names, a final return, arithmetic, comparisons,
+    boolean operators, conditional expressions, `sum`/`len`/`abs`/`min`/`max`, the reductions
+    and attributes of arrays (e.g. `age.sum()` and `age.size`), elementwise and reducing numpy
+    functions, list literals, and list comprehensions over the elements of an input. Any other
+    construct raises UnsupportedConstruct.
+    """
+
+    def __init__(self, numpy_aliases=("np", "numpy", "math")):
+        self.numpy_aliases = set(numpy_aliases)
+        self.env = {}
+        self.elementwise = False
+        self.loop_variables = set()
+
+    def compile_function(self, function_def, inputs):
+        """
+        Parameters
+        ------------
+        function_def: ast.FunctionDef of the program
+        inputs: list of theano variables, one per argument of the program
+
+        Return
+        -----------
+        theano expression of the return value of the program
+        """
+        arg_names = [a.arg for a in function_def.args.args]
+        if(len(arg_names) != len(inputs)):
+            raise UnsupportedConstruct("The number of arguments does not match the number of inputs")
+        self.env = dict(zip(arg_names, inputs))
+
+        for stmt in function_def.body:
+            if(isinstance(stmt, ast.Return)):
+                return self.visit(stmt.value)
+            elif(isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name)):
+                self.env[stmt.targets[0].id] = self.visit(stmt.value)
+            elif(isinstance(stmt, ast.AugAssign) and isinstance(stmt.target, ast.Name)):
+                self.env[stmt.target.id] = self._binary(stmt.op, self.visit(ast.Name(id=stmt.target.id, ctx=ast.Load())), self.visit(stmt.value))
+            elif(isinstance(stmt, ast.Expr) and isinstance(getattr(stmt.value, "value", getattr(stmt.value, "s", None)), str)):
+                #NOTE docstring
+                continue
+            else:
+                raise UnsupportedConstruct(f"Unsupported statement {type(stmt).__name__}")
+        raise UnsupportedConstruct("The program does not end with a return")
+
+    def generic_visit(self, node):
+        raise UnsupportedConstruct(f"Unsupported expression {type(node).__name__}")
+
+    def visit_Constant(self, node):
+        if(isinstance(node.value, bool) or isinstance(node.value, (int, float))):
+            return node.value
+        raise UnsupportedConstruct(f"Unsupported constant {node.value!r}")
+
+    def visit_Num(self, node):
+        return node.n
+
+    def visit_NameConstant(self, node):
+        if(isinstance(node.value, bool)):
+            return node.value
+        raise UnsupportedConstruct(f"Unsupported constant {node.value!r}")
+
+    def visit_Name(self, node):
+        if(node.id not in self.env):
+            raise UnsupportedConstruct(f"Unknown name {node.id}")
+        value = self.env[node.id]
+        #NOTE inside a comprehension the loop variable stands for all elements at once, so any other array would be
+        #combined with it elementwise instead of once per element as in python
+        if(self.elementwise and node.id not in self.loop_variables and _ndim(value) > 0):
+            raise UnsupportedConstruct(f"The array {node.id} cannot be used inside a list comprehension")
+        return value
+
+    def _binary(self, op, left, right):
+        if(type(op) not in _BINARY_OPERATORS):
+            raise UnsupportedConstruct(f"Unsupported operator {type(op).__name__}")
+        return _BINARY_OPERATORS[type(op)](left, right)
+
+    def visit_BinOp(self, node):
+        return self._binary(node.op, self.visit(node.left), self.visit(node.right))
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        if(isinstance(node.op, ast.USub)):
+            return -operand
+        elif(isinstance(node.op, ast.UAdd)):
+            return operand
+        elif(isinstance(node.op, ast.Not)):
+            return tt.eq(operand, 0)
+        raise UnsupportedConstruct(f"Unsupported operator {type(node.op).__name__}")
+
+    def visit_Compare(self, node):
+        #NOTE chained comparisons such as `a < b < c` are translated to `a < b and b < c`
+        result = None
+        left = self.visit(node.left)
+        for op, comparator in zip(node.ops, node.comparators):
+            if(type(op) not in _COMPARISONS):
+                raise UnsupportedConstruct(f"Unsupported comparison {type(op).__name__}")
+            right = self.visit(comparator)
+            comparison = _COMPARISONS[type(op)](left, right)
+            result = comparison if result is None else tt.and_(result, comparison)
+            left = right
+        return result
+
+    def visit_BoolOp(self, node):
+        #NOTE tt.and_ and tt.or_ are bitwise, they agree with python only on booleans
+        combine = tt.and_ if isinstance(node.op, ast.And) else tt.or_
+        values = [self.visit(v) for v in node.values]
+        if(not all(isinstance(v, bool) or getattr(v, "dtype", None) == "bool" for v in values)):
+            raise UnsupportedConstruct("and/or are only supported on booleans")
+        result = values[0]
+        for v in values[1:]:
+            result = combine(result, v)
+        return result
+
+    def visit_IfExp(self, node):
+        return tt.switch(self.visit(node.test), self.visit(node.body), self.visit(node.orelse))
+
+    def visit_List(self, node):
+        return tt.stack([self.visit(e) for e in node.elts])
+
+    visit_Tuple = visit_List
+
+    def visit_Subscript(self, node):
+        if(self.elementwise):
+            raise UnsupportedConstruct("Indexing is not supported inside list comprehensions")
+        value = self.visit(node.value)
+        index = node.slice
+        if(isinstance(index, ast.Index)):
+            index = index.value
+        return value[self._index(index)]
+
+    def _index(self, index):
+        if(isinstance(index, ast.Slice)):
+            return slice(*[None if i is None else self.visit(i) for i in (index.lower, index.upper, index.step)])
+        if(isinstance(index, ast.Tuple)):
+            return tuple(self._index(i) for i in index.elts)
+        return self.visit(index)
+
+    def visit_Attribute(self, node):
+        if(node.attr not in _ATTRIBUTES or self.elementwise):
+            raise UnsupportedConstruct(f"Unsupported attribute {node.attr}")
+        value = tt.as_tensor_variable(self.visit(node.value))
+        if(node.attr == "size"):
+            #NOTE pymc3 random variables shadow the `size` attribute of theano tensors
+            return value.shape.prod()
+        return getattr(value, node.attr)
+
+    def visit_ListComp(self, node):
+        #NOTE a comprehension over the elements of an input is elementwise, so the loop variable
+        #is bound to the whole input and the element expression is applied to all of it at once
+        if(len(node.generators) != 1 or node.generators[0].ifs or not isinstance(node.generators[0].target, ast.Name)):
+            raise UnsupportedConstruct("Only list comprehensions with a single loop and no conditions are supported")
+        return self._comprehension(node.elt, node.generators[0])
+
+    def _comprehension(self, elt, generator, default=None):
+        iterable = self.visit(generator.iter)
+        name = generator.target.id
+        shadowed = self.env.get(name)
+        self.env[name] = iterable
+        elementwise, loop_variables = self.elementwise, self.loop_variables
+        self.elementwise, self.loop_variables = True, loop_variables | {name}
+        try:
+            result = self.visit(elt)
+            for condition in generator.ifs:
+                result = tt.switch(self.visit(condition), result, default)
+            #NOTE the element expression may not depend on the loop variable
+            result = result + tt.zeros_like(iterable)
+        finally:
+            self.elementwise, self.loop_variables = elementwise, loop_variables
+            if(shadowed is None):
+                del self.env[name]
+            else:
+                self.env[name] = shadowed
+        return result
+
+    def _sum(self, args):
+        if(len(args) != 1):
+            raise UnsupportedConstruct("sum with a start value is not supported")
+        arg = args[0]
+        #NOTE `sum(e for x in xs if c)` keeps the filter by summing zeros for the filtered elements
+        if(isinstance(arg, (ast.ListComp, ast.GeneratorExp)) and len(arg.generators) == 1 and isinstance(arg.generators[0].target, ast.Name)):
+            return tt.sum(self._comprehension(arg.elt, arg.generators[0], default=0))
+        return tt.sum(self.visit(arg))
+
+    def _builtin(self, name, node):
+        if(name == "sum"):
+            return self._sum(node.args)
+        args = [self.visit(a) for a in node.args]
+        if(name == "len" and len(args) == 1):
+            return tt.as_tensor_variable(args[0]).shape[0]
+        elif(name == "abs" and len(args) == 1):
+            return tt.abs_(args[0])
+        elif(name in ("max", "min") and len(args) == 1):
+            return _REDUCTIONS[name](args[0])
+        elif(name in ("max", "min") and len(args) == 2):
+            return tt.maximum(*args) if name == "max" else tt.minimum(*args)
+        elif(name == "round" and len(args) == 1):
+            return _ELEMENTWISE_FUNCTIONS["round"](args[0])
+        elif(name == "float" and len(args) == 1):
+            return tt.cast(args[0], "float64")
+        elif(name == "int" and len(args) == 1):
+            return tt.cast(args[0], "int64")
+        raise UnsupportedConstruct(f"Unsupported function {name}")
+
+    def visit_Call(self, node):
+        if(node.keywords):
+            raise UnsupportedConstruct("Keyword arguments are not supported")
+        func = node.func
+        if(isinstance(func, ast.Name)):
+            if(func.id in self.env):
+                raise UnsupportedConstruct(f"Calling {func.id} is not supported")
+            return self._builtin(func.id, node)
+
+        if(isinstance(func, ast.Attribute)):
+            if(isinstance(func.value, ast.Name) and func.value.id in self.numpy_aliases and func.value.id not in self.env):
+                args = [self.visit(a) for a in node.args]
+                if(func.attr in _ELEMENTWISE_FUNCTIONS):
+                    return _ELEMENTWISE_FUNCTIONS[func.attr](*args)
+                if(func.attr in _REDUCTIONS and not self.elementwise):
+                    return _REDUCTIONS[func.attr](*args)
+                raise UnsupportedConstruct(f"Unsupported function {func.value.id}.{func.attr}")
+            if(func.attr in _METHODS and not self.elementwise):
+                value = tt.as_tensor_variable(self.visit(func.value))
+                args = [self.visit(a) for a in node.args]
+                return getattr(value, func.attr)(*args)
+        raise UnsupportedConstruct("Unsupported call")
+
+
+def _numpy_aliases(tree):
+    aliases = {"np", "numpy", "math"}
+    for node in tree.body:
+        if(isinstance(node, ast.Import)):
+            for alias in node.names:
+                if(alias.name in ("numpy", "math")):
+                    aliases.add(alias.asname or alias.name)
+        elif(isinstance(node, ast.FunctionDef)):
+            continue
+        else:
+            raise UnsupportedConstruct(f"Unsupported module level statement {type(node).__name__}")
+    return aliases
+
+
+def compile_program(tree, inputs, otype):
+    """
+    Lifts a program into a native theano expression
+
+    Parameters
+    ------------
+    tree: Python AST of the program as returned by `FunctionTypeDecorator.parse_program`
+    inputs: list of theano variables, one per argument of the program
+    otype: TheanoToken with the output type of the program
+
+    Return
+    -----------
+    theano expression computing the output of the program. Raises UnsupportedConstruct
+    if the program cannot be lifted symbolically
+    """
+    compiler = SymbolicCompiler(_numpy_aliases(tree))
+    function_def = None
+    for node in tree.body:
+        if(isinstance(node, ast.FunctionDef)):
+            function_def = node
+            break
+    if(function_def is None):
+        raise UnsupportedConstruct("did not find any function definition in program")
+    expression = tt.as_tensor_variable(compiler.compile_function(function_def, inputs))
+    if(expression.ndim != _output_ndim(otype)):
+        raise UnsupportedConstruct(f"The program returns an array with {expression.ndim} dimensions, the output type has {_output_ndim(otype)}")
+    return tt.cast(expression, _output_dtype(otype))
@@ -1,8 +1,22 @@
+import threading
+import contextlib
+import numpy as np
+from privugger.lazy import lazy_import
 
+"""
+Theano types of lifted programs, and precision policies. A precision policy fixes the float dtype of the priors, of the lifted programs and of the traces, and
+whether discrete priors use the smallest integer dtype that holds their support.
+
+- "double": float64 and int64. This is the default
+- "single": float32, and int16 for discrete distributions whose finite support fits in it
+
+The policy is set for the whole process with `set_precision`, and can be overridden per program with the
+`precision` argument of `privugger.Program`.
+"""
 
 class TheanoToken():
     """
-    A enum-like class representing mappings from string values to theano types 
+    A enum-like class representing mappings from string values to theano types
     """
     int_vector = "VectorI"
     float_vector = "VectorF"
@@ -14,4 +28,197 @@ class TheanoToken():
     single_element_int_vector = 'Single_element_VectorI'
 
 
-    
+PRECISIONS = {
+    "double": ("float64", False),
+    "single": ("float32", True),
+}
+
+#NOTE pymc3 only accepts int16 and int64 for discrete variables
+COMPACT_INT = "int16"
+
+theano = lazy_import("theano")
+
+_default = "double"
+_local   = threading.local()
+
+#NOTE floatX is a process wide theano flag. The threads that use precision policies with the same float dtype share
+#it, a thread that needs another dtype waits until the flag is free
+_float_x = threading.Condition()
+_users   = 0
+_flags   = {}
+
+#NOTE pymc3 models change theano's flags when they are entered and left, and theano's cache of compiled modules is
+#not thread safe, so the threads build and compile their models one at a time. The draws are sampled concurrently
+_build_lock = threading.Lock()
+
+
+def _check(precision):
+    if(precision not in PRECISIONS):
+        raise ValueError(f"Unknown precision {precision}, expected one of {list(PRECISIONS)}")
+    return precision
+
+
+def set_precision(precision):
+    """
+    Sets the default precision policy of the process
+
+    Parameters
+    -----------
+    precision: String "double" or "single"
+    """
+    global _default
+    _default = _check(precision)
+
+
+def get_precision():
+    """
+    Returns the precision policy in use, i.e., the one activated by `use_precision` or else the default
+    """
+    return getattr(_local, "precision", None) or _default
+
+
+def _acquire(float_x):
+    global _users
+    own = getattr(_local, "users", 0)
+    with _float_x:
+        #NOTE a thread that already uses the flag may change it when no other thread uses it
+        while(_users > own and theano.config.floatX != float_x):
+            _float_x.wait()
+        previous = theano.config.floatX
+        theano.config.floatX = float_x
+        if(_users == 0):
+            _flags["compute_test_value"] = theano.config.compute_test_value
+        _users += 1
+        _local.users = own + 1
+    return previous
+
+
+def _release(previous):
+    global _users
+    with _float_x:
+        #NOTE other threads may have joined with the same dtype, the previous dtype is restored once they are done
+        while(_users > _local.users and theano.config.floatX != previous):
+            _float_x.wait()
+        _users -= 1
+        _local.users -= 1
+        theano.config.floatX = previous
+        if(_users == 0):
+            #NOTE pymc3 models set compute_test_value when they are entered and restore it when they are left, which
+            #the models of concurrent threads do out of order
+            theano.config.compute_test_value = _flags.pop("compute_test_value")
+        _float_x.notify_all()
+
+
+@contextlib.contextmanager
+def use_precision(precision=None, mcmc=False):
+    """
+    Activates a precision policy while building and sampling a model. Theano's floatX is set to the float dtype
+    of the policy, so continuous priors and the constants of the lifted program get that dtype. floatX is process
+    wide: threads whose policies have the same float dtype sample concurrently, a thread whose policy needs another
+    float dtype waits until the other threads are done. The threads build and compile their models one at a time,
+    see `unlocking_callback`
+
+    Parameters
+    -----------
+    precision: String "double" or "single". Default None, i.e., the default precision
+
+    mcmc: Boolean, True if the model is sampled with MCMC. The Metropolis proposals of pymc3 are int64, so only
+    discrete priors sampled with Gibbs steps get compact integer dtypes. Default False
+    """
+    precision = _check(precision or _default)
+    previous = getattr(_local, "precision", None), getattr(_local, "mcmc", False)
+    float_x = _acquire(float_dtype(precision))
+    if(getattr(_local, "depth", 0) == 0):
+        _build_lock.acquire()
+        _local.unlocked = False
+    _local.depth = getattr(_local, "depth", 0) + 1
+    _local.precision, _local.mcmc = precision, mcmc
+    try:
+        yield precision
+    finally:
+        _local.precision, _local.mcmc = previous
+        _local.depth -= 1
+        if(_local.depth == 0 and not _local.unlocked):
+            _build_lock.release()
+        _release(float_x)
+
+
+def _unlock():
+    if(getattr(_local, "depth", 0) > 0 and not _local.unlocked):
+        _local.unlocked = True
+        _build_lock.release()
+
+
+def _lock():
+    if(getattr(_local, "depth", 0) > 0 and _local.unlocked):
+        _build_lock.acquire()
+        _local.unlocked = False
+
+
+@contextlib.contextmanager
+def unlocked():
+    """
+    Lets other threads build and compile their models in a `with` block of a thread that uses a precision policy,
+    e.g. while it waits for chains that are sampled in other processes
+    """
+    _unlock()
+    try:
+        yield
+    finally:
+        _lock()
+
+
+def unlocking_callback(callback=None):
+    """
+    Returns a callback of pm.sample that lets other threads build and compile their models while the draws of a
+    chain are sampled, from its first draw to its last draw. The functions of the chain are compiled before its first
+    draw, and the trace is converted after its last draw
+
+    Parameters
+    -----------
+    callback: function called after every draw, see pm.sample. Default None
+    """
+    def unlocking(trace, draw):
+        #NOTE pm.sample with one core never marks the last draw, the trace knows the number of draws of the chain
+        if(draw.is_last or draw.draw_idx == getattr(trace, "draws", 0) - 1):
+            _lock()
+        elif(draw.draw_idx == 0):
+            _unlock()
+        if(callback is not None):
+            callback(trace, draw)
+    return unlocking
+
+
+def float_dtype(precision=None):
+    """
+    Returns the float dtype of a precision policy. Default None, i.e., the policy in use
+    """
+    return PRECISIONS[_check(precision or get_precision())][0]
+
+
+def is_shared(value):
+    """
+    Returns True if value is a theano shared variable, e.g., a parameter backed by `pm.Data`
+    """
+    return isinstance(value, theano.compile.SharedVariable)
+
+
+def int_dtype(values=None, precision=None, gibbs=False):
+    """
+    Returns the integer dtype of a discrete prior
+
+    Parameters
+    -----------
+    values: array with the finite support of the prior, or None if it is not finite
+
+    precision: String with the precision policy. Default None, i.e., the policy in use
+
+    gibbs: Boolean, True if pymc3 samples the prior with a Gibbs step, which keeps its dtype. Default False
+    """
+    compact = PRECISIONS[_check(precision or get_precision())][1] and (gibbs or not getattr(_local, "mcmc", False))
+    if(compact and values is not None):
+        values = np.asarray(values)
+        info = np.iinfo(COMPACT_INT)
+        if(np.all(np.mod(values, 1) == 0) and values.min() >= info.min and values.max() <= info.max):
+            return COMPACT_INT
+    return "int64"
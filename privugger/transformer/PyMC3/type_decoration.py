@@ -4,7 +4,7 @@ import sys
 import inspect
 import os
 import privugger.transformer.PyMC3.annotation_types as at
-from privugger.transformer.PyMC3.theano_types import TheanoToken
+from privugger.transformer.PyMC3.theano_types import TheanoToken, float_dtype
 
 
 class FunctionTypeDecorator(ast.NodeTransformer):
@@ -17,8 +17,9 @@ class FunctionTypeDecorator(ast.NodeTransformer):
 
  
 
-    def __init__(self, name=None):
+    def __init__(self, name=None, precision=None):
         self.function_name = name
+        self.precision = precision
 
     
     def get_function_def_ast(self, tree):
@@ -38,6 +39,10 @@ class FunctionTypeDecorator(ast.NodeTransformer):
 
     def simple_method_wrap(self, program, name, args):
         
+        #NOTE the decorated program is kept at module level, so the theano op is built once when the module is loaded
+        if(name == 'method'):
+            name = program.name = 'lifted_method'
+
         arg_identifiers = []
         for a in args.args:
             arg_identifiers.append(a.arg)
@@ -45,24 +50,22 @@ class FunctionTypeDecorator(ast.NodeTransformer):
         #func_returns = self.get_function_return(program.body)
         returns = ast.Return(value=ast.Call(args=[ast.arguments(args=arg_identifiers, defaults=[], vararg=None, kwarg=None)],func=ast.Name(id=name, ctx=ast.Load()), keywords=[]))
         
-        new_function = ast.Module(body=[ast.FunctionDef(name='method', decorator_list=[], args=args, body=[program, returns])])
+        new_function = ast.Module(body=[program, ast.FunctionDef(name='method', decorator_list=[], args=args, body=[returns])])
         return new_function
         #print(astor.to_source(new_function))
         #print(ast.dump(new_function))
 
-    def lift(self, program, decorators):
+    def parse_program(self, program):
         """
-        This funtion provides another path to program lifting, when the decoration types are given directly. 
-        The function lifts the program to be used within a pymc3 model.
+        Parses the program into a Python AST, without lifting it
          
         Parameters
         ------------
-        program: path to program or a string of the entire program
-        decorators: list of the decorator types
+        program: path to program, a lambda or a function
 
         Return
         -----------
-        Python AST node with the lifted program
+        Python AST module node with the program
         
         """
 
@@ -103,15 +106,29 @@ class FunctionTypeDecorator(ast.NodeTransformer):
             elif("def" != res[:3]):
                 raise TypeError("The program needs to be a path to a file, a lambda or a function")
 
-            with open("temp.py", "w") as file:
-                file.write(res)
-            tree = ast.parse(open("temp.py").read())
+            tree = ast.parse(res)
 
-            os.remove("temp.py")
-        
-        #if("lambda")
-        
+        return tree
+
+    def lift(self, program, decorators):
+        """
+        This funtion provides another path to program lifting, when the decoration types are given directly. 
+        The function lifts the program to be used within a pymc3 model.
+         
+        Parameters
+        ------------
+        program: path to program, a lambda or a function. It may also be an AST already returned by `parse_program`
+        decorators: list of the decorator types
+
+        Return
+        -----------
+        Python AST node with the lifted program
         
+        """
+        if(isinstance(program, ast.Module)):
+            tree = program
+        else:
+            tree = self.parse_program(program)
         
         function_def = self.get_function_def_ast(tree.body)
 
@@ -138,11 +155,13 @@ class FunctionTypeDecorator(ast.NodeTransformer):
         p_type: string
 
         Return:
-        string with name of theano tensor type
+        string with name of theano tensor type. Float types have the float dtype of the precision policy,
+        int types are int64
         
         """
+        single = float_dtype(self.precision) == 'float32'
         if (p_type == 'float'):
-            return 'dscalar'
+            return 'fscalar' if single else 'dscalar'
         
         elif(p_type == 'int'):
             return 'lscalar'
@@ -151,19 +170,16 @@ class FunctionTypeDecorator(ast.NodeTransformer):
             return 'lvector'
         
         elif(p_type == 'VectorF'):
-            return 'dvector'
+            return 'fvector' if single else 'dvector'
 
         elif(p_type == 'MatrixI'):
             return 'lmatrix'
 
-        elif(p_type== 'MatrixF'):
-            return 'fmatrix'
-
-        elif(p_type=='MatrixD'):
-            return 'dmatrix'
+        elif(p_type== 'MatrixF' or p_type=='MatrixD'):
+            return 'fmatrix' if single else 'dmatrix'
 
         elif(p_type=='Single_element_VectorF'):
-            return 'TensorType(\'float64\', (True,))'
+            return f'TensorType(\'{float_dtype(self.precision)}\', (True,))'
 
         elif(p_type=='Single_element_VectorI'):
             return 'TensorType(\'int64\', (True,))'
@@ -269,6 +285,10 @@ class FunctionTypeDecorator(ast.NodeTransformer):
         if(return_list is not None):
             for r in return_list:
                 wrapped_return_body = self.wrap_output_type(r[0].value, otype)
+                if(otype in ('float', 'VectorF', 'MatrixF', 'MatrixD', 'Single_element_VectorF')):
+                    #NOTE theano does not cast the outputs of an op, so they must have the dtype of its otype
+                    wrapped_return_body = ast.Return(ast.Call(func=ast.Attribute(value=ast.Name(id='np', ctx=ast.Load()), attr='asarray', ctx=ast.Load()),
+                                                              args=[wrapped_return_body.value], keywords=[ast.keyword(arg='dtype', value=ast.Constant(value=float_dtype(self.precision)))]))
                 node.body[r[1]] = wrapped_return_body
         node.decorator_list = theano_decorator_list
         return node 
@@ -1 +1,3 @@
-from privugger.transformer.PyMC3 import *
+from privugger.lazy import lazy_exports
+
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {}, fallback=["privugger.transformer.PyMC3"])
@@ -28,4 +28,7 @@ setup(
     url='https://github.com/itu-square/privugger',
     #package_dir={"": "privugger"},
     packages=find_packages(),
+    entry_points={
+        "console_scripts": ["privugger-warmup=privugger.inference.warmup:main"],
+    },
 )